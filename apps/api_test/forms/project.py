@@ -73,6 +73,7 @@ class AddProjectForm(BaseForm):
     business_id: int = Field(..., title="业务线")
     swagger: Optional[Union[str, None]] = Field(None, title="swagger地址")
     script_list: Optional[list[int]] = Field([], title="脚本文件")
+    keep_alive: Optional[int] = Field(1, title="执行测试时是否复用连接")
 
     @field_validator("swagger")
     def validate_swagger(cls, value):
@@ -112,6 +113,8 @@ class EditEnv(GetEnvForm):
     host: str = required_str_field(title='域名')
     variables: List[ValidateModel] = Field(title="变量")
     headers: List[HeaderModel] = Field(title="头部信息")
+    rate_limit: Optional[dict] = Field(
+        {}, title="限流", description="执行时对此域名发请求的限流，rate：每秒请求数，burst：突发请求数，max_in_flight：同时在途的请求数，0为不限制")
 
     @field_validator('id')
     def validate_id(cls, value):
@@ -129,6 +132,14 @@ class EditEnv(GetEnvForm):
             raise ValueError(f"环境地址【{value}】不可访问，请确认")
         return value
 
+    @field_validator('rate_limit')
+    def validate_rate_limit(cls, value):
+        for key in ["rate", "burst", "max_in_flight"]:
+            if key in (value or {}):
+                cls.validate_is_true(
+                    isinstance(value[key], (int, float)) and value[key] >= 0, f'限流的【{key}】必须为不小于0的数字')
+        return value
+
     def depends_validate(self):
         self.validate_project_id()
         self.validate_variables()
@@ -54,6 +54,21 @@ class GetReportForm(BaseForm):
         return value
 
 
+class RerunReportForm(BaseForm):
+    """ 重跑报告中不通过的用例 """
+    id: int = Field(..., title="报告id")
+    is_async: int = Field(default=0, title="执行模式", description="0：用例维度串行执行，1：用例维度并行执行")
+
+    @field_validator("id")
+    def validate_id(cls, value):
+        report = cls.validate_data_is_exist("报告不存在", Report, id=value)
+        cls.validate_is_true(report.process == 3 and report.status == 2, "报告还没执行完毕，不能重跑")
+        not_passed_list = ReportCase.get_not_passed_case_list(value)
+        cls.validate_is_true(not_passed_list, "报告中没有不通过的用例")
+        setattr(cls, "report", report)
+        return value
+
+
 class DeleteReportForm(BaseForm):
     """ 删除报告 """
     id_list: List[int] = required_str_field(title="报告id list")
@@ -113,6 +128,11 @@ class GetReportStepForm(BaseForm):
         setattr(self, "report_step", report_step)
 
 
+class GetReportEventForm(BaseForm):
+    """ 订阅测试报告执行状态的变化 """
+    report_id: int = Field(..., title="报告id")
+
+
 class GetReportShowIdForm(BaseForm):
     """ 获取报告状态 """
     batch_id: str = required_str_field(title="执行批次id")
@@ -3,7 +3,7 @@ from typing import Optional, Union, List
 from pydantic import Field, field_validator
 
 from ...base_form import BaseForm, PaginationForm, required_str_field
-from ..model_factory import ApiTask as Task
+from ..model_factory import ApiTask as Task, ApiCase as Case, ApiCaseSuite as CaseSuite
 from ...enums import ReceiveTypeEnum, SendReportTypeEnum, TriggerTypeEnum, DataStatusEnum
 
 
@@ -61,11 +61,35 @@ class AddTaskForm(BaseForm):
     is_async: int = Field(default=0, title="任务的运行机制", description="0：串行，1：并行，默认0")
     call_back: Optional[Union[list, dict]] = Field(title="回调给流水线")
     push_hit: int = Field(title="任务不通过时，是否自动记录问题", description="任务不通过时，是否自动记录，0：不记录，1：记录，默认1")
+    smoke_case_ids: Optional[list] = Field(
+        [], title="冒烟用例id", description="按接口变更影响范围选择用例执行时，这些用例始终执行，需在任务的用例范围内")
+    run_policy: Optional[dict] = Field(
+        {}, title="执行策略", description="满足条件时不再执行剩下的用例，max_fail：不通过的用例数上限；"
+                                          "fail_rate、fail_rate_window：最近多少条用例中不通过的比例上限；health_check：用例不通过时是否探测运行环境")
 
     def depends_validate(self):
         self.validate_cron()
+        self.validate_run_policy()
+        self.validate_smoke_case_ids()
         self.validate_is_send()
 
+    def validate_smoke_case_ids(self):
+        """ 冒烟用例需在任务的用例范围内：选中的用例、选中的用例集下的用例，都没选则为服务下所有用例集的用例 """
+        if not self.smoke_case_ids:
+            return
+        suite_id_set = set(self.suite_ids or [])
+        if not self.suite_ids and not self.case_ids:
+            suite_id_set = {suite[0] for suite in CaseSuite.db.session.query(CaseSuite.id).filter(
+                CaseSuite.project_id == self.project_id, CaseSuite.suite_type.in_(['api', 'process'])).all()}
+        case_id_set = set(self.case_ids or [])
+        in_scope_id_set = {
+            case_id for case_id, suite_id in Case.db.session.query(Case.id, Case.suite_id).filter(
+                Case.id.in_(self.smoke_case_ids)).all()
+            if case_id in case_id_set or suite_id in suite_id_set
+        }
+        not_in_scope_list = [case_id for case_id in self.smoke_case_ids if case_id not in in_scope_id_set]
+        self.validate_is_true(not not_in_scope_list, f'冒烟用例{not_in_scope_list}不在任务的用例范围内')
+
 
 class EditTaskForm(AddTaskForm, GetTaskForm):
     """ 编辑任务 """
@@ -73,6 +97,8 @@ class EditTaskForm(AddTaskForm, GetTaskForm):
     def depends_validate(self):
         """ 启用中 且 cron表达式有更改的，需要更新内存中的任务"""
         self.validate_cron()
+        self.validate_run_policy()
+        self.validate_smoke_case_ids()
         self.validate_is_send()
         old_task = getattr(self, 'task')
         setattr(self.task, 'update_to_memory', old_task.status == 1 and self.cron != old_task.cron)
@@ -87,6 +113,16 @@ class RunTaskForm(BaseForm):
         TriggerTypeEnum.page, title="触发类型", description="pipeline/page/cron")  # pipeline 跑完过后会发送测试报告
     extend: Optional[Union[list, dict, str]] = Field(
         None, title="扩展字段", description="运维传过来的扩展字段，接收的什么就返回什么")
+    select_mode: Optional[str] = Field(
+        "all", title="用例选择方式",
+        description="all：执行任务的所有用例，impact：只执行受接口变更影响的用例（含逐层引用了这些用例的用例）和冒烟用例")
+    change_api_list: Optional[List[int]] = Field(
+        None, title="变更的接口id", description="select_mode为impact时使用，不传则取服务最近一次swagger拉取时新增、修改了的接口")
+
+    @field_validator("select_mode")
+    def validate_select_mode(cls, value):
+        cls.validate_is_true(value in ("all", "impact"), "用例选择方式只能为 all、impact")
+        return value
 
     @field_validator("id_list")
     def validate_id(cls, value):
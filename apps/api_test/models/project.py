@@ -14,6 +14,8 @@ class ApiProject(BaseProject):
     swagger: Mapped[str] = mapped_column(String(255), nullable=True, comment="服务对应的swagger地址")
     last_pull_status: Mapped[int] = mapped_column(
         Integer(), default=1, comment="最近一次swagger拉取状态，0拉取失败，1未拉取，2拉取成功")
+    keep_alive: Mapped[int] = mapped_column(
+        Integer(), default=1, nullable=True, comment="执行测试时是否复用连接（keep-alive），1复用，0每个请求都新建连接")
 
     def last_pull_is_fail(self):
         """ 最近一次从swagger拉取失败 """
@@ -2,6 +2,7 @@
 from sqlalchemy import Integer, JSON, Text, Boolean
 from sqlalchemy.orm import Mapped, mapped_column
 
+from apps.enums import DataStatusEnum
 from apps.base_model import BaseStep, HeadersFiled, ParamsFiled, DataFormFiled, DataUrlencodedFiled, DataJsonFiled, \
     ExtractsFiled, ValidatesFiled, BodyTypeFiled
 
@@ -23,3 +24,16 @@ class ApiStep(
     pop_header_filed: Mapped[list] = mapped_column(JSON, default=[], comment="头部参数中去除指定字段")
     api_id: Mapped[int] = mapped_column(Integer(), nullable=True, comment="步骤所引用的接口的id")
     allow_redirect: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False, comment="是否允许重定向")
+
+    @classmethod
+    def get_impact_case_id_set(cls, api_id_list):
+        """ 受接口变更影响的用例id：步骤引用了这些接口的用例，以及逐层引用了这些用例的用例 """
+        case_id_set = {row[0] for row in cls.db.session.query(cls.case_id).filter(
+            cls.api_id.in_(api_id_list), cls.status == DataStatusEnum.ENABLE.value).all()}
+        to_check_case_id_set = set(case_id_set)
+        while to_check_case_id_set:
+            quote_case_id_set = {row[0] for row in cls.db.session.query(cls.case_id).filter(
+                cls.quote_case.in_(to_check_case_id_set), cls.status == DataStatusEnum.ENABLE.value).all()}
+            to_check_case_id_set = quote_case_id_set - case_id_set
+            case_id_set.update(to_check_case_id_set)
+        return case_id_set
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+from sqlalchemy import JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
 from apps.base_model import BaseTask
 
 
@@ -7,3 +10,6 @@ class ApiTask(BaseTask):
     __abstract__ = False
     __tablename__ = "api_test_task"
     __table_args__ = {"comment": "接口测试任务表"}
+
+    smoke_case_ids: Mapped[list] = mapped_column(
+        JSON, default=[], nullable=True, comment="冒烟用例id，按接口变更影响范围选择用例执行时，这些用例始终执行")
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
-from flask import current_app as app
+from flask import current_app as app, request
 
 from utils.client.parse_model import StepModel
+from utils.util.report_event_util import ReportEventUtil
 from ..blueprint import api_test
 from ..model_factory import ApiReport as Report, ApiReportStep as ReportStep, ApiReportCase as ReportCase, \
     ApiMsg, ApiCaseSuite as CaseSuite, ApiCase as Case, ApiStep as Step
 from ..forms.report import GetReportForm, GetReportListForm, DeleteReportForm, GetReportCaseForm, \
     GetReportCaseListForm, GetReportStepForm, GetReportStepListForm, GetReportStatusForm, GetReportShowIdForm, \
-    GetReportCaseSuiteListForm, ChangeReportStepStatus
+    GetReportEventForm, GetReportCaseSuiteListForm, ChangeReportStepStatus, RerunReportForm
+from ...system.model_factory import RunQueue
+from ...busines import RunCaseBusiness
+from utils.client.run_api_test import RunCase
 from ...enums import ApiCaseSuiteTypeEnum
 
 
@@ -32,6 +36,13 @@ def api_get_report_status():
         Report.select_is_all_status_by_batch_id(form.batch_id, [form.process, form.status]))
 
 
+@api_test.get("/report/events")
+def api_get_report_events():
+    """ 订阅测试报告的执行状态变化（SSE），只推送有变化的部分，代替轮询 /report/status、/report/step-list """
+    form = GetReportEventForm()
+    return ReportEventUtil.make_sse_response(Report.__tablename__, form.report_id, request.headers.get("Last-Event-ID"))
+
+
 @api_test.get("/report/show-id")
 def api_get_report_show_id():
     """ 根据运行id获取当次要打开的报告 """
@@ -53,9 +64,35 @@ def api_save_report_as_case():
 
 @api_test.get("/report")
 def api_get_report():
-    """ 获取测试报告 """
+    """ 获取测试报告，排队中的报告会返回在执行队列中的排队信息 """
     form = GetReportForm()
-    return app.restful.get_success(form.report.to_dict())
+    report = form.report.to_dict()
+    if report["process"] == 0:
+        report["queue"] = RunQueue.get_queue_info("api", report["id"])
+    return app.restful.get_success(report)
+
+
+@api_test.login_post("/report/rerun")
+def api_rerun_report():
+    """ 重跑报告中不通过的用例，结果写入新的报告，报告统计合并被重跑报告中通过的用例 """
+    form = RerunReportForm()
+    report = form.report
+    batch_id = Report.get_batch_id()
+    report_id = RunCaseBusiness.run(
+        project_id=report.project_id,
+        batch_id=batch_id,
+        report_name=f'{report.name}_重跑'[:128],
+        report_model=Report,
+        env_code=report.env,
+        is_async=form.is_async,
+        temp_variables=report.temp_variables or {},
+        task_type=report.run_type,
+        case_id_list=[],
+        trigger_id=report.trigger_id,
+        runner=RunCase,
+        parent_id=report.id
+    )
+    return app.restful.trigger_success({"batch_id": batch_id, "report_id": report_id})
 
 
 @api_test.login_delete("/report")
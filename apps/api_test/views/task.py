@@ -3,11 +3,10 @@ from flask import current_app as app
 
 from ..blueprint import api_test
 from ...base_form import ChangeSortForm
-from ...busines import RunCaseBusiness
-from ..model_factory import ApiReport as Report, ApiCase as Case, ApiCaseSuite as CaseSuite, ApiTask as Task
+from ...busines import RunTaskBusiness
+from ..model_factory import ApiTask as Task
 from ..forms.task import RunTaskForm, AddTaskForm, EditTaskForm, GetTaskForm, DeleteTaskForm, \
     GetTaskListForm
-from utils.client.run_api_test import RunCase
 from ...config.models.config import Config
 from ...system.models.user import User
 
@@ -100,28 +99,4 @@ def api_disable_task():
 def api_run_task():
     """ 运行定时任务 """
     form = RunTaskForm()
-    for task in form.task_list:
-        case_id_list = CaseSuite.get_case_id(Case, task.project_id, task.suite_ids, task.case_ids)
-        batch_id = Report.get_batch_id()
-        env_list = form.env_list or task.env_list
-        for env_code in env_list:
-            report_id = RunCaseBusiness.run(
-                project_id=task.project_id,
-                batch_id=batch_id,
-                report_name=task.name,
-                report_model=Report,
-                env_code=env_code,
-                trigger_type=form.trigger_type,
-                is_async=form.is_async,
-                task_type="task",
-                trigger_id=[task.id],
-                case_id_list=case_id_list,
-                run_type="api",
-                runner=RunCase,
-                task_dict=task.to_dict(),
-                extend_data=form.extend
-            )
-    return app.restful.trigger_success({
-        "batch_id": batch_id,
-        "report_id": report_id if len(env_list) == 1 else None
-    })
+    return app.restful.trigger_success(RunTaskBusiness.run("api", form))
@@ -109,6 +109,11 @@ class GetReportStepForm(BaseForm):
         return value
 
 
+class GetReportEventForm(BaseForm):
+    """ 订阅测试报告执行状态的变化 """
+    report_id: int = Field(..., title="报告id")
+
+
 class GetReportShowIdForm(BaseForm):
     """ 获取报告状态 """
     batch_id: str = required_str_field(title="执行批次id")
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
-from flask import current_app as app
+from flask import current_app as app, request
 
 from ..blueprint import app_test
 from ..model_factory import AppUiReport as Report, AppUiReportStep as ReportStep, AppUiReportCase as ReportCase, \
     AppUiCaseSuite as CaseSuite
 from ..forms.report import GetReportForm, GetReportListForm, DeleteReportForm, GetReportCaseForm, \
     GetReportCaseListForm, GetReportStepForm, GetReportStepListForm, GetReportStatusForm, GetReportShowIdForm, \
-    GetReportStepImgForm, GetReportCaseSuiteListForm, ChangeReportStepStatus
+    GetReportEventForm, GetReportStepImgForm, GetReportCaseSuiteListForm, ChangeReportStepStatus
+from ...system.model_factory import RunQueue
 from utils.util.file_util import FileUtil
+from utils.util.report_event_util import ReportEventUtil
 
 
 @app_test.login_get("/report/list")
@@ -31,6 +33,13 @@ def app_get_report_status():
         Report.select_is_all_status_by_batch_id(form.batch_id, [form.process, form.status]))
 
 
+@app_test.get("/report/events")
+def app_get_report_events():
+    """ 订阅测试报告的执行状态变化（SSE），只推送有变化的部分，代替轮询 /report/status、/report/step-list """
+    form = GetReportEventForm()
+    return ReportEventUtil.make_sse_response(Report.__tablename__, form.report_id, request.headers.get("Last-Event-ID"))
+
+
 @app_test.get("/report/show-id")
 def app_get_report_show_id():
     """ 根据运行id获取当次要打开的报告 """
@@ -40,9 +49,12 @@ def app_get_report_show_id():
 
 @app_test.get("/report")
 def app_get_report():
-    """ 获取测试报告 """
+    """ 获取测试报告，排队中的报告会返回在执行队列中的排队信息 """
     form = GetReportForm()
-    return app.restful.get_success(form.report.to_dict())
+    report = form.report.to_dict()
+    if report["process"] == 0:
+        report["queue"] = RunQueue.get_queue_info("app", report["id"])
+    return app.restful.get_success(report)
 
 
 @app_test.login_delete("/report")
@@ -3,11 +3,10 @@ from flask import current_app as app
 
 from ..blueprint import app_test
 from ...base_form import ChangeSortForm
-from ...busines import RunCaseBusiness
-from ..model_factory import AppUiReport as Report, AppUiCase as Case, AppUiCaseSuite as CaseSuite, AppUiTask as Task
+from ...busines import RunTaskBusiness
+from ..model_factory import AppUiTask as Task
 from ..forms.task import RunTaskForm, AddTaskForm, EditTaskForm, GetTaskForm, DeleteTaskForm, \
     GetTaskListForm
-from utils.client.run_ui_test import RunCase
 from ...config.models.config import Config
 from ...system.models.user import User
 
@@ -100,26 +99,4 @@ def app_disable_task():
 def app_run_task():
     """ 单次运行定时任务 """
     form = RunTaskForm()
-    for task in form.task_list:
-        form.env_list = form.env_list or task.env_list
-        case_id_list = CaseSuite.get_case_id(Case, task.project_id, task.suite_ids, task.case_ids)
-        appium_config = RunCaseBusiness.get_appium_config(task.project_id, task.conf["server"], task.conf["phone"], task.conf["no_reset"])
-        batch_id = Report.get_batch_id()
-        report_id = RunCaseBusiness.run(
-            project_id=task.project_id,
-            batch_id=batch_id,
-            report_name=task.name,
-            report_model=Report,
-            env_code=form.env_list[0],
-            trigger_type=form.trigger_type,
-            is_async=form.is_async,
-            task_type="task",
-            trigger_id=[task.id],
-            case_id_list=case_id_list,
-            run_type="app",
-            runner=RunCase,
-            extend_data=form.extend,
-            task_dict=task.to_dict(),
-            appium_config=appium_config
-        )
-    return app.restful.trigger_success({"batch_id": batch_id, "report_id": report_id})
+    return app.restful.trigger_success(RunTaskBusiness.run("app", form))
@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
-import importlib
+import sys
 import types
+from threading import Lock
 
-from sqlalchemy import Text, String, JSON
+from sqlalchemy import Text, String, JSON, func
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.dialects.mysql import LONGTEXT
 
-from apps.base_model import BaseModel, NumFiled
+from apps.base_model import BaseModel, NumFiled, DataVersionFiled
 from ...config.model_factory import RunEnv
 from utils.util.file_util import FileUtil
 
 
-class Script(NumFiled):
+class Script(NumFiled, DataVersionFiled):
     """ python脚本 """
     __tablename__ = "python_script"
     __table_args__ = {"comment": "python脚本"}
@@ -23,9 +24,15 @@ class Script(NumFiled):
         String(16), index=True, default="test",
         comment="脚本类型，test：执行测试、mock：mock脚本、encryption：加密、decryption：解密")
 
+    # 脚本的进程内缓存，同一个进程的所有执行共用
+    _script_state_dict = {}  # 数据库中脚本的最新状态 {(env, script_id): (name, md5)}，执行 create_script_file 时刷新
+    _script_file_dict = {}  # 已写入磁盘的脚本文件 {"test_demo": (md5, 文件修改时间)}
+    _script_module_dict = {}  # 已编译的脚本 {(env, script_id): (name, md5, module, 函数字典)}
+    _script_lock = Lock()
+
     @classmethod
     def create_script_file(cls, env_code=None, not_create_list=[]):
-        """ 创建所有自定义函数 py 文件，默认在第一行加上运行环境
+        """ 创建所有自定义函数 py 文件，默认在第一行加上运行环境，只查内容的md5，内容有变化的脚本才重新写入
         示例：
             # coding:utf-8
 
@@ -34,9 +41,66 @@ class Script(NumFiled):
             脚本内容
         """
         env = env_code or RunEnv.get_first().code
-        for script in cls.get_all():
-            if script.name not in not_create_list:
-                FileUtil.save_script_data(f"{env}_{script.name}", script.script_data, env)
+        changed_dict = {}
+        for script_id, name, md5 in cls.db.session.query(cls.id, cls.name, func.md5(cls.script_data)).all():
+            cls._script_state_dict[(env, script_id)] = (name, md5)
+            file_name = f"{env}_{name}"
+            if name not in not_create_list and \
+                    cls._script_file_dict.get(file_name) != (md5, FileUtil.get_script_mtime(file_name)):
+                changed_dict[script_id] = md5
+
+        if changed_dict:
+            for script in cls.query.filter(cls.id.in_(list(changed_dict))).all():
+                file_name = f"{env}_{script.name}"
+                FileUtil.save_script_data(file_name, script.script_data, env)
+                cls._script_file_dict[file_name] = (changed_dict[script.id], FileUtil.get_script_mtime(file_name))
+
+    @classmethod
+    def get_script_module(cls, script_id, env_code):
+        """ 获取脚本编译后的模块，同一个脚本、同一个环境、同样的内容只编译一次，所有执行共用 """
+        key = (env_code, script_id)
+        with cls._script_lock:
+            if key not in cls._script_state_dict:
+                script_state = cls.db.session.query(cls.name, func.md5(cls.script_data)).filter(cls.id == script_id).first()
+                if script_state is None:  # 脚本已被删除
+                    return
+                cls._script_state_dict[key] = tuple(script_state)
+            name, md5 = cls._script_state_dict[key]
+
+            script_module = cls._script_module_dict.get(key)
+            if script_module is None or script_module[:2] != (name, md5):
+                script_data = cls.db.session.query(cls.script_data).filter(cls.id == script_id).scalar()
+                module = cls.compile_script_module(f"{env_code}_{name}", script_data, env_code)
+                functions = {
+                    func_name: item for func_name, item in vars(module).items() if isinstance(item, types.FunctionType)
+                }
+                script_module = cls._script_module_dict[key] = (name, md5, module, functions)
+            return script_module
+
+    @classmethod
+    def compile_script_module(cls, file_name, script_data, env_code):
+        """ 在内存中把脚本内容编译为模块，并注册到 sys.modules，脚本之间依旧可以互相导入 """
+        module_name = f"script_list.{file_name}"
+        module = types.ModuleType(module_name)
+        module.__file__, module.__package__ = FileUtil.get_script_path(file_name), "script_list"
+        exec(compile(FileUtil.build_script_data(script_data, env_code), module.__file__, "exec"), module.__dict__)
+        sys.modules[module_name] = module
+        return module
+
+    @classmethod
+    def get_script_functions(cls, script_id, env_code):
+        """ 获取脚本中的函数 {"函数名": 函数} """
+        script_module = cls.get_script_module(script_id, env_code)
+        return script_module[3] if script_module else {}
+
+    @classmethod
+    def clear_script_cache(cls, script_id):
+        """ 脚本修改、删除后，清除脚本在所有环境的缓存 """
+        with cls._script_lock:
+            for key in [key for key in cls._script_state_dict if key[1] == script_id]:
+                cls._script_state_dict.pop(key, None)
+            for key in [key for key in cls._script_module_dict if key[1] == script_id]:
+                cls._script_module_dict.pop(key, None)
 
     @classmethod
     def get_func_by_script_id(cls, script_id_list: list, env_id=None):
@@ -45,12 +109,8 @@ class Script(NumFiled):
         cls.create_script_file(env_code)  # 创建所有函数文件
 
         func_dict = {}
-        script_name_list = cls.query.with_entities(cls.name).filter(cls.id.in_(script_id_list)).all()
-        for script_name in script_name_list:
-            func_list = importlib.reload(importlib.import_module(f"script_list.{env_code}_{script_name[0]}"))
-            func_dict.update({
-                name: item for name, item in vars(func_list).items() if isinstance(item, types.FunctionType)
-            })
+        for script_id in script_id_list:
+            func_dict.update(cls.get_script_functions(script_id, env_code))
         return func_dict
 
 
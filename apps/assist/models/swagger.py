@@ -15,6 +15,8 @@ class SwaggerPullLog(BaseModel):
     project_id: Mapped[int] = mapped_column(Integer(), comment="服务id")
     desc: Mapped[str] = mapped_column(Text(), nullable=True, comment="备注")
     pull_args: Mapped[dict] = mapped_column(JSON, default=[], nullable=True, comment="拉取时指定的参数")
+    change_api_list: Mapped[list] = mapped_column(
+        JSON, default=[], nullable=True, comment="此次拉取新增、修改了的接口id，用于按变更影响范围选择用例执行")
 
     def pull_fail(self, project, desc=None):
         """ 拉取失败 """
@@ -25,3 +27,9 @@ class SwaggerPullLog(BaseModel):
         """ 拉取成功 """
         self.model_update({"status": 2})
         project.last_pull_is_success()
+
+    @classmethod
+    def get_last_change_api_list(cls, project_id):
+        """ 服务最近一次拉取成功时新增、修改了的接口id """
+        pull_log = cls.query.filter(cls.project_id == project_id, cls.status == 2).order_by(cls.id.desc()).first()
+        return (pull_log.change_api_list or []) if pull_log else []
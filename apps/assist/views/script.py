@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
-import importlib
 import sys
-import types
 import traceback
 
 from flask import current_app as app
@@ -47,18 +45,14 @@ def assist_copy_script():
 def assist_debug_script():
     """ 函数调试 """
     form = DebuggerScriptForm()
-    name, expression = f'{form.env}_{form.script.name}', form.expression
+    expression = form.expression
 
     # 把自定义函数脚本内容写入到python脚本中
     Script.create_script_file(form.env)
 
     # 动态导入脚本
     try:
-        import_path = f'script_list.{name}'
-        func_list = importlib.reload(importlib.import_module(import_path))
-        module_functions_dict = {
-            name: item for name, item in vars(func_list).items() if isinstance(item, types.FunctionType)
-        }
+        module_functions_dict = Script.get_script_functions(form.script.id, form.env)
         ext_func = extract_functions(expression)
         func = parse_function(ext_func[0])
 
@@ -106,6 +100,7 @@ def assist_change_script():
     """ 修改脚本文件 """
     form = EditScriptForm()
     form.script.model_update(form.model_dump())
+    Script.clear_script_cache(form.script.id)
     return app.restful.change_success()
 
 
@@ -113,6 +108,7 @@ def assist_change_script():
 def assist_delete_script():
     """ 删除脚本文件 """
     form = DeleteScriptForm()
+    Script.clear_script_cache(form.script.id)
     form.script.delete()
     return app.restful.delete_success()
 
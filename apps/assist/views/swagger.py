@@ -387,7 +387,7 @@ def assist_pull_by_swagger():
 
     with ApiMsg.db.auto_commit():
 
-        add_list = []
+        add_list, change_api_list = [], []
         for api_addr, api_data in swagger_data["paths"].items():
             for api_method, swagger_api in api_data.items():
                 # 处理模块
@@ -440,6 +440,9 @@ def assist_pull_by_swagger():
                 else:
                     if 'api_name' in options:  # 用户选择了要更新接口名字
                         db_api.name = swagger_api.get("summary", "接口未命名")
+                    # 下一个接口查询时会自动flush，所以在这里判断数据有没有变化
+                    if ApiMsg.db.session.is_modified(db_api):
+                        change_api_list.append(db_api.id)
 
         ApiMsg.db.session.add_all(add_list)
 
@@ -448,6 +451,8 @@ def assist_pull_by_swagger():
         FileUtil.delete_file(swagger_file)
         FileUtil.save_file(swagger_file, swagger_data)
 
+    # 记录此次新增、修改了的接口，用于按变更影响范围选择用例执行
+    pull_log.model_update({"change_api_list": change_api_list + [api.id for api in add_list]})
     return app.restful.success("数据拉取并更新完成")
 
 
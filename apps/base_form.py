@@ -138,10 +138,12 @@ class BaseForm(pydanticBaseModel, JsonUtil):
     def __getattr__(self, item):
         return self.__dict__.get(item, None)
 
-    def __init__(self):
-        """ 实例化的时候获取所有参数一起传给BaseForm，pydantic会在实例化的时候自动进行数据校验 """
+    def __init__(self, **kwargs):
+        """ 实例化的时候获取所有参数一起传给BaseForm，pydantic会在实例化的时候自动进行数据校验
+        传了kwargs则直接用kwargs校验，用于不经过http请求的调用，如定时任务在进程内直接触发执行
+        """
         g.current_from = self  # 初始胡的时候把form放g上，方便在处理异常的时候获取字段title，提示用户
-        request_data = request.get_json(silent=True) or request.form.to_dict() or request.args.to_dict()
+        request_data = kwargs or request.get_json(silent=True) or request.form.to_dict() or request.args.to_dict()
         super(BaseForm, self).__init__(**request_data)
 
         self.depends_validate()  # 自动执行有依赖关系的数据验证
@@ -389,6 +391,18 @@ class BaseForm(pydanticBaseModel, JsonUtil):
         except Exception as error:
             raise ValueError(f"时间配置cron格式【{self.cron}】错误，请检查")
 
+    def validate_run_policy(self):
+        """ 校验执行策略，不通过的用例数、比例为0则不限制 """
+        run_policy = self.run_policy or {}
+        for key in ["max_fail", "fail_rate_window", "health_check", "health_check_interval"]:
+            if key in run_policy:
+                self.validate_is_true(
+                    isinstance(run_policy[key], int) and run_policy[key] >= 0, f'执行策略的【{key}】必须为不小于0的整数')
+        if "fail_rate" in run_policy:
+            self.validate_is_true(
+                isinstance(run_policy["fail_rate"], (int, float)) and 0 <= run_policy["fail_rate"] <= 1,
+                '执行策略的【fail_rate】必须为0-1之间的数字')
+
     def validate_is_send(self):
         """ 发送报告相关校验, 发送报告类型 1.不发送、2.始终发送、3.仅用例不通过时发送 """
         if self.is_send in [SendReportTypeEnum.always.value, SendReportTypeEnum.on_fail.value]:
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import copy
 import os
 import time
@@ -8,10 +9,11 @@ from email.policy import default
 from typing import Union
 
 import requests
-from flask import g, request
+from flask import g, request, current_app
 from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
 from flask_sqlalchemy.query import Query as BaseQuery
-from sqlalchemy import MetaData, or_, text, Integer, String, DateTime, JSON, Text
+from sqlalchemy import MetaData, or_, text, func, insert, select, update, literal_column, Integer, String, DateTime, \
+    JSON, Text
 from sqlalchemy.orm import Mapped, mapped_column
 from werkzeug.security import generate_password_hash
 
@@ -21,6 +23,7 @@ from config import _main_server_host, ui_suite_list, api_suite_list, _job_server
 from utils.make_data.make_xmind import get_xmind_first_sheet_data
 from utils.util.file_util import TEMP_FILE_ADDRESS
 from utils.util.json_util import JsonUtil
+from utils.util.report_event_util import ReportEventUtil
 from utils.parse.parse import parse_list_to_dict, update_dict_to_list, parse_dict_to_list
 
 
@@ -100,26 +103,45 @@ class BaseModel(db.Model, JsonUtil):
         return [data[0] for data in cls.query.with_entities(cls.id).filter_by(**kwargs).all()]
 
     @classmethod
-    def format_insert_data(cls, data_dict):
+    async def run_in_thread(cls, func, *args, **kwargs):
+        """ 在线程中执行会读写数据库的函数，不阻塞事件循环
+        线程内推入新的app上下文，使用单独的数据库会话，并发的协程不会在多个线程中共用同一个会话
+        """
+        app = current_app._get_current_object()
+
+        def run_with_app_context():
+            with app.app_context():
+                return func(*args, **kwargs)
+
+        return await asyncio.to_thread(run_with_app_context)
+
+    @classmethod
+    def get_insert_user(cls):
+        """ 获取创建数据的用户id """
+        try:  # 执行初始化脚本、执行测试时，不在上下文中，不能使用g对象
+            if hasattr(g, 'user_id') and g.user_id:
+                return g.user_id  # 真实用户
+            from apps.system.model_factory import User
+            return User.db.session.query(User.id).filter(User.account == "common").first()[0]
+        except Exception as error:
+            return None
+
+    @classmethod
+    def format_insert_data(cls, data_dict, **kwargs):
+        """ 格式化要插入的数据，批量插入时可传 current_user，避免每条数据都查一次用户 """
         if "id" in data_dict:
             data_dict.pop("id")
 
         if cls.__name__ == "User" and "password" in data_dict:
             data_dict["password"] = generate_password_hash(data_dict["password"])
 
-        try:  # 执行初始化脚本、执行测试时，不在上下文中，不能使用g对象
-            if hasattr(g, 'user_id') and g.user_id:
-                current_user = g.user_id  # 真实用户
-            else:
-                from apps.system.model_factory import User
-                current_user = User.db.session.query(User.id).filter(User.account == "common").first()[0]
-        except Exception as error:
-            current_user = None
+        current_user = kwargs["current_user"] if "current_user" in kwargs else cls.get_insert_user()
         data_dict["create_user"] = data_dict["update_user"] = current_user
         data_dict["create_time"] = data_dict["update_time"] = None
 
         # 只保留模型中有的字段
-        return {key: value for key, value in data_dict.items() if key in cls.get_table_column_name_list()}
+        column_name_list = cls.get_table_column_name_list()
+        return {key: value for key, value in data_dict.items() if key in column_name_list}
 
     @classmethod
     def model_create(cls, data_dict: dict):
@@ -171,6 +193,33 @@ class BaseModel(db.Model, JsonUtil):
                 obj_list.append(cls(**insert_dict))
             db.session.add_all(obj_list)
 
+    @classmethod
+    def model_bulk_insert(cls, data_list: list):
+        """ 批量插入，多条数据合并为一条INSERT语句，只提交一次，不返回数据 """
+        if not data_list:
+            return
+        current_user, now = cls.get_insert_user(), datetime.now()
+        insert_list = []
+        for data_dict in data_list:
+            insert_dict = cls.format_insert_data(data_dict, current_user=current_user)
+            insert_dict["create_time"] = insert_dict["update_time"] = now
+            insert_list.append(insert_dict)
+        with db.auto_commit():
+            db.session.execute(insert(cls), insert_list)
+
+    @classmethod
+    def model_bulk_create_and_get_id(cls, data_list: list, **kwargs):
+        """ 批量插入，并按插入顺序返回自增id
+        kwargs: 圈定本批数据范围的查询条件，如 report_id=1，插入期间此范围内不能有其他地方插入数据
+        """
+        if not data_list:
+            return []
+        filter_list = [getattr(cls, key) == value for key, value in kwargs.items()]
+        max_id = db.session.query(func.max(cls.id)).filter(*filter_list).scalar() or 0
+        cls.model_bulk_insert(data_list)
+        query_set = db.session.query(cls.id).filter(cls.id > max_id, *filter_list).order_by(cls.id.asc()).all()
+        return [data[0] for data in query_set]
+
     def model_update(self, data_dict: dict):
         """ 更新数据 """
         if "num" in data_dict: data_dict.pop("num")
@@ -369,6 +418,14 @@ class NumFiled(BaseModel):
     num: Mapped[int] = mapped_column(Integer(), default=0, nullable=True, comment="数据序号")
 
 
+class DataVersionFiled(BaseModel):
+    """ 数据版本号，每次修改（含 query.update）由数据库在原值上加1，用于判断数据是否变化，不受 update_time 只精确到秒的影响 """
+    __abstract__ = True
+    data_version: Mapped[int] = mapped_column(
+        Integer(), nullable=True, default=0, onupdate=func.coalesce(literal_column("data_version"), 0) + 1,
+        comment="数据版本号，每次修改加1")
+
+
 class ScriptListFiled(BaseModel):
     __abstract__ = True
     script_list: Mapped[list] = mapped_column(JSON, nullable=True, default=[], comment="引用的脚本文件")
@@ -463,7 +520,7 @@ class DownFuncFiled(BaseModel):
     down_func: Mapped[list] = mapped_column(JSON, default=[], comment="执行后置的函数")
 
 
-class BaseProject(ScriptListFiled, NumFiled):
+class BaseProject(ScriptListFiled, NumFiled, DataVersionFiled):
     """ 服务基类表 """
     __abstract__ = True
 
@@ -495,13 +552,16 @@ class BaseProject(ScriptListFiled, NumFiled):
         return cls.query.with_entities(cls.business_id).filter(cls.id == project_id).first()
 
 
-class BaseProjectEnv(VariablesFiled):
+class BaseProjectEnv(VariablesFiled, DataVersionFiled):
     """ 服务环境基类表 """
     __abstract__ = True
 
     host: Mapped[str] = mapped_column(String(255), default=_main_server_host, comment="服务地址")
     env_id: Mapped[int] = mapped_column(Integer(), index=True, nullable=False, comment="对应环境id")
     project_id: Mapped[int] = mapped_column(Integer(), index=True, nullable=False, comment="所属的服务id")
+    rate_limit: Mapped[dict] = mapped_column(
+        JSON, default={}, nullable=True,
+        comment="执行时对此环境域名发请求的限流，rate：每秒请求数，burst：突发请求数，max_in_flight：同时在途的请求数，0为不限制")
 
     @classmethod
     def create_env(cls, project_env_model=None, run_env_model=None, project_id=None, env_list=None):
@@ -591,7 +651,7 @@ class BaseModule(NumFiled):
         return new_model
 
 
-class BaseApi(StatusFiled, NumFiled):
+class BaseApi(StatusFiled, NumFiled, DataVersionFiled):
     """ 页面表 """
     __abstract__ = True
 
@@ -621,7 +681,7 @@ class BaseElement(BaseApi):
         cls.model_batch_create(element_list)
 
 
-class BaseCaseSuite(NumFiled):
+class BaseCaseSuite(NumFiled, DataVersionFiled):
     """ 用例集基类表 """
     __abstract__ = True
 
@@ -778,7 +838,7 @@ class BaseCaseSuite(NumFiled):
         return list(set(case_id_list))
 
 
-class BaseCase(ScriptListFiled, VariablesFiled, SkipIfFiled, NumFiled):
+class BaseCase(ScriptListFiled, VariablesFiled, SkipIfFiled, NumFiled, DataVersionFiled):
     """ 用例基类表 """
 
     __abstract__ = True
@@ -870,7 +930,7 @@ class BaseCase(ScriptListFiled, VariablesFiled, SkipIfFiled, NumFiled):
         return f'{project_name[0]}/{suite_path_name}/{self.name}'
 
 
-class BaseStep(StatusFiled, SkipIfFiled, UpFuncFiled, DownFuncFiled, NumFiled):
+class BaseStep(StatusFiled, SkipIfFiled, UpFuncFiled, DownFuncFiled, NumFiled, DataVersionFiled):
     """ 测试步骤基类表 """
 
     __abstract__ = True
@@ -967,6 +1027,10 @@ class BaseTask(StatusFiled, NumFiled):
         JSON, nullable=True,
         default={"browser": "chrome", "server_id": "", "phone_id": "", "no_reset": ""},
         comment="运行配置，ui存浏览器，app存运行服务器、手机、是否重置APP")
+    run_policy: Mapped[dict] = mapped_column(
+        JSON, nullable=True, default={},
+        comment="执行策略，满足条件时不再执行剩下的用例，max_fail：不通过的用例数上限，fail_rate、fail_rate_window："
+                "最近 fail_rate_window 条用例中不通过的比例上限，health_check：用例不通过时是否探测运行环境，0为不限制")
 
     def enable_task(self):
         try:
@@ -1048,18 +1112,29 @@ class BaseReport(BaseModel):
     retry_count: Mapped[int] = mapped_column(Integer(), default=0, comment="已经执行重试的次数")
     env: Mapped[str] = mapped_column(String(255), default="test", comment="运行环境")
     temp_variables: Mapped[dict] = mapped_column(JSON, default={}, nullable=True, comment="临时参数")
-    process: Mapped[int] = mapped_column(Integer(), default=1, comment="进度节点, 1: 解析数据、2: 执行测试、3: 写入报告")
+    process: Mapped[int] = mapped_column(Integer(), default=1, comment="进度节点, 0: 排队中、1: 解析数据、2: 执行测试、3: 写入报告")
     trigger_type: Mapped[TriggerTypeEnum] = mapped_column(
         default=TriggerTypeEnum.page, comment="触发类型，pipeline:流水线、page:页面、cron:定时任务")
     batch_id: Mapped[str] = mapped_column(String(128), index=True, comment="运行批次id，用于查询报告")
     trigger_id: Mapped[Union[int, list, str]] = mapped_column(JSON, comment="运行id，用于触发重跑")
     project_id: Mapped[int] = mapped_column(Integer(), nullable=False, index=True, comment="所属的服务id")
     summary: Mapped[dict] = mapped_column(JSON, default={}, comment="报告的统计")
+    parent_id: Mapped[int] = mapped_column(
+        Integer(), nullable=True, index=True, default=None, comment="重跑不通过的用例时，被重跑的报告id")
+    parse_plan_key: Mapped[str] = mapped_column(
+        String(64), nullable=True, default=None, comment="此次执行使用的解析计划缓存的key，用于重跑不通过的用例")
+    parse_plan_fingerprint: Mapped[str] = mapped_column(
+        String(64), nullable=True, default=None,
+        comment="此次执行使用的解析计划的指纹，重跑不通过的用例时，解析计划缓存的指纹和这个一致才使用（缓存可能被之后的执行覆盖）")
+    step_status_version: Mapped[int] = mapped_column(
+        Integer(), nullable=True, default=0,
+        comment="报告下步骤执行状态（暂停/停止/放行）的修改次数，执行时为0则说明没有修改过，不用查步骤的状态")
 
     @classmethod
     def batch_delete_report(cls, report_id_list):
         """ 批量删除报告 """
         cls.query.filter(cls.id.in_(report_id_list)).delete()
+        ReportEventUtil.delete_events(cls.__tablename__, report_id_list)
 
     @classmethod
     def batch_delete_report_detail_data(cls, report_case_mode, report_step_mode):
@@ -1078,7 +1153,8 @@ class BaseReport(BaseModel):
                     "success": 0,
                     "fail": 0,
                     "error": 0,
-                    "skip": 0
+                    "skip": 0,
+                    "cancel": 0  # 触发了任务的执行策略，没有执行
                 },
                 "test_step": {  # 步骤维度
                     "total": 0,
@@ -1151,6 +1227,7 @@ class BaseReport(BaseModel):
     def update_report_process(self, **kwargs):
         """ 更新执行进度 """
         self.__class__.query.filter_by(id=self.id).update(kwargs)
+        ReportEventUtil.publish(self.__tablename__, self.id, {"type": "report", "id": self.id, **kwargs})
 
     def parse_data_start(self):
         """ 开始解析数据 """
@@ -1176,17 +1253,25 @@ class BaseReport(BaseModel):
         """ 保存报告完毕 """
         self.update_report_process(process=3, status=2)
 
+    def update_parse_plan_key(self, plan_key, fingerprint):
+        """ 记录此次执行使用的解析计划缓存和解析计划的指纹 """
+        self.__class__.query.filter_by(id=self.id).update(
+            {"parse_plan_key": plan_key, "parse_plan_fingerprint": fingerprint})
+
     def update_report_result(self, run_result, status=2, summary=None):
         """ 测试运行结束后，更新状态和结果 """
         update_dict = {"is_passed": 1 if run_result == "success" else 0, "status": status}
         if summary:
             update_dict["summary"] = self.loads(self.dumps(summary))
         self.__class__.query.filter_by(id=self.id).update(update_dict)
+        ReportEventUtil.publish(self.__tablename__, self.id, {
+            "type": "report", "id": self.id, "is_passed": update_dict["is_passed"], "status": status,
+            "result": run_result})
 
     @classmethod
     def select_is_all_status_by_batch_id(cls, batch_id, process_and_status=[1, 1]):
         """ 查询一个运行批次下离初始化状态最近的报告 """
-        status_list = [[1, 1], [1, 2], [2, 1], [2, 2], [3, 1], [3, 2]]
+        status_list = [[0, 1], [1, 1], [1, 2], [2, 1], [2, 2], [3, 1], [3, 2]]
         index = status_list.index(process_and_status)
         for process, status in status_list[index:]:  # 只查传入状态之后的状态
             data = cls.db.session.query(cls.id).filter(
@@ -1220,10 +1305,20 @@ class BaseReportCase(BaseModel):
     report_id: Mapped[int] = mapped_column(Integer(), index=True, comment="测试报告id")
     result: Mapped[str] = mapped_column(
         String(128), default='waite',
-        comment="步骤测试结果，waite：等待执行、running：执行中、fail：执行不通过、success：执行通过、skip：跳过、error：报错")
+        comment="用例测试结果，waite：等待执行、running：执行中、fail：执行不通过、success：执行通过、skip：跳过、error：报错、"
+                "cancel：触发了任务的执行策略，取消执行")
     case_data: Mapped[dict] = mapped_column(JSON, default={}, comment="用例的数据")
     summary: Mapped[dict] = mapped_column(JSON, default={}, comment="用例的报告统计")
     error_msg: Mapped[str] = mapped_column(Text(), default='', comment="用例错误信息")
+    run_index: Mapped[int] = mapped_column(
+        Integer(), nullable=True, default=0, comment="用例的第几次运行，从0开始，重跑不通过的用例时用于定位要重跑的数据行")
+    data_driver_index: Mapped[int] = mapped_column(
+        Integer(), nullable=True, default=0, comment="数据驱动的第几行数据，从0开始，重跑不通过的用例时用于定位要重跑的数据行")
+
+    @staticmethod
+    def get_row_key(case_id, run_index, data_driver_index):
+        """ 报告用例对应的数据行：用例id + 第几次运行 + 数据驱动的第几行 """
+        return case_id, run_index or 0, data_driver_index or 0
 
     @staticmethod
     def get_summary_template():
@@ -1322,6 +1417,20 @@ class BaseReportCase(BaseModel):
         # [(1, '用例1', 'running')] =>> [{ 'id': 1, 'name': '用例1', 'result': 'running' }]
         return [dict(zip(field_title, d)) for d in query_data]
 
+    @classmethod
+    def get_not_passed_case_list(cls, report_id):
+        """ 报告中执行不通过（失败/错误）的用例 """
+        return cls.query.filter(cls.report_id == report_id, cls.result.in_(["fail", "error"])).with_entities(
+            cls.id, cls.case_id, cls.run_index, cls.data_driver_index, cls.result, cls.summary
+        ).order_by(cls.id.asc()).all()
+
+    @classmethod
+    def get_row_key_set(cls, report_id):
+        """ 报告中所有用例对应的数据行 """
+        query_data = cls.query.filter(cls.report_id == report_id).with_entities(
+            cls.case_id, cls.run_index, cls.data_driver_index).all()
+        return {cls.get_row_key(*row) for row in query_data}
+
     @classmethod
     def get_resport_suite_and_case_list(cls, report_id, suite_model, report_step_model):
         """ 根据报告id，获取用例集/用例列表 """
@@ -1363,6 +1472,8 @@ class BaseReportCase(BaseModel):
         if error_msg:
             update_dict["error_msg"] = error_msg
         self.__class__.query.filter_by(id=self.id).update(update_dict)
+        ReportEventUtil.publish(self.__tablename__, self.report_id, {
+            "type": "case", "id": self.id, "report_id": self.report_id, "result": result})
 
     def test_is_running(self, case_data=None, summary=None):
         self.update_report_case_result("running", case_data, summary, error_msg=None)
@@ -1379,6 +1490,9 @@ class BaseReportCase(BaseModel):
     def test_is_error(self, case_data=None, summary=None, error_msg=None):
         self.update_report_case_result("error", case_data, summary, error_msg)
 
+    def test_is_cancel(self, case_data=None, summary=None, error_msg=None):
+        self.update_report_case_result("cancel", case_data, summary, error_msg)
+
 
 class BaseReportStep(BaseModel):
     """ 步骤执行记录基类表 """
@@ -1458,20 +1572,57 @@ class BaseReportStep(BaseModel):
         return [dict(zip(field_title, d)) for d in query_data]
 
     @classmethod
-    def get_resport_step_with_status(cls, resport_step_id, time_out=60):
-        """ 如果步骤的状态是暂停，则等暂停完毕或者暂停超时结束后再返回，模拟debug """
-        while time_out >= 0:
-            report_step = cls.query.filter_by(id=resport_step_id).first()
-            if report_step.status == "pause":  # 如果设置了当前步骤为暂停执行，则每5秒查询一次状态有没有变更
-                time_out -= 5
-                time.sleep(5)
-                if time_out >= 5: # 最后一次循环就不重置 report_step 变量了
-                    report_step = None
-                continue
-            return report_step
-        # 步骤暂停超时过后还没有放行，把后面的所有步骤都改为停止执行
-        cls.update_status(None, report_step.report_case_id, report_step.id, "stop")
-        report_step.status = "stop"
+    def get_report_table(cls):
+        """ 步骤所在的报告表，如 api_test_report_step => api_test_report """
+        return cls.metadata.tables[cls.__tablename__[:-len("_step")]]
+
+    @classmethod
+    def get_step_status_version(cls, report_id):
+        """ 报告下步骤执行状态的修改次数，按主键查一个字段，在哪个节点上修改的都能感知到 """
+        report_table = cls.get_report_table()
+        return cls.db.session.execute(
+            select(report_table.c.step_status_version).where(report_table.c.id == report_id)).scalar() or 0
+
+    @classmethod
+    def get_report_step_if_pending(cls, resport_step_id, report_id=None, report_case_id=None):
+        """ 报告下的步骤执行状态没有被修改过时不查步骤，直接返回只带id的步骤对象，执行进度按id更新；否则查出步骤 """
+        if report_id and report_case_id and cls.get_step_status_version(report_id) == 0:
+            return cls(id=resport_step_id, report_id=report_id, report_case_id=report_case_id, status="resume"), False
+        report_step = cls.query.filter_by(id=resport_step_id).first()
+        return report_step, report_step.status == "pause"
+
+    @classmethod
+    def check_pause_finish(cls, report_step, end_time):
+        """ 暂停期间被唤醒后从数据库取最新状态检查暂停是否结束；暂停超时过后还没有放行，把后面的所有步骤都改为停止执行 """
+        report_step.status = cls.db.session.query(cls.status).filter(cls.id == report_step.id).scalar()
+        if report_step.status != "pause":
+            return True
+        if time.time() >= end_time:
+            cls.update_status(None, report_step.report_case_id, report_step.id, "stop")
+            report_step.status = "stop"
+            return True
+        return False
+
+    @classmethod
+    def get_resport_step_with_status(cls, resport_step_id, time_out=60, report_id=None, report_case_id=None):
+        """ 如果步骤的状态是暂停，则等暂停完毕或者暂停超时结束后再返回，模拟debug
+        步骤状态只通过 update_status 修改，修改后报告的 step_status_version 加1，并发布到报告的事件频道，
+        暂停时阻塞等待事件发布的通知，同一个进程内修改状态立即唤醒，其他进程/节点修改状态 ReportEventUtil.poll_interval 秒内感知到
+        """
+        report_step, is_pause = cls.get_report_step_if_pending(resport_step_id, report_id, report_case_id)
+        end_time = time.time() + time_out
+        while is_pause and cls.check_pause_finish(report_step, end_time) is False:
+            ReportEventUtil.wait(max(min(end_time - time.time(), ReportEventUtil.poll_interval), 0))
+        return report_step
+
+    @classmethod
+    async def async_get_resport_step_with_status(cls, resport_step_id, time_out=60, report_id=None, report_case_id=None):
+        """ 同 get_resport_step_with_status，查询在线程中执行，在事件循环中等待，暂停期间不阻塞其他用例的执行 """
+        report_step, is_pause = await cls.run_in_thread(
+            cls.get_report_step_if_pending, resport_step_id, report_id, report_case_id)
+        end_time = time.time() + time_out
+        while is_pause and await cls.run_in_thread(cls.check_pause_finish, report_step, end_time) is False:
+            await asyncio.sleep(max(min(end_time - time.time(), ReportEventUtil.poll_interval), 0))
         return report_step
 
     @classmethod
@@ -1485,16 +1636,30 @@ class BaseReportStep(BaseModel):
             cls.query.filter(cls.report_case_id == report_case_id, cls.id >= report_step_id).update({"status": status})
         elif report_id is None and report_case_id is None and report_step_id:  #  更新指定数据的状态
             cls.query.filter(cls.id == report_step_id).update({"status": status})
+        else:
+            return
+
+        if report_id is None:  # 事件按报告发布，需要知道步骤所在的报告
+            filter_data = cls.report_case_id == report_case_id if report_case_id else cls.id == report_step_id
+            query_res = cls.db.session.query(cls.report_id).filter(filter_data).first()
+            if query_res is None:
+                return
+            report_id = query_res[0]
+        report_table = cls.get_report_table()
+        cls.db.session.execute(update(report_table).where(report_table.c.id == report_id).values(
+            step_status_version=func.coalesce(report_table.c.step_status_version, 0) + 1))
+        ReportEventUtil.publish(cls.__tablename__, report_id, {
+            "type": "step_status", "report_id": report_id, "report_case_id": report_case_id,
+            "report_step_id": report_step_id, "status": status})
 
     def save_step_result_and_summary(self, step_runner, step_error_traceback=None):
-        """ 保存测试步骤的结果和数据 """
-        data = step_runner.get_test_step_data()
-        step_data = self.loads(self.dumps(data))  # 可能有 datetime 格式的数据
+        """ 保存测试步骤的结果和数据，步骤执行结束，把缓存的进度一起写入 """
+        step_data = step_runner.get_test_step_data()
         step_meta_data = step_runner.client_session.meta_data
         step_data["attachment"] = step_error_traceback
         # 保存测试步骤的结果和数据
-        self.update_report_step_data(
-            step_data=step_data, result=step_meta_data["result"], summary=step_meta_data["stat"])
+        self.update_step_progress(step_data=step_data, result=step_meta_data["result"], summary=step_meta_data["stat"])
+        self.flush_step_progress()
 
     @classmethod
     def add_run_step_result_count(cls, case_summary, step_meta_data, response_time_level=None, report_step_id=None):
@@ -1523,12 +1688,56 @@ class BaseReportStep(BaseModel):
         """ 更新测试数据 """
         self.__class__.query.filter_by(id=self.id).update(kwargs)
 
+    def init_progress_buffer(self, granularity="live", flush_interval=1, **kwargs):
+        """ 开启步骤执行进度的写缓冲，执行过程中的进度变更先合并到内存中，只写入最新的状态
+        granularity:
+            live：步骤开始执行时立即写入，执行过程中的进度变更距上次写入超过 flush_interval 秒才写入，步骤结束时写入
+            final：只在步骤结束时写入一次
+        """
+        self._progress_buffer = {
+            "granularity": granularity,
+            "flush_interval": flush_interval,
+            "last_flush_at": time.time(),
+            "pending": {}
+        }
+
+    def update_step_progress(self, is_boundary=False, **kwargs):
+        """ 更新步骤的执行进度，开启了写缓冲则先合并到内存中，到了写入时机再写入数据库，否则直接写入 """
+        progress_buffer = getattr(self, "_progress_buffer", None)
+        if progress_buffer is None:
+            self.write_step_progress(kwargs)
+            return
+        progress_buffer["pending"].update(kwargs)
+        if progress_buffer["granularity"] == "live" and (
+                is_boundary or time.time() - progress_buffer["last_flush_at"] >= progress_buffer["flush_interval"]):
+            self.flush_step_progress()
+
+    def flush_step_progress(self):
+        """ 把缓存的执行进度写入数据库 """
+        progress_buffer = getattr(self, "_progress_buffer", None)
+        if progress_buffer and progress_buffer["pending"]:
+            pending, progress_buffer["pending"] = progress_buffer["pending"], {}
+            progress_buffer["last_flush_at"] = time.time()
+            self.write_step_progress(pending)
+
+    def write_step_progress(self, update_dict):
+        """ 写入执行进度，步骤数据在写入时才序列化 """
+        if update_dict.get("step_data"):
+            update_dict["step_data"] = self.loads(self.dumps(update_dict["step_data"]))  # 可能有 datetime 格式的数据
+        self.__class__.query.filter_by(id=self.id).update(update_dict)
+
+        # 只推送状态的变化，步骤数据由页面按需获取
+        event = {key: value for key, value in update_dict.items() if key in ("process", "result", "status", "summary")}
+        if event:
+            ReportEventUtil.publish(self.__tablename__, self.report_id, {
+                "type": "step", "id": self.id, "report_case_id": self.report_case_id, **event})
+
     def update_test_result(self, result, step_data):
-        """ 更新测试状态 """
+        """ 更新测试状态，开始执行是步骤的边界，实时进度下立即写入 """
         update_dict = {"result": result}
         if step_data:
-            update_dict["step_data"] = self.loads(self.dumps(step_data))
-        self.__class__.query.filter_by(id=self.id).update(update_dict)
+            update_dict["step_data"] = step_data
+        self.update_step_progress(is_boundary=result == "running", **update_dict)
 
     def test_is_running(self, step_data=None):
         self.update_test_result("running", step_data)
@@ -1549,8 +1758,8 @@ class BaseReportStep(BaseModel):
         """ 更新数据和执行进度 """
         update_dict = {"process": process}
         if step_data:
-            update_dict["step_data"] = self.loads(self.dumps(step_data))
-        self.__class__.query.filter_by(id=self.id).update(update_dict)
+            update_dict["step_data"] = step_data
+        self.update_step_progress(**update_dict)
 
     def test_is_start_parse(self, step_data=None):
         self.update_step_process("parse", step_data)
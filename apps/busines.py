@@ -3,8 +3,16 @@ from threading import Thread
 
 from flask import current_app
 
-from .app_test.model_factory import AppUiProject
+from .api_test.model_factory import ApiReport, ApiCase, ApiCaseSuite, ApiStep
+from .ui_test.model_factory import WebUiReport, WebUiCase, WebUiCaseSuite
+from .app_test.model_factory import AppUiProject, AppUiReport, AppUiCase, AppUiCaseSuite
+from .assist.model_factory import SwaggerPullLog
 from .config.model_factory import RunEnv, Config
+from .system.model_factory import RunQueue
+from .enums import TriggerTypeEnum
+from utils.client.run_api_test import RunCase as RunApiCase
+from utils.client.run_ui_test import RunCase as RunUiCase
+from utils.message.send_report import call_back_for_pipeline
 
 
 class RunCaseBusiness:
@@ -14,28 +22,40 @@ class RunCaseBusiness:
     def run(
             cls, is_async, task_type, project_id, batch_id, report_model, report_name, case_id_list, runner, env_code,
             run_type=None, temp_variables={}, trigger_id=None, browser=None, trigger_type="page", task_dict={},
-            appium_config={}, extend_data={}
+            appium_config={}, extend_data={}, parent_id=None
     ):
-        """ 运行用例/任务 """
+        """ 运行用例/任务，parent_id: 重跑不通过的用例时，被重跑的报告id """
 
         env = RunEnv.get_data_by_id_or_code(env_code)
         summary = report_model.get_summary_template()
         summary["env"]["code"], summary["env"]["name"] = env.code, env.name
+        run_queue_config = Config.get_run_queue()
 
         report = report_model.get_new_report(
             project_id=project_id, batch_id=batch_id, trigger_id=trigger_id or case_id_list, name=report_name,
-            run_type=task_type, env=env.code, trigger_type=trigger_type, temp_variables=temp_variables, summary=summary
+            run_type=task_type, env=env.code, trigger_type=trigger_type, temp_variables=temp_variables, summary=summary,
+            process=0 if run_queue_config["enable"] else 1,  # 写入执行队列的，领取执行前为排队中
+            parent_id=parent_id
         )
-        # 新起线程运行任务
-        Thread(
-            target=runner(
-                report_id=report.id, case_id_list=case_id_list, is_async=is_async, env_code=env.code, env_name=env.name,
-                browser=browser, task_dict=task_dict, temp_variables=temp_variables, run_type=run_type,
-                extend=extend_data, appium_config=appium_config, current_app=current_app
-            ).parse_and_run
-        ).start()
+        run_params = dict(
+            report_id=report.id, case_id_list=case_id_list, is_async=is_async, env_code=env.code, env_name=env.name,
+            browser=browser, task_dict=task_dict, temp_variables=temp_variables, run_type=run_type,
+            extend=extend_data, appium_config=appium_config, parent_id=parent_id
+        )
+        if run_queue_config["enable"]:  # 写入执行队列，由执行进程按优先级领取执行
+            RunQueue.add_run(
+                report.id, run_type or "api", runner, run_params, project_id=project_id,
+                priority=cls.get_run_priority(trigger_type, run_queue_config),
+                max_attempt=int(run_queue_config["max_attempt"]))
+        else:  # 新起线程运行任务
+            Thread(target=runner(**run_params, current_app=current_app._get_current_object()).parse_and_run).start()
         return report.id
 
+    @classmethod
+    def get_run_priority(cls, trigger_type, run_queue_config):
+        """ 执行队列中的优先级，页面调试 > 流水线 > 定时任务 """
+        return int(run_queue_config["priority"].get(getattr(trigger_type, "value", trigger_type), 0))
+
     @classmethod
     def get_appium_config(cls, project_id, server_dict, phone_dict, no_reset):
         """ 获取appium配置 """
@@ -79,3 +99,120 @@ class RunCaseBusiness:
             appium_config["xcodeSigningId"] = "iPhone Developer"
 
         return appium_config
+
+
+class RunTaskBusiness:
+    """ 运行任务，页面/流水线通过接口触发、定时任务在job服务进程内直接触发，都走这里
+    form 为对应测试类型的 RunTaskForm，返回 {"batch_id": 批次号, "report_id": 只生成了一个报告时的报告id}
+    """
+
+    @classmethod
+    def run(cls, test_type, form):
+        """ 根据测试类型运行任务，test_type: api/ui/app """
+        return getattr(cls, f'run_{test_type}_task')(form)
+
+    @classmethod
+    def run_task_by_env(cls, form, run_type, report_model, case_model, suite_model, runner):
+        """ 运行接口/ui任务，每个任务在每个运行环境都生成一个报告
+        按接口变更影响范围选择用例时，没有要执行的用例的任务不执行，记录到返回的 skip_task_list 中
+        """
+        batch_id, report_id, env_list, skip_task_list = None, None, [], []
+        for task in form.task_list:
+            case_id_list = suite_model.get_case_id(case_model, task.project_id, task.suite_ids, task.case_ids)
+            if getattr(form, "select_mode", "all") == "impact":
+                case_id_list = cls.get_impact_case_id_list(form, task, case_id_list)
+                if not case_id_list:  # 没有受影响的用例，也没有冒烟用例，不执行
+                    current_app.logger.info(f'任务【{task.name}】没有受接口变更影响的用例，不执行')
+                    skip_task_list.append({"task_id": task.id, "task_name": task.name, "reason": "没有受接口变更影响的用例"})
+                    cls.call_back_skip_task(form, task)
+                    continue
+            batch_id = report_model.get_batch_id()
+            env_list = form.env_list or task.env_list
+            for env_code in env_list:
+                report_id = RunCaseBusiness.run(
+                    project_id=task.project_id,
+                    batch_id=batch_id,
+                    report_name=task.name,
+                    report_model=report_model,
+                    env_code=env_code,
+                    browser=(form.browser if hasattr(form, 'browser') else task.browser) if run_type == "ui" else None,
+                    trigger_type=form.trigger_type,
+                    is_async=form.is_async,
+                    task_type="task",
+                    trigger_id=[task.id],
+                    case_id_list=case_id_list,
+                    run_type=run_type,
+                    runner=runner,
+                    task_dict=task.to_dict(),
+                    extend_data=form.extend
+                )
+        result = {"batch_id": batch_id, "report_id": report_id if len(env_list) == 1 else None}
+        if skip_task_list:
+            result["skip_task_list"] = skip_task_list
+        return result
+
+    @classmethod
+    def call_back_skip_task(cls, form, task):
+        """ 流水线触发的任务没有要执行的用例，直接按执行通过回调流水线，避免流水线一直等回调 """
+        if form.trigger_type != TriggerTypeEnum.pipeline:
+            return
+        app, task_id, call_back = current_app._get_current_object(), task.id, task.call_back or []
+
+        def call_back_in_app_context():
+            with app.app_context():
+                call_back_for_pipeline(task_id, call_back, form.extend, "success")
+
+        Thread(target=call_back_in_app_context).start()
+
+    @classmethod
+    def get_impact_case_id_list(cls, form, task, case_id_list):
+        """ 只执行任务中受接口变更影响的用例和冒烟用例，保持任务中的用例顺序 """
+        change_api_list = form.change_api_list
+        if change_api_list is None:
+            change_api_list = SwaggerPullLog.get_last_change_api_list(task.project_id)
+        select_case_id_set = ApiStep.get_impact_case_id_set(change_api_list) if change_api_list else set()
+        select_case_id_set.update(task.smoke_case_ids or [])
+        select_case_id_list = [case_id for case_id in case_id_list if case_id in select_case_id_set]
+        current_app.logger.info(
+            f'任务【{task.name}】按接口变更影响范围选择用例，变更的接口：{change_api_list}，'
+            f'执行{len(select_case_id_list)}/{len(case_id_list)}条用例')
+        return select_case_id_list
+
+    @classmethod
+    def run_api_task(cls, form):
+        """ 运行接口自动化任务 """
+        return cls.run_task_by_env(form, "api", ApiReport, ApiCase, ApiCaseSuite, RunApiCase)
+
+    @classmethod
+    def run_ui_task(cls, form):
+        """ 运行web ui自动化任务 """
+        return cls.run_task_by_env(form, "ui", WebUiReport, WebUiCase, WebUiCaseSuite, RunUiCase)
+
+    @classmethod
+    def run_app_task(cls, form):
+        """ 运行app自动化任务，只在第一个运行环境执行 """
+        batch_id, report_id = None, None
+        for task in form.task_list:
+            form.env_list = form.env_list or task.env_list
+            case_id_list = AppUiCaseSuite.get_case_id(AppUiCase, task.project_id, task.suite_ids, task.case_ids)
+            appium_config = RunCaseBusiness.get_appium_config(
+                task.project_id, task.conf["server"], task.conf["phone"], task.conf["no_reset"])
+            batch_id = AppUiReport.get_batch_id()
+            report_id = RunCaseBusiness.run(
+                project_id=task.project_id,
+                batch_id=batch_id,
+                report_name=task.name,
+                report_model=AppUiReport,
+                env_code=form.env_list[0],
+                trigger_type=form.trigger_type,
+                is_async=form.is_async,
+                task_type="task",
+                trigger_id=[task.id],
+                case_id_list=case_id_list,
+                run_type="app",
+                runner=RunUiCase,
+                extend_data=form.extend,
+                task_dict=task.to_dict(),
+                appium_config=appium_config
+            )
+        return {"batch_id": batch_id, "report_id": report_id}
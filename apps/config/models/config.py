@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy import Integer, Text, String
+import time
+from threading import Lock
+
+from sqlalchemy import Integer, Text, String, func
 from sqlalchemy.orm import Mapped, mapped_column
 
-from apps.base_model import NumFiled
+from apps.base_model import NumFiled, DataVersionFiled
 
 
 class ConfigType(NumFiled):
@@ -15,7 +18,7 @@ class ConfigType(NumFiled):
     desc: Mapped[str] = mapped_column(Text(), nullable=True, comment="描述")
 
 
-class Config(NumFiled):
+class Config(NumFiled, DataVersionFiled):
     """ 配置表 """
 
     __tablename__ = "config_config"
@@ -26,9 +29,66 @@ class Config(NumFiled):
     value: Mapped[str] = mapped_column(Text(), comment="配置值")
     desc: Mapped[str] = mapped_column(Text(), nullable=True, comment="描述")
 
+    # 进程内的配置缓存，缓存的是数据库中的原始值，由各个 get_xxx 方法自己转换类型，避免调用方修改了缓存中的数据
+    # 配置的版本号存在数据库中，所有节点共用，任意节点修改了配置，其他节点最多延迟 version_check_interval 秒生效
+    version_check_interval = 1  # 检查配置版本号的间隔（秒）
+    cache_ttl = 60  # 缓存最长有效期（秒），直接改库等没有更新版本号的修改，最多延迟这么久生效
+    _config_cache = {"value": {}, "loaded_at": 0, "checked_at": 0, "version": None}
+    _config_cache_lock = Lock()
+
+    @classmethod
+    def get_config_version(cls):
+        """ 配置的版本号：配置数、最大id、数据版本号之和，任意节点新增、删除、修改配置都会变化 """
+        count, max_id, data_version = cls.db.session.query(
+            func.count(cls.id), func.max(cls.id), func.sum(cls.data_version)).one()
+        return count, max_id, int(data_version or 0)
+
+    @classmethod
+    def load_all_config(cls):
+        """ 一次性查出所有配置项放到缓存中 """
+        version = cls.get_config_version()
+        value_dict = dict(cls.db.session.query(cls.name, cls.value).all())
+        now = time.time()
+        cls._config_cache = {"value": value_dict, "loaded_at": now, "checked_at": now, "version": version}
+        return value_dict
+
+    @classmethod
+    def config_cache_is_expired(cls, config_cache):
+        """ 缓存过期，或者配置有修改（版本号变了），版本号每 version_check_interval 秒最多查一次 """
+        now = time.time()
+        if now - config_cache["loaded_at"] >= cls.cache_ttl:
+            return True
+        if now - config_cache["checked_at"] < cls.version_check_interval:
+            return False
+        config_cache["checked_at"] = now
+        return config_cache["version"] != cls.get_config_version()
+
+    @classmethod
+    def get_all_config(cls):
+        """ 获取所有配置项 {"配置名": "配置值"}，缓存失效则重新加载 """
+        config_cache = cls._config_cache
+        if cls.config_cache_is_expired(config_cache):
+            with cls._config_cache_lock:
+                # 等锁期间其他线程已经重新加载过的，直接用新的缓存
+                if cls._config_cache is config_cache or cls._config_cache["loaded_at"] == 0:
+                    return cls.load_all_config()
+                return cls._config_cache["value"]
+        return config_cache["value"]
+
+    @classmethod
+    def clear_config_cache(cls):
+        """ 配置有新增、修改、删除时调用，当前进程立即重新加载，其他进程、节点通过数据库中的版本号感知到变化 """
+        cls._config_cache = {"value": {}, "loaded_at": 0, "checked_at": 0, "version": None}
+
+    @classmethod
+    def get_config_value(cls, config_name, default=None):
+        """ 获取配置值，传了default时，没有此配置项则返回default（老版本数据库中可能还没有新加的配置项） """
+        return cls.get_all_config().get(config_name, default)
+
     @classmethod
-    def get_config_value(cls, config_name):
-        return cls.db.session.query(cls.value).filter(cls.name == config_name).first()[0]  # ('60',)
+    def get_holiday_list(cls):
+        """ 获取holiday_list配置项，原始的json字符串，用 "月-日" in holiday_list 判断 """
+        return cls.get_config_value("holiday_list", "[]")
 
     @classmethod
     def get_pip_command(cls):
@@ -72,6 +132,47 @@ class Config(NumFiled):
     def get_response_time_level(cls):
         return cls.loads(cls.get_config_value("response_time_level"))
 
+    @classmethod
+    def get_http_client_limits(cls):
+        """ 获取执行接口测试时连接池的配置项 """
+        return cls.loads(cls.get_config_value(
+            "http_client_limits", '{"max_connections": 100, "max_keepalive_connections": 20, "keepalive_expiry": 5}'))
+
+    @classmethod
+    def get_api_run_engine(cls):
+        """ 获取接口自动化并行执行时使用的执行引擎，thread：多线程，asyncio：协程 """
+        return cls.get_config_value("api_run_engine", "thread")
+
+    @classmethod
+    def get_api_async_concurrency(cls):
+        """ 获取接口自动化使用协程执行时，同时执行的用例数上限 """
+        return int(cls.get_config_value("api_async_concurrency", 100))
+
+    @classmethod
+    def get_run_queue(cls):
+        """ 获取执行队列的配置项，没有配置的项用默认值 """
+        return {
+            "enable": 0, "worker_count": 4, "lease_time_out": 60, "heartbeat_interval": 15, "poll_interval": 2,
+            "max_attempt": 2, "global_limit": 0, "project_limit": 0, "max_wait": 30 * 60,
+            "priority": {"page": 30, "pipeline": 20, "cron": 10}, "shard_size": 0,
+            **cls.loads(cls.get_config_value("run_queue", "{}"))
+        }
+
+    @classmethod
+    def get_run_case_max_workers(cls):
+        """ 获取并行执行时，单个测试报告同时执行的用例数上限 """
+        return int(cls.get_config_value("run_case_max_workers", 10))
+
+    @classmethod
+    def get_node_run_case_max_workers(cls):
+        """ 获取并行执行时，单个服务进程同时执行的用例数上限 """
+        return int(cls.get_config_value("node_run_case_max_workers", 50))
+
+    @classmethod
+    def get_report_step_progress(cls):
+        """ 获取测试步骤执行进度的写入配置 """
+        return cls.loads(cls.get_config_value("report_step_progress", '{"granularity": "live", "flush_interval": 1}'))
+
     @classmethod
     def get_wait_time_out(cls):
         return cls.get_config_value("wait_time_out")
@@ -3,11 +3,11 @@ from sqlalchemy import or_
 from sqlalchemy import String
 from sqlalchemy.orm import Mapped, mapped_column
 
-from ...base_model import NumFiled
+from ...base_model import NumFiled, DataVersionFiled
 from ..model_factory import BusinessLine
 
 
-class RunEnv(NumFiled):
+class RunEnv(NumFiled, DataVersionFiled):
     """ 运行环境表 """
     __tablename__ = "config_run_env"
     __table_args__ = {"comment": "运行环境配置表"}
@@ -46,6 +46,7 @@ def config_add_config():
     """ 新增配置 """
     form = PostConfigForm()
     Config.model_create(form.model_dump())
+    Config.clear_config_cache()
     return app.restful.add_success()
 
 
@@ -54,6 +55,7 @@ def config_change_config():
     """ 修改配置 """
     form = PutConfigForm()
     Config.query.filter(Config.id == form.id).update(form.model_dump())
+    Config.clear_config_cache()
     return app.restful.change_success()
 
 
@@ -62,6 +64,7 @@ def config_delete_config():
     """ 删除配置 """
     form = DeleteConfigForm()
     form.conf.delete()
+    Config.clear_config_cache()
     return app.restful.delet_success()
 
 
@@ -72,6 +75,7 @@ def config_change_api_default_validator():
     conf_value = json.loads(form.conf.value)
     conf_value.append(form.model_dump())
     form.conf.model_update({"value": form.conf.dumps(conf_value)})
+    Config.clear_config_cache()
     return app.restful.change_success()
 
 
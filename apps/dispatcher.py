@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+""" 定时任务的触发方式
+    local: 在job服务进程内直接触发执行，复用job服务常驻的app，不走http、不重复创建app
+    http: 调主程序的执行接口，用于job服务和主程序分开部署的场景
+    由 config._job_dispatch_transport 指定
+"""
+from abc import ABC, abstractmethod
+from threading import Thread
+
+import requests
+
+from .busines import RunTaskBusiness
+from .api_test.forms.task import RunTaskForm as ApiRunTaskForm
+from .ui_test.forms.task import RunTaskForm as UiRunTaskForm
+from .app_test.forms.task import RunTaskForm as AppRunTaskForm
+from .system.views.job import JobFuncs
+from config import _main_server_host, _job_dispatch_transport
+
+
+class TaskDispatcher(ABC):
+    """ 触发执行定时任务，task_id 以 cron 开头的为系统定时任务，否则为自动化测试任务 """
+
+    def __init__(self, app):
+        self.app = app
+
+    @classmethod
+    def is_system_job(cls, task_id):
+        return isinstance(task_id, str) and task_id.startswith('cron')
+
+    def dispatch(self, task_id, task_type):
+        """ 触发执行，返回触发结果 """
+        if self.is_system_job(task_id):
+            return self.dispatch_system_job(task_id)
+        return self.dispatch_test_task(task_id, task_type)
+
+    @abstractmethod
+    def dispatch_system_job(self, func_name):
+        """ 触发执行系统定时任务 """
+
+    @abstractmethod
+    def dispatch_test_task(self, task_id, task_type):
+        """ 触发执行自动化测试任务 """
+
+
+class LocalTaskDispatcher(TaskDispatcher):
+    """ 在当前进程内直接触发执行 """
+    run_task_form_mapping = {"api": ApiRunTaskForm, "ui": UiRunTaskForm, "app": AppRunTaskForm}
+
+    def run_with_app_context(self, func):
+        with self.app.app_context():
+            func()
+
+    def dispatch_system_job(self, func_name):
+        Thread(target=self.run_with_app_context, args=(getattr(JobFuncs, func_name),)).start()
+        return {"func_name": func_name}
+
+    def dispatch_test_task(self, task_id, task_type):
+        with self.app.app_context():
+            form = self.run_task_form_mapping[task_type](id_list=[task_id], trigger_type="cron")
+            return RunTaskBusiness.run(task_type, form)
+
+
+class HttpTaskDispatcher(TaskDispatcher):
+    """ 调主程序的执行接口触发执行 """
+
+    def dispatch_system_job(self, func_name):
+        return self.request_run_api('/system/job/run', {"func_name": func_name, "trigger_type": "cron"})
+
+    def dispatch_test_task(self, task_id, task_type):
+        return self.request_run_api(f'/{task_type}-test/task/run', {"id_list": [task_id], "trigger_type": "cron"})
+
+    def request_run_api(self, api_addr, request_data):
+        request_url = f'{_main_server_host}/api{api_addr}'
+        self.app.logger.info(f'触发参数：\nurl: {request_url}\n请求参数: {request_data}')
+        return requests.post(url=request_url, json=request_data).json()
+
+
+def get_task_dispatcher(app):
+    """ 根据配置获取触发方式 """
+    dispatcher_mapping = {"local": LocalTaskDispatcher, "http": HttpTaskDispatcher}
+    return dispatcher_mapping[_job_dispatch_transport](app)
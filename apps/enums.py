@@ -120,3 +120,12 @@ class TodoListEnum(str, BaseEnum):
     doing = "doing"
     testing = "testing"
     done = "done"
+
+
+class RunQueueStatusEnum(str, BaseEnum):
+    """ 执行队列中任务的状态 """
+    pending = "pending"  # 待执行
+    running = "running"  # 已被节点领取，执行中
+    done = "done"  # 执行完毕
+    failed = "failed"  # 执行失败，且已超过最大执行次数
+    rejected = "rejected"  # 排队超时，不再执行
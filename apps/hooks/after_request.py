@@ -30,6 +30,9 @@ def register_after_hook(app):
         if "download" in request.path or "." in request.path or request.path.endswith("swagger"):
             return response
 
+        if response.mimetype == "text/event-stream":  # SSE 是流式响应，不改响应类型、不记录响应数据
+            return response
+
         # result = copy.copy(response.response)
         # if isinstance(result[0], bytes):
         #     result[0] = bytes.decode(result[0])
@@ -1,4 +1,7 @@
 from .models.error_record import SystemErrorRecord, SaveRequestLog
 from .models.job import JobRunLog, ApschedulerJobs
+from .models.parse_plan import ParsePlan
+from .models.report_event import ReportEvent
+from .models.run_queue import RunQueue
 from .models.user import Permission, Role, RolePermissions, User, UserRoles
 from .models.user_operation_log import UserOperationLog
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from sqlalchemy import String
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.dialects.mysql import LONGTEXT, insert
+
+from apps.base_model import BaseModel
+
+
+class ParsePlan(BaseModel):
+    """ 解析计划缓存，所有执行节点共用，一个节点解析过的用例，其他节点执行同样的用例时可以直接使用 """
+    __tablename__ = "system_parse_plan"
+    __table_args__ = {"comment": "解析计划缓存"}
+
+    plan_key: Mapped[str] = mapped_column(String(64), unique=True, nullable=False, comment="解析计划的key")
+    content: Mapped[str] = mapped_column(LONGTEXT, comment="解析计划内容")
+
+    @classmethod
+    def get_content(cls, plan_key):
+        """ 读取缓存的解析计划，没有则返回None """
+        return cls.db.session.query(cls.content).filter(cls.plan_key == plan_key).scalar()
+
+    @classmethod
+    def save_content(cls, plan_key, content, keep_days=7):
+        """ 保存解析计划，已存在则覆盖，顺便删掉超过 keep_days 天没有更新的解析计划 """
+        now = datetime.now()
+        cls.db.session.execute(insert(cls).values(
+            plan_key=plan_key, content=content, create_time=now, update_time=now
+        ).on_duplicate_key_update(content=content, update_time=now))
+        cls.query.filter(cls.update_time < now - timedelta(days=keep_days)).delete(synchronize_session=False)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, JSON, insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+from apps.base_model import BaseModel
+
+
+class ReportEvent(BaseModel):
+    """ 测试报告执行状态的事件，所有节点共用，执行节点发布、web节点读取推送给查看报告的页面
+    自增id即事件id，按报告的事件频道读取大于某个id的事件
+    """
+    __tablename__ = "system_report_event"
+    __table_args__ = {"comment": "测试报告执行状态的事件"}
+
+    channel: Mapped[str] = mapped_column(String(128), index=True, comment="事件频道，报告表名_报告id，如 api_test_report_1")
+    event: Mapped[dict] = mapped_column(JSON, comment="事件内容")
+
+    @classmethod
+    def add_event(cls, channel, event):
+        """ 写入一个事件，执行过程中频繁调用，不查用户、不走 model_create """
+        now = datetime.now()
+        cls.db.session.execute(
+            insert(cls).values(channel=channel, event=event, create_time=now, update_time=now))
+
+    @classmethod
+    def get_event_list(cls, channel, last_id=0, limit=500):
+        """ 读取频道中id大于 last_id 的事件，返回 [(事件id, 事件)] """
+        query_data = cls.db.session.query(cls.id, cls.event).filter(
+            cls.channel == channel, cls.id > last_id).order_by(cls.id.asc()).limit(limit).all()
+        return [(event_id, event) for event_id, event in query_data]
+
+    @classmethod
+    def delete_by_channel(cls, channel_list):
+        cls.query.filter(cls.channel.in_(channel_list)).delete(synchronize_session=False)
+
+    @classmethod
+    def delete_expire(cls, keep_hours):
+        """ 删除超过 keep_hours 小时的事件，返回删除的数量 """
+        return cls.query.filter(
+            cls.create_time < datetime.now() - timedelta(hours=keep_hours)).delete(synchronize_session=False)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import importlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import Text, String, Integer, DateTime, JSON, select, update, or_, and_, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from apps.base_model import BaseModel
+from apps.enums import RunQueueStatusEnum
+
+
+class RunQueue(BaseModel):
+    """ 执行队列，触发执行时只写入队列，由各个节点上的执行进程领取执行
+    领取时用 SELECT ... FOR UPDATE SKIP LOCKED，多个节点同时领取不会互相等待、也不会重复领取；
+    领取后按心跳续租，节点宕机/卡死导致租约过期的，会被其他节点重新领取
+    准入控制：同时执行的任务数达到全局/服务的上限时不再领取，待执行的任务按优先级排队，排队超时的不再执行
+    分片执行：用例多的报告解析完后把用例切成多个分片写入队列，各节点领取分片执行，执行结果写回分片，由报告所在的节点合并
+    """
+    __tablename__ = "system_run_queue"
+    __table_args__ = {"comment": "执行队列"}
+
+    report_id: Mapped[int] = mapped_column(Integer(), index=True, comment="测试报告id")
+    project_id: Mapped[int] = mapped_column(Integer(), nullable=True, index=True, comment="服务id，用于限制同一个服务同时执行的任务数")
+    run_type: Mapped[str] = mapped_column(String(16), comment="测试类型，api/ui/app")
+    unit_type: Mapped[str] = mapped_column(
+        String(16), default="report", comment="执行单元，report：整个报告，shard：报告中的一部分用例")
+    runner: Mapped[str] = mapped_column(String(255), comment="执行器，如 utils.client.run_api_test.RunCase")
+    run_params: Mapped[dict] = mapped_column(JSON, default={}, comment="实例化执行器的参数")
+    priority: Mapped[int] = mapped_column(Integer(), default=0, comment="优先级，越大越先执行")
+    status: Mapped[str] = mapped_column(
+        String(16), index=True, default=RunQueueStatusEnum.pending.value, comment="状态，pending/running/done/failed/rejected")
+    lease_owner: Mapped[str] = mapped_column(String(128), nullable=True, comment="领取的节点，主机名:进程id")
+    lease_expire_time: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True, comment="租约过期时间")
+    heartbeat_time: Mapped[datetime] = mapped_column(DateTime, nullable=True, comment="最后一次心跳时间")
+    attempt: Mapped[int] = mapped_column(Integer(), default=0, comment="已领取执行的次数")
+    max_attempt: Mapped[int] = mapped_column(Integer(), default=2, comment="最多领取执行的次数")
+    error: Mapped[str] = mapped_column(Text(), nullable=True, comment="执行失败的错误信息")
+    shard: Mapped[dict] = mapped_column(
+        JSON, nullable=True, comment="分片要执行的数据，{report_case_list: 报告用例id, script_id_list: 要加载的脚本id, shard_count: 报告切分的分片数}")
+    result: Mapped[dict] = mapped_column(JSON, nullable=True, comment="分片的执行结果汇总")
+
+    @classmethod
+    def get_class_path(cls, obj_class):
+        return f'{obj_class.__module__}.{obj_class.__name__}'
+
+    @classmethod
+    def import_class(cls, class_path):
+        module_path, class_name = class_path.rsplit(".", 1)
+        return getattr(importlib.import_module(module_path), class_name)
+
+    @classmethod
+    def add_run(cls, report_id, run_type, runner, run_params, project_id=None, priority=0, max_attempt=2,
+                unit_type="report"):
+        """ 写入队列，等待执行节点领取 """
+        cls.model_create({
+            "report_id": report_id,
+            "project_id": project_id,
+            "run_type": run_type,
+            "unit_type": unit_type,
+            "runner": cls.get_class_path(runner),
+            "run_params": cls.loads(cls.dumps(run_params)),
+            "priority": priority,
+            "max_attempt": max_attempt
+        })
+
+    @classmethod
+    def add_shard_list(cls, queue, shard_list, script_id_list):
+        """ 把报告的用例分片写入队列，优先级比报告高一级，已经开始执行的报告先执行完，返回分片id """
+        return cls.model_bulk_create_and_get_id([{
+            "report_id": queue.report_id,
+            "project_id": queue.project_id,
+            "run_type": queue.run_type,
+            "unit_type": "shard",
+            "runner": queue.runner,
+            "run_params": queue.run_params,
+            "priority": queue.priority + 1,
+            "max_attempt": queue.max_attempt,
+            "status": RunQueueStatusEnum.pending.value,
+            "attempt": 0,
+            "shard": {
+                "report_case_list": report_case_list, "script_id_list": script_id_list, "shard_count": len(shard_list)}
+        } for report_case_list in shard_list], report_id=queue.report_id, run_type=queue.run_type, unit_type="shard")
+
+    @classmethod
+    def get_shard_list(cls, shard_id_list):
+        """ 分片的状态和执行结果 """
+        return cls.db.session.query(cls.id, cls.status, cls.result, cls.shard).filter(cls.id.in_(shard_id_list)).all()
+
+    @classmethod
+    def reject_shard_list(cls, report_id, run_type):
+        """ 报告重新执行时，之前切分的还没执行的分片不再执行，报告会重新切分 """
+        return cls.query.filter(
+            cls.report_id == report_id, cls.run_type == run_type, cls.unit_type == "shard",
+            cls.status.in_([RunQueueStatusEnum.pending.value, RunQueueStatusEnum.running.value])
+        ).update({"status": RunQueueStatusEnum.rejected.value, "error": "报告重新执行，分片不再执行"},
+                 synchronize_session=False)
+
+    @classmethod
+    def cancel_pending_shard_list(cls, shard_id_list, reason):
+        """ 报告触发了执行策略，还没被领取的分片不再执行，返回不再执行的分片id """
+        pending_id_list = [row[0] for row in cls.db.session.query(cls.id).filter(
+            cls.id.in_(shard_id_list), cls.status == RunQueueStatusEnum.pending.value).all()]
+        if pending_id_list:
+            cls.query.filter(cls.id.in_(pending_id_list), cls.status == RunQueueStatusEnum.pending.value).update(
+                {"status": RunQueueStatusEnum.rejected.value, "error": f'触发执行策略，分片不再执行：{reason}'},
+                synchronize_session=False)
+        return pending_id_list
+
+    @classmethod
+    def get_running_filter(cls, now):
+        """ 正在执行的报告：已被领取，且租约还没过期，分片属于已经开始执行的报告，不计入执行数 """
+        return and_(
+            cls.unit_type == "report", cls.status == RunQueueStatusEnum.running.value, cls.lease_expire_time >= now)
+
+    @classmethod
+    def lease(cls, lease_owner, lease_time_out, limit=1, global_limit=0, project_limit=0, report_id=None,
+              run_type=None):
+        """ 领取待执行的任务，待执行的、租约已过期且还能重试的都可以领取，返回领取到的数据
+        mysql连接是自动提交模式，FOR UPDATE 的锁要在显式开启的事务中才会保持到更新完毕
+        global_limit: 所有节点同时执行的报告数上限，project_limit: 同一个服务同时执行的报告数上限，0为不限制，
+            执行数的统计不加锁，多个节点同时领取时可能会略微超过上限；分片属于已经准入的报告，不受上限限制
+        report_id、run_type: 只领取指定报告的分片
+        """
+        now = datetime.now()
+        with cls.db.engine.connect() as connection:
+            query_filter = [or_(
+                cls.status == RunQueueStatusEnum.pending.value,
+                and_(
+                    cls.status == RunQueueStatusEnum.running.value,
+                    cls.lease_expire_time < now,
+                    cls.attempt < cls.max_attempt
+                )
+            )]
+            if report_id:
+                query_filter.extend([cls.report_id == report_id, cls.run_type == run_type, cls.unit_type == "shard"])
+            else:
+                if global_limit:
+                    running_count = connection.execute(
+                        select(func.count(cls.id)).where(cls.get_running_filter(now))).scalar()
+                    if running_count >= global_limit:  # 只领取分片
+                        query_filter.append(cls.unit_type == "shard")
+                if project_limit:  # 排除执行数已达上限的服务
+                    query_filter.append(or_(cls.unit_type == "shard", cls.project_id.is_(None), cls.project_id.notin_(
+                        select(cls.project_id).where(cls.get_running_filter(now), cls.project_id.isnot(None))
+                        .group_by(cls.project_id).having(func.count(cls.id) >= project_limit)
+                    )))
+
+            connection.exec_driver_sql("START TRANSACTION")
+            try:
+                id_list = connection.execute(
+                    select(cls.id).where(*query_filter)
+                    .order_by(cls.priority.desc(), cls.id).limit(limit).with_for_update(skip_locked=True)
+                ).scalars().all()
+                if id_list:
+                    connection.execute(update(cls).where(cls.id.in_(id_list)).values(
+                        status=RunQueueStatusEnum.running.value,
+                        lease_owner=lease_owner,
+                        lease_expire_time=now + timedelta(seconds=lease_time_out),
+                        heartbeat_time=now,
+                        attempt=cls.attempt + 1
+                    ))
+                connection.exec_driver_sql("COMMIT")
+            except Exception:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+        return cls.query.filter(cls.id.in_(id_list)).all() if id_list else []
+
+    @classmethod
+    def get_lease_filter(cls, lease_owner, attempt_dict):
+        """ 租约还在的条件：领取的节点和领取的次数都没变，attempt_dict: {任务id: 领取时的执行次数} """
+        return and_(cls.lease_owner == lease_owner, or_(*[
+            and_(cls.id == queue_id, cls.attempt == attempt) for queue_id, attempt in attempt_dict.items()]))
+
+    @classmethod
+    def heartbeat(cls, lease_owner, attempt_dict, lease_time_out):
+        """ 续租，返回续租成功的数量，少于 attempt_dict 的说明租约已经过期并被其他节点领走了 """
+        if not attempt_dict:
+            return 0
+        now = datetime.now()
+        return cls.query.filter(
+            cls.get_lease_filter(lease_owner, attempt_dict), cls.status == RunQueueStatusEnum.running.value
+        ).update({"lease_expire_time": now + timedelta(seconds=lease_time_out), "heartbeat_time": now},
+                 synchronize_session=False)
+
+    @classmethod
+    def get_lease_lost_id_list(cls, lease_owner, attempt_dict):
+        """ 租约已被接管（被其他节点或本节点重新领取）的任务id """
+        if not attempt_dict:
+            return []
+        held_id_set = {row[0] for row in cls.db.session.query(cls.id).filter(
+            cls.get_lease_filter(lease_owner, attempt_dict)).all()}
+        return [queue_id for queue_id in attempt_dict if queue_id not in held_id_set]
+
+    def is_lease_held(self, lease_owner):
+        """ 租约是否还在当前领取者手上，写入报告前检查，租约被接管的不能再写 """
+        return self.__class__.db.session.query(self.__class__.id).filter(
+            self.__class__.get_lease_filter(lease_owner, {self.id: self.attempt})).first() is not None
+
+    @classmethod
+    def get_expired_exhausted_list(cls):
+        """ 租约已过期、且已经达到最大执行次数的任务，不会再被领取 """
+        return cls.query.filter(
+            cls.status == RunQueueStatusEnum.running.value,
+            cls.lease_expire_time < datetime.now(),
+            cls.attempt >= cls.max_attempt
+        ).all()
+
+    @classmethod
+    def get_wait_time_out_list(cls, max_wait):
+        """ 排队超过 max_wait 秒还没被领取的任务 """
+        return cls.query.filter(
+            cls.unit_type == "report",
+            cls.status == RunQueueStatusEnum.pending.value,
+            cls.attempt == 0,
+            cls.create_time < datetime.now() - timedelta(seconds=max_wait)
+        ).all()
+
+    def reject(self):
+        """ 排队超时，不再执行，只有还在排队的才能修改，已经被领取的以领取的节点为准 """
+        return self.__class__.query.filter(
+            self.__class__.id == self.id, self.__class__.status == RunQueueStatusEnum.pending.value,
+            self.__class__.attempt == 0
+        ).update({"status": RunQueueStatusEnum.rejected.value, "error": "排队超时，不再执行"},
+                 synchronize_session=False)
+
+    @classmethod
+    def get_queue_info(cls, run_type, report_id):
+        """ 报告在队列中的排队信息，没有在排队则返回None
+        position: 排在第几位，按优先级从高到低、同优先级先进先出，wait_time: 已等待的时间（秒）
+        """
+        queue = cls.query.filter(
+            cls.run_type == run_type, cls.report_id == report_id, cls.unit_type == "report",
+            cls.status == RunQueueStatusEnum.pending.value
+        ).first()
+        if queue is None:
+            return None
+        ahead_count = cls.db.session.query(func.count(cls.id)).filter(
+            cls.unit_type == "report",
+            cls.status == RunQueueStatusEnum.pending.value,
+            or_(cls.priority > queue.priority, and_(cls.priority == queue.priority, cls.id < queue.id))
+        ).scalar()
+        return {
+            "position": ahead_count + 1,
+            "priority": queue.priority,
+            "wait_time": int((datetime.now() - queue.create_time).total_seconds())
+        }
+
+    def release(self, lease_owner, status, error=None, result=None):
+        """ 执行完毕/执行失败，只有当前租约的持有者才能修改，租约被其他节点接管的以接管的节点为准 """
+        return self.__class__.query.filter(
+            self.__class__.get_lease_filter(lease_owner, {self.id: self.attempt})
+        ).update({"status": status, "error": error, "result": result, "lease_expire_time": None},
+                 synchronize_session=False)
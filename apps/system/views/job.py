@@ -5,7 +5,7 @@ from threading import Thread
 import datetime
 
 import requests
-from flask import current_app as app, request
+from flask import current_app as app, request, has_app_context
 
 from utils.util.file_util import FileUtil
 from ..forms.job import GetJobRunLogList, GetJobForm, GetJobLogForm, EnableJobForm, DisableJobForm, RunJobForm
@@ -25,6 +25,11 @@ from config import _job_server_host
 from ... import create_app
 
 
+def job_app_context():
+    """ 已经在app上下文中（job服务进程内直接触发）则复用当前的app，否则新建app """
+    return app.app_context() if has_app_context() else create_app().app_context()
+
+
 class JobFuncs:
     """ 定时任务，方法以cron_开头，参数放在文档注释里面 """
 
@@ -37,7 +42,7 @@ class JobFuncs:
             "cron": "0 0 2 * * ?"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             ApiReport.batch_delete_report_detail_data(ApiReportCase, ApiReportStep)
             WebUiReport.batch_delete_report_detail_data(WebUiReportCase, WebUiReportStep)
             AppUiReport.batch_delete_report_detail_data(AppUiReportCase, AppUiReportStep)
@@ -51,7 +56,7 @@ class JobFuncs:
             "cron": "0 35 2 * * ?"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             time_point = (datetime.datetime.now() - datetime.timedelta(days=30))
 
             # 清理api测试报告数据
@@ -94,7 +99,7 @@ class JobFuncs:
             "cron": "0 10 2 * * ?"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             ApiCase.batch_delete_step(ApiStep)
             WebUiCase.batch_delete_step(WebUiStep)
             AppUiCase.batch_delete_step(AppUiStep)
@@ -108,7 +113,7 @@ class JobFuncs:
             "cron": "0 15 2,13 * * ?"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             run_log = JobRunLog.model_create_and_get({"business_id": -99, "func_name": "cron_api_use_count"})
             api_id_list = ApiMsg.get_id_list()
             change_dict = {}
@@ -130,7 +135,7 @@ class JobFuncs:
             "cron": "0 20 2 * * ?"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             ApiProject.clear_env(ApiProjectEnv)
             WebUiProject.clear_env(WebUiProjectEnv)
             AppUiProject.clear_env(AppUiProjectEnv)
@@ -144,7 +149,7 @@ class JobFuncs:
             "cron": "0 25 2 * * ?"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             ApiTask.clear_case_quote(ApiCase, ApiCaseSuite)
             WebUiTask.clear_case_quote(WebUiCase, WebUiCaseSuite)
             AppUiTask.clear_case_quote(AppUiCase, AppUiCaseSuite)
@@ -158,7 +163,7 @@ class JobFuncs:
             "cron": "0 0 18 ? * FRI"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             cls.run_task_report_count("cron_count_of_week", "week")
 
     @classmethod
@@ -170,7 +175,7 @@ class JobFuncs:
             "cron": "0 1 18 last * *"
         }
         """
-        with create_app().app_context():
+        with job_app_context():
             cls.run_task_report_count("cron_count_of_month", "month")
 
     @staticmethod
@@ -182,7 +187,7 @@ class JobFuncs:
         elif count_time == "month":
             count_day = 'DATE_FORMAT(create_time, "%Y%m") = DATE_FORMAT(CURDATE(), "%Y%m")'
 
-        with create_app().app_context():
+        with job_app_context():
             business_list = BusinessLine.query.filter(BusinessLine.receive_type != "not_receive").all()
 
             for business in business_list:
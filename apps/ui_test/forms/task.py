@@ -62,6 +62,9 @@ class AddTaskForm(BaseForm):
     is_async: int = Field(default=0, title="任务的运行机制", description="0：串行，1：并行，默认0")
     call_back: Optional[Union[list, dict]] = Field([], title="回调给流水线")
     push_hit: int = Field(title="任务不通过时，是否自动记录问题", description="任务不通过时，是否自动记录，0：不记录，1：记录，默认1")
+    run_policy: Optional[dict] = Field(
+        {}, title="执行策略", description="满足条件时不再执行剩下的用例，max_fail：不通过的用例数上限；"
+                                          "fail_rate、fail_rate_window：最近多少条用例中不通过的比例上限；health_check：用例不通过时是否探测运行环境")
 
     @field_validator("conf")
     def validate_conf(cls, value):
@@ -71,6 +74,7 @@ class AddTaskForm(BaseForm):
 
     def depends_validate(self):
         self.validate_cron()
+        self.validate_run_policy()
         self.validate_is_send()
 
 
@@ -80,6 +84,7 @@ class EditTaskForm(AddTaskForm, GetTaskForm):
     def depends_validate(self):
         """ 启用中 且 cron表达式有更改的，需要更新内存中的任务"""
         self.validate_cron()
+        self.validate_run_policy()
         self.validate_is_send()
         old_task = getattr(self, 'task')
         setattr(self.task, 'update_to_memory', old_task.status == 1 and self.cron != old_task.cron)
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
-from flask import current_app as app
+from flask import current_app as app, request
 
 from ..blueprint import ui_test
 from ..model_factory import WebUiReport as Report, WebUiReportStep as ReportStep, WebUiReportCase as ReportCase, \
     WebUiCaseSuite as CaseSuite
 from ..forms.report import GetReportForm, GetReportListForm, DeleteReportForm, GetReportCaseForm, \
     GetReportCaseListForm, GetReportStepForm, GetReportStepListForm, GetReportStatusForm, GetReportShowIdForm, \
-    GetReportStepImgForm, GetReportCaseSuiteListForm, ChangeReportStepStatus
+    GetReportEventForm, GetReportStepImgForm, GetReportCaseSuiteListForm, ChangeReportStepStatus
+from ...system.model_factory import RunQueue
 from utils.util.file_util import FileUtil
+from utils.util.report_event_util import ReportEventUtil
 
 
 @ui_test.login_get("/report/list")
@@ -31,6 +33,13 @@ def ui_get_report_status():
         Report.select_is_all_status_by_batch_id(form.batch_id, [form.process, form.status]))
 
 
+@ui_test.get("/report/events")
+def ui_get_report_events():
+    """ 订阅测试报告的执行状态变化（SSE），只推送有变化的部分，代替轮询 /report/status、/report/step-list """
+    form = GetReportEventForm()
+    return ReportEventUtil.make_sse_response(Report.__tablename__, form.report_id, request.headers.get("Last-Event-ID"))
+
+
 @ui_test.get("/report/show-id")
 def ui_get_report_show_id():
     """ 根据运行id获取当次要打开的报告 """
@@ -40,9 +49,12 @@ def ui_get_report_show_id():
 
 @ui_test.get("/report")
 def ui_get_report():
-    """ 获取测试报告 """
+    """ 获取测试报告，排队中的报告会返回在执行队列中的排队信息 """
     form = GetReportForm()
-    return app.restful.get_success(form.report.to_dict())
+    report = form.report.to_dict()
+    if report["process"] == 0:
+        report["queue"] = RunQueue.get_queue_info("ui", report["id"])
+    return app.restful.get_success(report)
 
 
 @ui_test.login_delete("/report")
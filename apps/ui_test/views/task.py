@@ -3,11 +3,10 @@ from flask import current_app as app
 
 from ..blueprint import ui_test
 from ...base_form import ChangeSortForm
-from ...busines import RunCaseBusiness
-from ..model_factory import WebUiReport as Report, WebUiCase as Case, WebUiCaseSuite as CaseSuite, WebUiTask as Task
+from ...busines import RunTaskBusiness
+from ..model_factory import WebUiTask as Task
 from ..forms.task import RunTaskForm, AddTaskForm, EditTaskForm, GetTaskForm, DeleteTaskForm, \
     GetTaskListForm
-from utils.client.run_ui_test import RunCase
 from ...config.models.config import Config
 from ...system.models.user import User
 
@@ -100,29 +99,4 @@ def ui_disable_task():
 def ui_run_task():
     """ 单次运行定时任务 """
     form = RunTaskForm()
-    for task in form.task_list:
-        case_id_list = CaseSuite.get_case_id(Case, task.project_id, task.suite_ids, task.case_ids)
-        batch_id = Report.get_batch_id()
-        env_list = form.env_list or task.env_list
-        for env_code in env_list:
-            report_id = RunCaseBusiness.run(
-                batch_id=batch_id,
-                env_code=env_code,
-                browser=form.browser if hasattr(form, 'browser') else task.browser,
-                trigger_type=form.trigger_type,
-                is_async=form.is_async,
-                project_id=task.project_id,
-                report_name=task.name,
-                task_type="task",
-                report_model=Report,
-                trigger_id=[task.id],
-                case_id_list=case_id_list,
-                run_type="ui",
-                runner=RunCase,
-                extend_data=form.extend,
-                task_dict=task.to_dict()
-            )
-    return app.restful.trigger_success({
-        "batch_id": batch_id,
-        "report_id": report_id if len(env_list) == 1 else None
-    })
+    return app.restful.trigger_success(RunTaskBusiness.run("ui", form))
@@ -147,6 +147,25 @@ api_default_validator = [
 # 测试步骤响应时间级别的映射，毫秒
 response_time_level = {"slow": 300, "very_slow": 1000}
 
+# 测试步骤执行进度的写入配置，granularity：live 实时进度、final 只写入最终结果，flush_interval：实时进度下合并写入的间隔，秒
+report_step_progress = {"granularity": "live", "flush_interval": 1}
+
+# 执行接口测试时，同一次运行内复用连接的连接池配置，keepalive_expiry单位为秒
+http_client_limits = {"max_connections": 100, "max_keepalive_connections": 20, "keepalive_expiry": 5}
+
+# 执行队列配置，enable：1 触发执行时写入队列，由执行进程(run_worker.py)领取执行，0 在接收请求的进程内直接执行（默认），
+#   为0时以下的准入控制（global_limit、project_limit、max_wait、priority）和分片都不生效，同时触发的执行不排队；
+# worker_count：每个执行进程同时执行的任务数，修改后要重启执行进程才生效，其余配置执行进程每次查询队列时重新读取，不用重启；lease_time_out：租约有效期，秒；heartbeat_interval：续租间隔，秒；
+# poll_interval：没有任务时查询队列的间隔，秒；max_attempt：租约过期后最多被领取执行的次数；
+# global_limit：所有节点同时执行的任务数上限，project_limit：同一个服务同时执行的任务数上限，0为不限制；
+# max_wait：排队超过这个时间（秒）则不再执行，报告按执行不通过结束，并回调流水线、发送通知；priority：各触发方式的优先级，越大越先执行，页面调试 > 流水线 > 定时任务
+# shard_size：并行执行的接口自动化，用例数超过这个数时按这个数切分成多个分片，由各节点领取执行，0为不分片
+run_queue = {
+    "enable": 0, "worker_count": 4, "lease_time_out": 60, "heartbeat_interval": 15, "poll_interval": 2, "max_attempt": 2,
+    "global_limit": 0, "project_limit": 0, "max_wait": 30 * 60, "priority": {"page": 30, "pipeline": 20, "cron": 10},
+    "shard_size": 0
+}
+
 # 回调流水线消息内容
 call_back_msg_addr = ""
 
@@ -313,7 +332,11 @@ def init_config():
             {"name": "default_account", "value": JsonUtil.dumps({"account": "admin", "password": "123456"}), "desc": "默认登录账号"},
             {"name": "save_func_permissions", "value": "0", "desc": "保存脚本权限，0所有人都可以，1管理员才可以"},
             {"name": "pause_step_time_out", "value": pause_step_time_out, "desc": "暂停测试步骤执行的超时时间"},
+            {"name": "report_step_progress", "value": JsonUtil.dumps(report_step_progress), "desc": "测试步骤执行进度的写入配置，granularity：live 实时展示执行进度，final 只写入最终结果；flush_interval：实时进度下合并写入的间隔，秒；协程执行（api_run_engine 为 asyncio）时不在事件循环中写库，实时进度只在步骤开始、结束时写入"},
             {"name": "shell_command_info", "value": JsonUtil.dumps(shell_command_info), "desc": "shell 造数据的，服务器信息"},
+            {"name": "run_case_max_workers", "value": 10, "desc": "并行执行用例时，单个测试报告同时执行的用例数上限"},
+            {"name": "node_run_case_max_workers", "value": 50, "desc": "并行执行用例时，单个服务进程同时执行的用例数上限，修改后需重启服务"},
+            {"name": "run_queue", "value": JsonUtil.dumps(run_queue), "desc": "执行队列配置，enable：1 写入队列由执行进程(run_worker.py)领取执行，多个节点分摊执行，0 在接收请求的进程内直接执行（默认），为0时准入控制（global_limit、project_limit、max_wait、priority）和分片都不生效，同时触发的执行不排队；worker_count：每个执行进程同时执行的任务数；lease_time_out：租约有效期（秒），执行节点宕机后，租约过期的任务会被其他节点重新领取；heartbeat_interval：续租间隔（秒）；poll_interval：没有任务时查询队列的间隔（秒）；max_attempt：最多被领取执行的次数；global_limit：所有节点同时执行的任务数上限，project_limit：同一个服务同时执行的任务数上限，0为不限制，超过上限的任务按优先级排队；max_wait：排队超过这个时间（秒）则不再执行，报告按执行不通过结束，并回调流水线、发送通知；priority：各触发方式的优先级，越大越先执行；shard_size：并行执行的接口自动化，用例数超过这个数时切分成多个分片由各节点领取执行，0为不分片"},
             {"name": "pip_command", "value": "pip", "desc": "执行 'pip install' 时指定的pip，或者pip的绝对路径，用于在线管理第三方库"},
             {
                 "name": "call_back_response",
@@ -331,6 +354,9 @@ def init_config():
             {"name": "run_time_error_message_send_addr", "value": "", "desc": "运行测试用例时，有错误信息实时通知地址"},
             {"name": "request_time_out", "value": 60, "desc": "运行测试步骤时，request超时时间"},
             {"name": "response_time_level", "value": JsonUtil.dumps(response_time_level), "desc": "测试步骤响应时间级别的映射，毫秒"},
+            {"name": "api_run_engine", "value": "thread", "desc": "接口自动化并行执行时使用的执行引擎，thread：每条用例一个线程，asyncio：所有用例在一个事件循环中以协程并发执行"},
+            {"name": "api_async_concurrency", "value": 100, "desc": "接口自动化使用协程（asyncio）执行时，同时执行的用例数上限"},
+            {"name": "http_client_limits", "value": JsonUtil.dumps(http_client_limits), "desc": "执行接口测试时，同一次运行内复用连接的连接池配置，max_connections：最大连接数，max_keepalive_connections：最大保活连接数，keepalive_expiry：空闲连接保活时间（秒）"},
             {
                 "name": "api_report_addr",
                 "value": "/api-test/report-show?id=",
@@ -1,18 +1,19 @@
 # -*- coding: utf-8 -*-
 import datetime
 
-import requests
 from flask import request
 from flask.views import MethodView
 from flask_apscheduler import APScheduler
 
 from apps.config.model_factory import Config
-from config import _job_server_port, _main_server_host
+from config import _job_server_port
 from utils.view import restful
 from utils.parse.parse_cron import parse_cron
 from apps import create_app
+from apps.dispatcher import get_task_dispatcher
 
-job = create_app()
+job = create_app()  # job服务常驻的app，触发执行时复用，不再每次都新建
+dispatcher = get_task_dispatcher(job)
 
 # 注册并启动定时任务
 scheduler = APScheduler()
@@ -21,31 +22,21 @@ scheduler.start()
 
 
 def request_run_task_api(task_id, task_type, skip_holiday=1):
-    """ 调执行任务接口 """
+    """ 触发执行任务，已持久化的定时任务引用的是这个方法名，不能改名
+    触发方式见 apps.dispatcher，默认在当前进程内直接触发
+    """
     job.logger.info(f'{"*" * 20} 开始触发执行定时任务 {"*" * 20}')
     if skip_holiday:
         today = datetime.datetime.now().strftime("%m-%d")
-        with create_app().app_context():
-            holiday_list = Config.get_first(name="holiday_list").value
+        with job.app_context():
+            holiday_list = Config.get_holiday_list()
         if today in holiday_list:
             job.logger.info(f'skip_holiday跳过执行')
             return
 
-    if isinstance(task_id, str) and task_id.startswith('cron'):  # 系统定时任务
-        api_addr = '/system/job/run'
-    else:  # 自动化测试定时任务
-        api_addr = f'/{task_type}-test/task/run'
-    request_url = f'{_main_server_host}/api{api_addr}'
-    request_data = {
-            "id": task_id, # 系统定时任务
-            "id_list": [task_id], # 自动化测试任务
-            "func_name": task_id,
-            "trigger_type": "cron"
-        }
-    re = requests.post(url=request_url, json=request_data)
-    job.logger.info(f'触发参数：\nurl: {_main_server_host}/api{api_addr}\n请求参数: {request_data}')
+    result = dispatcher.dispatch(task_id, task_type)
     job.logger.info(f'{"*" * 20} 定时任务触发完毕 {"*" * 20}')
-    job.logger.info(f'{"*" * 20} 触发响应为：{re.json()} {"*" * 20}')
+    job.logger.info(f'{"*" * 20} 触发结果为：{result} {"*" * 20}')
 
 
 class JobStatus(MethodView):
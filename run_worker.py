@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+""" 执行进程，配置项 run_queue 的 enable 为 1 时，触发执行的任务写入执行队列，由执行进程领取执行
+每个要参与执行的节点都启动一个: python run_worker.py [同时执行的任务数]
+"""
+import sys
+
+from apps import create_app
+from utils.client.run_queue_worker import RunQueueWorker
+
+app = create_app()
+
+if __name__ == '__main__':
+    RunQueueWorker(app, int(sys.argv[1]) if len(sys.argv) > 1 else None).run_forever()
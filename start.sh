@@ -5,3 +5,6 @@ echo "主应用启动完成"
 
 nohup python3 /usr/local/python3/bin/gunicorn -c gunicorn_config_job.py job:job &
 echo "任务调度应用启动完成"
+
+nohup python3 run_worker.py &
+echo "执行进程启动完成（配置项 run_queue 的 enable 为 1 时才会领取执行队列中的任务）"
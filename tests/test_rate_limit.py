@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+""" 按域名限流的测试：限流的key、分片限流配置、令牌桶 """
+import pytest
+
+from utils.client.test_runner.client import rate_limit
+from utils.client.test_runner.client.http import HttpClientPool
+from utils.client.test_runner.client.rate_limit import HostRateLimiter, get_host_key, split_rate_limit
+
+
+class FakeClock:
+    """ 替换限流模块的时钟，sleep 只推进时间并记录等待的秒数 """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleep_list = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleep_list.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", fake_clock)
+    return fake_clock
+
+
+def test_get_host_key_default_port():
+    assert get_host_key("http://Example.com/api") == get_host_key("http://example.com:80") == "http://example.com"
+    assert get_host_key("https://example.com:443/api") == "https://example.com"
+    assert get_host_key("http://example.com:8080/api") == "http://example.com:8080"
+    assert get_host_key("https://example.com:80") == "https://example.com:80"
+    assert get_host_key("http://[::1]:80/api") == "http://[::1]"
+    assert get_host_key("/api/login") is None
+
+
+def test_split_rate_limit():
+    rate_limit = {"rate": 10, "burst": 4, "max_in_flight": 5}
+    assert split_rate_limit(rate_limit, 1) == rate_limit
+    assert split_rate_limit(rate_limit, 4) == {"rate": 2.5, "burst": 1, "max_in_flight": 1}
+    assert split_rate_limit({"rate": 10, "burst": 0, "max_in_flight": 0}, 2) == {
+        "rate": 5, "burst": 1, "max_in_flight": 0}
+
+
+def test_host_rate_limiter_burst_and_rate(clock):
+    limiter = HostRateLimiter(rate=5, burst=3)
+    for index in range(3):  # 桶容量内的突发请求不用等
+        assert limiter.acquire() == 0
+    assert clock.sleep_list == []
+
+    assert limiter.reserve_token() == pytest.approx(1 / 5)  # 令牌用完，下一个请求等 1/rate 秒
+    assert limiter.reserve_token() == pytest.approx(2 / 5)  # 已预支的令牌要排在前面
+
+    clock.now += 10  # 时间过去后令牌恢复，最多恢复到桶容量
+    assert limiter.reserve_token() == 0
+
+
+def test_host_rate_limiter_acquire_wait(clock):
+    limiter = HostRateLimiter(rate=2, burst=1)
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == pytest.approx(500)  # 毫秒
+    assert clock.sleep_list == [pytest.approx(1 / 2)]
+
+
+def test_host_rate_limiter_per_host(clock):
+    pool = HttpClientPool(host_rate_limits={
+        "http://a.com": {"rate": 1, "burst": 1}, "http://b.com": {"rate": 1, "burst": 1}})
+    limiter_a, limiter_b = pool.get_host_limiter("http://a.com:80/api"), pool.get_host_limiter("http://b.com/api")
+    assert limiter_a is not limiter_b
+    assert limiter_a.reserve_token() == 0
+    assert limiter_a.reserve_token() == pytest.approx(1)
+    assert limiter_b.reserve_token() == 0  # 不同域名不共用令牌桶
+    assert pool.get_host_limiter("http://c.com/api") is None  # 没有配置限流的域名不限流
+    pool.close()
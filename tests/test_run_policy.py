@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+""" 执行策略的测试：记录用例结果触发停止、合并分片执行结果 """
+from utils.client.test_runner.run_policy import RunPolicy
+
+
+def test_merge_result_max_fail_across_shards():
+    run_policy = RunPolicy.get_run_policy({"max_fail": 3})
+    run_policy.merge_result(2)
+    assert not run_policy.is_stop()
+    run_policy.merge_result(1)
+    assert run_policy.stop_reason == "不通过的用例数达到3条"
+
+
+def test_merge_result_shard_stop_reason():
+    run_policy = RunPolicy.get_run_policy({"fail_rate": 0.5})
+    run_policy.merge_result(0, "最近20条用例不通过的比例为60%，达到50%")
+    assert run_policy.stop_reason == "最近20条用例不通过的比例为60%，达到50%"
+    run_policy.merge_result(1, "其他分片的停止原因")  # 以第一个停止原因为准
+    assert run_policy.stop_reason == "最近20条用例不通过的比例为60%，达到50%"
+
+
+def test_record_max_fail():
+    run_policy = RunPolicy.get_run_policy({"max_fail": 2})
+    for result in ("success", "fail", "success"):
+        run_policy.record(result)
+    assert not run_policy.is_stop() and run_policy.stop_reason is None
+    run_policy.record("error")
+    assert run_policy.is_stop()
+    assert run_policy.stop_reason == "不通过的用例数达到2条"
+
+
+def test_record_fail_rate_below_window():
+    """ 执行的用例数还不够一个窗口时不判断，前几条用例都不通过也不停止 """
+    run_policy = RunPolicy.get_run_policy({"fail_rate": 0.5, "fail_rate_window": 4})
+    for result in ("fail", "fail", "fail"):
+        run_policy.record(result)
+    assert not run_policy.is_stop() and run_policy.stop_reason is None
+
+
+def test_record_fail_rate_window():
+    run_policy = RunPolicy.get_run_policy({"fail_rate": 0.5, "fail_rate_window": 4})
+    for result in ("fail", "success", "success", "success", "fail"):
+        run_policy.record(result)
+    assert run_policy.stop_reason is None  # 最近4条中不通过的比例为25%
+    run_policy.record("fail")
+    assert run_policy.is_stop()
+    assert run_policy.stop_reason == "最近4条用例不通过的比例为50%，达到50%"
+
+
+def test_record_health_check(monkeypatch):
+    check_list = []
+    health_list = [True, False]
+
+    def check_health(self):
+        check_list.append(self.health_check_url)
+        return health_list[len(check_list) - 1]
+
+    monkeypatch.setattr(RunPolicy, "check_health", check_health)
+    run_policy = RunPolicy.get_run_policy(
+        {"health_check": 1, "health_check_interval": 0}, health_check_url="http://example.com/health")
+    run_policy.record("success")  # 用例通过不探测
+    assert check_list == []
+    run_policy.record("fail")  # 探测通过，不停止
+    assert len(check_list) == 1 and run_policy.stop_reason is None
+    run_policy.record("error")
+    assert len(check_list) == 2
+    assert run_policy.is_stop()
+    assert run_policy.stop_reason == "运行环境探测不通过：http://example.com/health"
+
+
+def test_record_health_check_interval(monkeypatch):
+    """ 两次探测至少间隔 health_check_interval 秒 """
+    check_list = []
+    monkeypatch.setattr(RunPolicy, "check_health", lambda self: check_list.append(1) or True)
+    run_policy = RunPolicy.get_run_policy(
+        {"health_check": 1, "health_check_interval": 60}, health_check_url="http://example.com/health")
+    run_policy.record("fail")
+    run_policy.record("fail")
+    assert len(check_list) == 1 and run_policy.stop_reason is None
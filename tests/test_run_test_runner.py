@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+""" RunTestRunner 并行执行（多线程）的测试，不连数据库，配置和执行器都替换为假的 """
+import threading
+
+import pytest
+from flask import Flask
+
+from apps.config.model_factory import Config
+from utils.client import run_test_runner
+from utils.client.run_test_runner import RunTestRunner
+from utils.client.test_runner.client.http import HttpClientPool
+
+config_dict = {
+    "request_time_out": 60,
+    "pause_step_time_out": 60,
+    "response_time_level": '{"slow": 300, "very_slow": 1000}',
+    "report_host": "http://localhost",
+    "api_report_addr": "/api-test/report?id=",
+    "api_run_engine": "thread",
+    "run_case_max_workers": 4,
+    "node_run_case_max_workers": 2,
+}
+
+
+class FakeReport:
+
+    def __init__(self):
+        self.run_case_start_count = 0
+
+    def run_case_start(self):
+        self.run_case_start_count += 1
+
+
+class FakeTestRunner:
+    """ 记录执行的用例和执行所在的线程，返回一条用例通过的统计 """
+    run_list = []
+    run_lock = threading.Lock()
+
+    def __init__(self):
+        self.summary = None
+
+    def run(self, test_plan):
+        with self.run_lock:
+            self.run_list.append((test_plan["report_case_list"], threading.current_thread().name))
+        self.summary = {"result": "success", "report_case_list": test_plan["report_case_list"]}
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    monkeypatch.setattr(Config, "get_all_config", classmethod(lambda cls: config_dict))
+    monkeypatch.setattr(run_test_runner, "TestRunner", FakeTestRunner)
+    monkeypatch.setattr(RunTestRunner, "_node_semaphore", None)
+    FakeTestRunner.run_list = []
+
+    run_test_runner_obj = RunTestRunner(report_id=1, env_code="test", run_type="api")
+    run_test_runner_obj.report = FakeReport()
+    run_test_runner_obj.test_plan["is_async"] = 1
+    run_test_runner_obj.test_plan["report_case_list"] = [11, 12, 13, 14, 15]
+    monkeypatch.setattr(run_test_runner_obj, "init_run_plan", lambda: None)
+    run_test_runner_obj.finish_summary_list = None
+    monkeypatch.setattr(
+        run_test_runner_obj, "update_run_case_status",
+        lambda summary_list: setattr(run_test_runner_obj, "finish_summary_list", summary_list))
+
+    app = Flask(__name__)
+    with app.app_context():
+        yield run_test_runner_obj
+
+
+def test_get_node_semaphore(runner):
+    node_semaphore = RunTestRunner.get_node_semaphore()
+    assert node_semaphore is RunTestRunner.get_node_semaphore()
+    # 最多同时执行 node_run_case_max_workers 条用例，名额用完后不能再获取
+    for index in range(config_dict["node_run_case_max_workers"]):
+        assert node_semaphore.acquire(blocking=False) is True
+    assert node_semaphore.acquire(blocking=False) is False
+    node_semaphore.release()
+    assert node_semaphore.acquire(blocking=False) is True
+
+
+def test_run_case_on_thread_pool(runner):
+    runner.run_case()
+
+    assert runner.report.run_case_start_count == 1
+    # 每条用例单独在线程池中执行，结果按用例顺序返回
+    assert sorted(report_case_list for report_case_list, thread_name in FakeTestRunner.run_list) == [
+        [11], [12], [13], [14], [15]]
+    assert all(thread_name.startswith("run_case_1") for report_case_list, thread_name in FakeTestRunner.run_list)
+    assert [summary["report_case_list"] for summary in runner.finish_summary_list] == [[11], [12], [13], [14], [15]]
+    # 测试计划只读共享，执行时不修改原来的用例列表
+    assert runner.test_plan["report_case_list"] == [11, 12, 13, 14, 15]
+
+
+def test_run_case_close_run_pool_on_error(runner, monkeypatch):
+    HttpClientPool.get_run_pool(runner.report_id)
+
+    def raise_error(summary_list):
+        raise RuntimeError("保存报告失败")
+
+    monkeypatch.setattr(runner, "update_run_case_status", raise_error)
+    with pytest.raises(RuntimeError):
+        runner.run_case()
+    # 执行异常也要释放此次运行的连接池
+    assert runner.report_id not in HttpClientPool._run_pool_dict
@@ -275,6 +275,7 @@ class ProjectModel(FormatModel):
         self.host = kwargs.get("host")
         self.variables = self.parse_variables(kwargs.get("variables", {}))
         self.headers = self.parse_list_data(kwargs.get("headers", {}))  # 接口自动化字段
+        self.keep_alive = kwargs.get("keep_alive") != 0  # 接口自动化字段，执行时是否复用连接
         self.app_package = kwargs.get("app_package")  # app自动化字段
         self.app_activity = kwargs.get("app_activity")  # app自动化字段
 
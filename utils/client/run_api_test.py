@@ -1,12 +1,8 @@
 # -*- coding: utf-8 -*-
 import copy
 
-from apps import create_app
-
 from apps.assist.model_factory import Script
-from apps.enums import DataStatusEnum
-from apps.api_test.model_factory import ApiCaseSuite as CaseSuite, ApiMsg as Api, ApiStep as Step, \
-    ApiReportCase as ReportCase, ApiReportStep as reportStep
+from apps.api_test.model_factory import ApiReportCase as ReportCase
 from utils.logs.log import logger
 from utils.client.parse_model import StepModel, FormatModel
 from utils.client.run_test_runner import RunTestRunner
@@ -24,7 +20,7 @@ class RunApi(RunTestRunner):
 
     def parse_and_run(self):
         """ 把解析放到异步线程里面 """
-        with create_app().app_context():  # 手动入栈
+        with self.get_app().app_context():  # 手动入栈
             Script.create_script_file(self.env_code)  # 创建所有函数文件
             self.report = self.report_model.get_first(id=self.report_id)
             self.project = self.get_format_project(self.report.project_id)  # 解析当前服务信息
@@ -41,7 +37,7 @@ class RunApi(RunTestRunner):
             api_dict = self.get_format_api(self.project, api_id)
 
             # 记录解析下后的用例，单接口运行时，没有用例，为了统一数据结构，所以把接口视为一条用例
-            report_case = ReportCase.model_create_and_get({
+            report_case = {
                 "report_id": self.report_id,
                 "name": api_dict["name"],
                 "run_type": "api",
@@ -52,7 +48,7 @@ class RunApi(RunTestRunner):
                     "variables": self.project.variables
                 },
                 "summary": ReportCase.get_summary_template()
-            })
+            }
 
             # 合并头部信息
             step_headers = {}
@@ -60,14 +56,13 @@ class RunApi(RunTestRunner):
             step_headers.update(api_dict["request"]["headers"])
             api_dict["request"]["headers"] = step_headers
 
-            reportStep.model_create({
+            self.add_report_case(report_case, [{
                 "element_id": api_dict["id"],
                 "report_id": self.report_id,
-                "report_case_id": report_case.id,
                 "name": api_dict["name"],
                 "step_data": api_dict
-            })
-            self.test_plan["report_case_list"].append(report_case.id)
+            }])
+        self.flush_report_case_batch()
         self.init_parsed_data()
 
 
@@ -82,17 +77,21 @@ class RunCase(RunTestRunner):
         self.test_plan["is_async"] = is_async
         self.case_id_list = case_id_list  # 要执行的用例id_list
         self.all_case_steps = []  # 所有测试步骤
+        self.app = kwargs.get("current_app")
+        self.run_queue = kwargs.get("run_queue")
+        self.run_queue_worker = kwargs.get("run_queue_worker")
+        self.parent_id = kwargs.get("parent_id")
 
     def parse_and_run(self):
         """ 把解析放到异步线程里面 """
-        with create_app().app_context():  # 手动入栈
+        with self.get_app().app_context():  # 手动入栈
             Script.create_script_file(self.env_code)  # 创建所有函数文件
             self.report = self.report_model.get_first(id=self.report_id)
             self.parse_all_case()
             self.report.parse_data_finish()
             self.run_case()
 
-    def parse_step(self, current_project, project, current_case, case, api, step, report_case_id):
+    def parse_step(self, current_project, project, current_case, case, api, step):
         """ 解析测试步骤
         current_project: 当前用例所在的服务(解析后的)
         project: 当前步骤对应接口所在的服务(解析后的)
@@ -100,7 +99,7 @@ class RunCase(RunTestRunner):
         case: 被引用的case
         api: 解析后的api
         step: 原始step
-        返回解析后的步骤 {}
+        返回解析后的报告步骤数据 {}，report_case_id 在批量写入用例后再补上
         """
         # 解析头部信息，继承头部信息，接口所在服务、当前所在服务、用例、步骤
         headers = {}
@@ -126,6 +125,7 @@ class RunCase(RunTestRunner):
             "extract": step.extracts,  # 接口要提取的信息
             "validate": step.validates,  # 接口断言信息
             "base_url": current_project.host if step.replace_host == 1 else project.host,
+            "keep_alive": project.keep_alive,  # 是否复用连接，以接口所在服务的设置为准
             "request": {
                 "method": api["request"]["method"],
                 "url": api["request"]["url"],
@@ -138,24 +138,21 @@ class RunCase(RunTestRunner):
                 "follow_redirects": step.allow_redirect # httpx的重定向字段
             }
         }
-        reportStep.model_create({
+        return {
             "element_id": api["id"],
             "step_id": step.id,
             "case_id": step.case_id,
             "report_id": self.report_id,
-            "report_case_id": report_case_id,
             "name": step_data["name"],
             "step_data": step_data
-        })
+        }
 
     def get_all_steps(self, case_id: int):
         """ 解析引用的用例 """
         case = self.get_format_case(case_id)
 
         if self.parse_case_is_skip(case.skip_if) is not True:  # 不满足跳过条件才解析
-            steps = Step.query.filter_by(
-                case_id=case.id, status=DataStatusEnum.ENABLE.value).order_by(Step.num.asc()).all()
-            for step in steps:
+            for step in self.get_case_steps(case.id):
                 if step.quote_case:
                     self.get_all_steps(step.quote_case)
                 else:
@@ -164,7 +161,74 @@ class RunCase(RunTestRunner):
                     self.api_set.add(step.api_id)
 
     def parse_all_case(self):
-        """ 解析所有用例 """
+        """ 解析所有用例，用例、步骤、接口等依赖的数据都没有变化时，直接使用上次解析的结果 """
+        if self.parent_id:  # 重跑不通过的用例
+            self.parse_not_passed_case()
+        else:
+            plan_key = self.get_parse_plan_key(self.case_id_list, temp_variables=self.temp_variables)
+            fingerprint = self.get_parse_plan_fingerprint(self.case_id_list)
+            if self.load_parse_plan(plan_key, fingerprint) is False:
+                self.parse_plan_record = {"report_case_list": [], "script_id_list": []}
+                self.parse_case_data()
+                self.save_parse_plan(plan_key, fingerprint, self.case_id_list)
+            self.report.update_parse_plan_key(plan_key, fingerprint)
+        self.flush_report_case_batch()
+
+        # 去除服务级的公共变量，保证用步骤上解析后的公共变量
+        self.test_plan["project_mapping"]["variables"] = {}
+        self.init_parsed_data()
+
+    def parse_not_passed_case(self):
+        """ 重跑报告中不通过的用例，只重跑不通过的数据行（用例id + 第几次运行 + 数据驱动的第几行）
+        被重跑报告使用的解析计划还在、且依赖的数据都没有变化时，直接取解析计划中对应的数据行，否则重新解析这些数据行
+        """
+        parent_report = self.report_model.get_first(id=self.parent_id)
+        row_key_set = {
+            self.report_case_model.get_row_key(report_case.case_id, report_case.run_index, report_case.data_driver_index)
+            for report_case in self.report_case_model.get_not_passed_case_list(self.parent_id)
+        }
+
+        plan_row_list = self.get_parent_parse_plan_row_list(parent_report, row_key_set)
+        if plan_row_list is not None:
+            logger.info(f'重跑报告【{self.parent_id}】中不通过的用例，使用解析计划：{parent_report.parse_plan_key}')
+            self.parse_functions(plan_row_list["script_id_list"])
+            for plan_report_case, report_step_list, is_skip in plan_row_list["report_case_list"]:
+                plan_report_case["report_id"] = self.report_id
+                for report_step in report_step_list:
+                    report_step["report_id"] = self.report_id
+                    self.api_set.add(report_step["element_id"])
+                self.count_step += len(report_step_list)
+                self.append_report_case_batch(plan_report_case, report_step_list, is_skip)
+        else:
+            logger.info(f'重跑报告【{self.parent_id}】中不通过的用例，依赖的数据有变化，重新解析')
+            self.case_id_list = list(dict.fromkeys(case_id for case_id, run_index, data_driver_index in row_key_set))
+            self.parse_case_data(row_key_set)
+
+    def get_parent_parse_plan_row_list(self, parent_report, row_key_set):
+        """ 从被重跑报告的解析计划中取要重跑的数据行，取不到返回None
+        解析计划缓存按key共用，可能已被之后的执行覆盖，所以缓存的指纹要和被重跑报告记录的一致，且和当前数据一致
+        """
+        if not (parent_report.parse_plan_key and parent_report.parse_plan_fingerprint):
+            return None
+        parse_plan = self.get_parse_plan(parent_report.parse_plan_key)
+        if parse_plan is None or parse_plan["fingerprint"] != parent_report.parse_plan_fingerprint:
+            return None
+
+        report_case_list = [
+            plan_row for plan_row in parse_plan["report_case_list"]
+            if self.report_case_model.get_row_key(
+                plan_row[0].get("case_id"), plan_row[0].get("run_index"), plan_row[0].get("data_driver_index")
+            ) in row_key_set
+        ]
+        if len(report_case_list) != len(row_key_set):
+            return None
+        return {"script_id_list": parse_plan["script_id_list"], "report_case_list": report_case_list}
+
+    def parse_case_data(self, row_key_set=None):
+        """ 从数据库中取数据解析所有用例
+        row_key_set: 只解析这些数据行（用例id + 第几次运行 + 数据驱动的第几行），用于重跑不通过的用例，不传则解析所有数据行
+        """
+        self.prefetch_case_data(self.case_id_list)  # 一次性把要用到的数据查出来
 
         # 遍历要运行的用例
         for case_id in self.case_id_list:
@@ -180,79 +244,106 @@ class RunCase(RunTestRunner):
                 current_case.skip_if = FormatModel().parse_skip_if(self.temp_variables.get("skip_if"))
                 current_case.run_times = self.temp_variables.get("run_times", 1)
 
-            for case_index in range(current_case.run_times or 1):
+            # 用例的公共变量设置了数据驱动
+            data_driver_dict = current_case.variables.get("data_driver_dict", {"key": "", "value": []})
+            if data_driver_dict["key"] == "":
+                data_driver_dict = {"key": "data", "value": ["nothing"]}
+            if not data_driver_dict["value"]:
+                continue
 
-                # 用例的公共变量设置了数据驱动
-                data_driver_dict = current_case.variables.get("data_driver_dict", {"key": "", "value": []})
-                if data_driver_dict["key"] == "":
-                    data_driver_dict = {"key": "data", "value": ["nothing"]}
+            # 用例只解析一次，每次运行、数据驱动的每一行数据，只是在解析结果上替换数据驱动的变量，执行时再解析变量
+            current_case.variables[data_driver_dict["key"]] = data_driver_dict["value"][0]
+            report_case_data, report_step_list, step_count = self.parse_case_once(case_id, current_case)
+            current_case.variables[data_driver_dict["key"]] = data_driver_dict["value"][-1]
 
+            for case_index in range(current_case.run_times or 1):
                 for data_driver_index, data_driver_value in enumerate(data_driver_dict["value"]):
-                    current_case.variables[data_driver_dict["key"]] = data_driver_value
+                    if row_key_set is not None and self.report_case_model.get_row_key(
+                            current_case.id, case_index, data_driver_index) not in row_key_set:
+                        continue
                     case_name = f'{current_case.name}_{case_index + 1}' if current_case.run_times > 1 else current_case.name
                     case_name = f'{case_name}_{data_driver_index}' if data_driver_index > 0 else case_name
 
-                    # 记录解析下后的用例
-                    report_case_data = current_case.get_attr()
-                    report_case_data["run_env"] = self.env_code
-                    report_case = ReportCase.model_create_and_get({
+                    # 记录解析下后的用例，当前数据驱动的值作为变量覆盖到解析结果上
+                    report_case = {
                         "name": case_name,
                         "case_id": current_case.id,
                         "suite_id": current_case.suite_id,
                         "report_id": self.report_id,
-                        "case_data": report_case_data,
+                        "run_index": case_index,
+                        "data_driver_index": data_driver_index,
+                        "case_data": {
+                            **report_case_data,
+                            "variables": {**report_case_data["variables"], data_driver_dict["key"]: data_driver_value}
+                        },
                         "summary": ReportCase.get_summary_template()
-                    })
+                    }
 
                     # 满足跳过条件则跳过
-                    if self.parse_case_is_skip(current_case.skip_if) is True:
-                        report_case.test_is_skip()
+                    if report_step_list is None:
+                        report_case["result"] = "skip"
+                        self.add_report_case(report_case, [], is_skip=True, is_frozen=True)
                         continue
 
-                    current_project = self.get_format_project(CaseSuite.get_first(id=current_case.suite_id).project_id)
-                    self.get_all_steps(case_id)  # 递归获取测试步骤（中间有可能某些测试步骤是引用的用例）
-
-                    # 循环解析测试步骤
-                    all_variables = {}  # 当前用例的所有公共变量
-                    for step in self.all_case_steps:
-                        step = StepModel(**step.to_dict())
-                        step_case = self.get_format_case(step.case_id)
-                        api_temp = Api.get_first(id=step.api_id)
-                        api_project = self.get_format_project(api_temp.project_id)
-                        api_data = self.get_format_api(api_project, api_obj=api_temp)
-
-                        if step.data_driver:  # 如果有step.data_driver，则说明是数据驱动， 此功能废弃
-                            """
-                            数据驱动格式
-                            [
-                                {"comment": "用例1描述", "data": "请求数据，支持参数化"},
-                                {"comment": "用例2描述", "data": "请求数据，支持参数化"}
-                            ]
-                            """
-                            for driver_data in step.data_driver:
-                                # 数据驱动的 comment 字段，用于做标识
-                                step.name += driver_data.get("comment", "")
-                                step.params = step.params = step.data_json = step.data_form = driver_data.get("data", {})
-                                self.parse_step(current_project, api_project, current_case, step_case, api_data, step, report_case.id)
-                        else:
-                            self.parse_step(current_project, api_project, current_case, step_case, api_data, step, report_case.id)
-
-                        # 把服务和用例的的自定义变量留下来
-                        all_variables.update(api_project.variables)
-                        all_variables.update(step_case.variables)
-
-                    # 更新当前服务+当前用例的自定义变量，最后以当前用例设置的自定义变量为准
-                    all_variables.update(current_project.variables)
-                    all_variables.update(current_case.variables)
-                    report_case_data["variables"].update(all_variables)  # = all_variables
-                    report_case_data["run_type"] = self.run_type
-                    report_case.update_report_case_data(report_case_data)
-
-                    self.test_plan["report_case_list"].append(report_case.id)
-
-                    # 完整的解析完一条用例后，去除对应的解析信息
-                    self.all_case_steps = []
+                    self.count_step += step_count
+                    self.add_report_case(
+                        report_case, [dict(report_step) for report_step in report_step_list], is_frozen=True)
 
-        # 去除服务级的公共变量，保证用步骤上解析后的公共变量
-        self.test_plan["project_mapping"]["variables"] = {}
-        self.init_parsed_data()
+    def parse_case_once(self, case_id, current_case):
+        """ 解析一条用例，返回 (用例数据, 解析后的步骤, 步骤数)，满足跳过条件时步骤为None
+        返回的数据已经固定下来，不会再被后续的解析修改，数据驱动的每一行数据共用
+        """
+        report_case_data = current_case.get_attr()
+        report_case_data["run_env"] = self.env_code
+
+        if self.parse_case_is_skip(current_case.skip_if) is True:
+            return self.report_case_model.loads(self.report_case_model.dumps(report_case_data)), None, 0
+
+        current_project = self.get_format_project(self.get_suite_project_id(current_case.suite_id))
+        count_step = self.count_step
+        self.get_all_steps(case_id)  # 递归获取测试步骤（中间有可能某些测试步骤是引用的用例）
+        step_count, self.count_step = self.count_step - count_step, count_step  # 步骤数在添加每一行数据的用例时再累加
+
+        # 循环解析测试步骤
+        all_variables = {}  # 当前用例的所有公共变量
+        report_step_list = []  # 当前用例解析后的步骤
+        for step in self.all_case_steps:
+            step = StepModel(**step.to_dict())
+            step_case = self.get_format_case(step.case_id)
+            api_temp = self.get_element_obj(step.api_id)
+            api_project = self.get_format_project(api_temp.project_id)
+            api_data = self.get_format_api(api_project, api_obj=api_temp)
+
+            if step.data_driver:  # 如果有step.data_driver，则说明是数据驱动， 此功能废弃
+                """
+                数据驱动格式
+                [
+                    {"comment": "用例1描述", "data": "请求数据，支持参数化"},
+                    {"comment": "用例2描述", "data": "请求数据，支持参数化"}
+                ]
+                """
+                for driver_data in step.data_driver:
+                    # 数据驱动的 comment 字段，用于做标识
+                    step.name += driver_data.get("comment", "")
+                    step.params = step.params = step.data_json = step.data_form = driver_data.get("data", {})
+                    report_step_list.append(
+                        self.parse_step(current_project, api_project, current_case, step_case, api_data, step))
+            else:
+                report_step_list.append(
+                    self.parse_step(current_project, api_project, current_case, step_case, api_data, step))
+
+            # 把服务和用例的的自定义变量留下来
+            all_variables.update(api_project.variables)
+            all_variables.update(step_case.variables)
+
+        # 更新当前服务+当前用例的自定义变量，最后以当前用例设置的自定义变量为准
+        all_variables.update(current_project.variables)
+        all_variables.update(current_case.variables)
+        report_case_data["variables"].update(all_variables)  # = all_variables
+        report_case_data["run_type"] = self.run_type
+
+        # 完整的解析完一条用例后，去除对应的解析信息
+        self.all_case_steps = []
+        report_case_data, report_step_list = self.report_case_model.loads(
+            self.report_case_model.dumps([report_case_data, report_step_list]))
+        return report_case_data, report_step_list, step_count
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import threading
+import traceback
+
+from apps.api_test.model_factory import ApiReport
+from apps.ui_test.model_factory import WebUiReport
+from apps.app_test.model_factory import AppUiReport
+from apps.config.model_factory import Config
+from apps.enums import RunQueueStatusEnum
+from apps.system.model_factory import RunQueue
+from utils.client.test_runner.exceptions import RunLeaseLost
+from utils.logs.log import logger
+
+
+class RunQueueWorker:
+    """ 执行进程，从执行队列中领取任务执行，多个节点都启动执行进程即可分摊执行
+    worker_count 个线程各自领取、执行任务，一个心跳线程给本进程正在执行的任务续租，
+    并把租约过期且不能再重试的任务置为失败、把排队超时的任务置为不再执行
+    任务分为整个报告和报告的分片，分片执行完只回写执行结果，由报告所在的节点合并生成测试报告
+    """
+    report_model_mapping = {"api": ApiReport, "ui": WebUiReport, "app": AppUiReport}
+
+    def __init__(self, app, worker_count=None):
+        self.app = app
+        self.lease_owner = f'{socket.gethostname()}:{os.getpid()}'
+        with app.app_context():
+            self.config = Config.get_run_queue()
+        self.worker_count = worker_count or int(self.config["worker_count"])
+        self.running_dict = {}  # 本进程正在执行的任务，{任务id: 领取时的执行次数}
+        self.lease_lost_id_set = set()  # 本进程正在执行、但租约已被接管的任务id
+        self.running_id_lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def reload_config(self):
+        """ 重新读取执行队列配置，配置页修改的轮询间隔、租约有效期、准入上限等不用重启执行进程即可生效
+        同时执行的任务数（worker_count）在启动时确定，修改后要重启执行进程才生效
+        读取失败则继续使用上一次读取的配置
+        """
+        try:
+            with self.app.app_context():
+                self.config = Config.get_run_queue()
+        except Exception as error:
+            logger.error(f'读取执行队列配置失败，继续使用上一次读取的配置：{error}')
+
+    def run_forever(self):
+        """ 启动执行线程和心跳线程，阻塞直到收到停止信号 """
+        logger.info(f'执行进程【{self.lease_owner}】启动，同时执行的任务数：{self.worker_count}')
+        thread_list = [threading.Thread(target=self.heartbeat_loop, name="run_queue_heartbeat", daemon=True)]
+        thread_list.extend([
+            threading.Thread(target=self.work_loop, name=f'run_queue_worker_{index}', daemon=True)
+            for index in range(self.worker_count)
+        ])
+        for thread in thread_list:
+            thread.start()
+        try:
+            while not self.stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def work_loop(self):
+        """ 领取一个任务执行，没有待执行的任务则等待 poll_interval 秒再领取 """
+        while not self.stop_event.is_set():
+            self.reload_config()
+            try:
+                with self.app.app_context():
+                    queue_list = RunQueue.lease(
+                        self.lease_owner, int(self.config["lease_time_out"]),
+                        global_limit=int(self.config["global_limit"]), project_limit=int(self.config["project_limit"]))
+                for queue in queue_list:
+                    self.run_queue(queue)
+            except Exception as error:
+                queue_list = []
+                logger.error(f'领取执行队列的任务失败：{error}')
+            if not queue_list:
+                self.stop_event.wait(float(self.config["poll_interval"]))
+
+    def run_report_shard(self, report_id, run_type):
+        """ 领取并执行指定报告的一个分片，报告所在的节点等待分片执行完毕期间调用，没有可领取的分片返回False """
+        with self.app.app_context():
+            queue_list = RunQueue.lease(
+                self.lease_owner, int(self.config["lease_time_out"]), report_id=report_id, run_type=run_type)
+        for queue in queue_list:
+            self.run_queue(queue)
+        return len(queue_list) > 0
+
+    def run_queue(self, queue):
+        """ 执行任务，执行失败的还能重试则放回队列，否则置为失败 """
+        logger.info(
+            f'执行进程【{self.lease_owner}】领取到任务：{queue.id}，报告id：{queue.report_id}，'
+            f'执行单元：{queue.unit_type}，第{queue.attempt}次执行')
+        with self.running_id_lock:
+            self.running_dict[queue.id] = queue.attempt
+        status, error, result = RunQueueStatusEnum.done.value, None, None
+        try:
+            with self.app.app_context():
+                runner = RunQueue.import_class(queue.runner)(
+                    **queue.run_params, current_app=self.app, run_queue=queue, run_queue_worker=self)
+                if queue.unit_type == "shard":
+                    result = runner.run_shard(**queue.shard)
+                else:
+                    self.set_report_start(queue)
+                    if queue.attempt > 1:  # 之前领取的节点没有执行完，从头开始执行，之前切分的分片不再执行
+                        RunQueue.reject_shard_list(queue.report_id, queue.run_type)
+                        runner.clear_report_detail()
+                    runner.parse_and_run()
+        except RunLeaseLost as error:  # 租约已被接管，以接管的节点为准，不再修改队列和报告
+            logger.warning(f'执行队列的任务【{queue.id}】停止执行：{error}')
+        except Exception:
+            error = traceback.format_exc()
+            logger.error(f'执行队列的任务【{queue.id}】执行失败：\n{error}')
+            if queue.attempt < queue.max_attempt:
+                status = RunQueueStatusEnum.pending.value
+            else:
+                status = RunQueueStatusEnum.failed.value
+        finally:
+            with self.running_id_lock:
+                self.running_dict.pop(queue.id, None)
+                self.lease_lost_id_set.discard(queue.id)
+
+        with self.app.app_context():
+            if queue.release(self.lease_owner, status, error, result) and status == RunQueueStatusEnum.failed.value:
+                self.set_report_fail(queue, f'执行失败，且已达到最大执行次数：{queue.max_attempt}')
+
+    def heartbeat_loop(self):
+        """ 每 heartbeat_interval 秒给正在执行的任务续租一次 """
+        while not self.stop_event.wait(float(self.config["heartbeat_interval"])):
+            self.reload_config()
+            try:
+                with self.running_id_lock:
+                    running_dict = dict(self.running_dict)
+                with self.app.app_context():
+                    if RunQueue.heartbeat(
+                            self.lease_owner, running_dict, int(self.config["lease_time_out"])) < len(running_dict):
+                        self.set_lease_lost(RunQueue.get_lease_lost_id_list(self.lease_owner, running_dict))
+                    self.fail_exhausted_queue()
+                    self.reject_wait_time_out_queue()
+            except Exception as error:
+                logger.error(f'执行队列续租失败：{error}')
+
+    def set_lease_lost(self, lease_lost_id_list):
+        """ 标记租约已被接管的任务，执行器在执行下一条用例前、写入报告前检查，发现后停止执行 """
+        if not lease_lost_id_list:
+            return
+        logger.warning(f'执行进程【{self.lease_owner}】有任务的租约已过期，已被其他节点接管：{lease_lost_id_list}')
+        with self.running_id_lock:
+            self.lease_lost_id_set.update(
+                queue_id for queue_id in lease_lost_id_list if queue_id in self.running_dict)
+
+    def is_lease_lost(self, queue_id):
+        return queue_id in self.lease_lost_id_set
+
+    def fail_exhausted_queue(self):
+        """ 租约过期、且已经达到最大执行次数的任务（领取的节点都宕机了），置为失败，并结束对应的报告 """
+        for queue in RunQueue.get_expired_exhausted_list():
+            if queue.release(queue.lease_owner, RunQueueStatusEnum.failed.value, "租约过期，且已达到最大执行次数"):
+                self.set_report_fail(queue, "执行节点没有按时续租，且已达到最大执行次数")
+
+    def reject_wait_time_out_queue(self):
+        """ 排队超过 max_wait 秒的任务不再执行，并结束对应的报告 """
+        max_wait = int(self.config["max_wait"])
+        if max_wait <= 0:
+            return
+        for queue in RunQueue.get_wait_time_out_list(max_wait):
+            if queue.reject():
+                logger.warning(f'执行队列的任务【{queue.id}】排队超过{max_wait}秒，不再执行，报告id：{queue.report_id}')
+                self.set_report_fail(queue, f'排队超过{max_wait}秒，不再执行')
+
+    def set_report_start(self, queue):
+        """ 报告从排队中变为解析数据中 """
+        report = self.report_model_mapping[queue.run_type].get_first(id=queue.report_id)
+        if report and report.process == 0:
+            report.parse_data_start()
+
+    def set_report_fail(self, queue, reason):
+        """ 任务不会再执行了，报告按执行不通过走正常的结束流程（保存报告、回调流水线、发送通知）
+        分片失败由报告所在的节点把分片内的用例记为错误，不直接结束报告
+        """
+        if queue.unit_type != "report":
+            return
+        try:
+            runner = RunQueue.import_class(queue.runner)(**queue.run_params, current_app=self.app)
+            runner.finish_report_without_run(reason)
+        except Exception:
+            logger.error(f'结束执行队列的任务【{queue.id}】的报告失败：\n{traceback.format_exc()}')
+            report = self.report_model_mapping[queue.run_type].get_first(id=queue.report_id)
+            if report:  # 至少把报告置为执行完毕、不通过，避免报告一直显示执行中
+                report.update_report_result("fail")
+                report.save_report_finish()
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
-import copy
+import hashlib
 import json
-import types
-import importlib
-from threading import Thread
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
 
 from apps import create_app
 from apps.api_test.model_factory import ApiCaseSuite, ApiMsg, ApiCase, ApiStep, ApiProject, ApiProjectEnv, ApiReport, \
     ApiReportCase, ApiReportStep
 from apps.system.models.user import User
+from apps.system.model_factory import RunQueue, ParsePlan
 from apps.ui_test.model_factory import WebUiProject, WebUiProjectEnv, WebUiElement, WebUiCaseSuite, WebUiCase, \
     WebUiStep, \
     WebUiReport, WebUiReportCase, WebUiReportStep
@@ -17,16 +21,26 @@ from apps.app_test.model_factory import AppUiProject, AppUiProjectEnv, AppUiElem
 from apps.config.model_factory import RunEnv, WebHook
 from apps.assist.model_factory import Script, Hits
 from apps.config.model_factory import Config
-from apps.enums import TriggerTypeEnum, ReceiveTypeEnum
-from utils.client.test_runner.api import TestRunner
+from apps.enums import TriggerTypeEnum, ReceiveTypeEnum, DataStatusEnum, RunQueueStatusEnum
+from utils.client.test_runner.api import TestRunner, AsyncTestRunner
+from utils.client.test_runner.exceptions import RunLeaseLost
 from utils.client.test_runner.utils import build_url
+from utils.client.test_runner.client.http import HttpClientPool
+from utils.client.test_runner.client.rate_limit import get_host_key, merge_rate_limit, split_rate_limit
 from utils.client.test_runner import built_in
+from utils.client.test_runner.function_registry import FunctionRegistry
+from utils.client.test_runner.run_policy import RunPolicy
 from utils.client.parse_model import ProjectModel, ApiModel, CaseModel, ElementModel
 from utils.logs.log import logger
 from utils.message.send_report import send_report, call_back_for_pipeline
 
 
 class RunTestRunner:
+    _node_semaphore = None  # 当前服务进程并行执行用例的数量限制
+    _node_semaphore_lock = Lock()
+    _shard_run_count = {}  # 当前进程正在执行的各报告的分片数，{report_id: 分片数}，为0时才释放报告的连接池
+    _shard_run_lock = Lock()
+    report_case_batch_size = 200  # 解析时，每解析多少条用例批量写入一次
 
     def __init__(
             self, report_id=None, env_code=None, env_name=None, run_type="api", extend={}, task_dict={}):
@@ -36,6 +50,10 @@ class RunTestRunner:
         self.report_id = report_id
         self.run_type = run_type
         self.task_dict = task_dict
+        self.app = None  # 触发执行的app，有则在异步线程中复用，不再新建
+        self.run_queue = None  # 从执行队列领取执行时，领取到的队列数据
+        self.run_queue_worker = None  # 从执行队列领取执行时，领取的执行进程
+        self.parent_id = None  # 重跑不通过的用例时，被重跑的报告id
 
         self.time_out = 60
         self.wait_time_out = 5
@@ -46,9 +64,17 @@ class RunTestRunner:
         self.parsed_case_dict = {}
         self.parsed_api_dict = {}
         self.parsed_element_dict = {}
+        self.prefetched = {}  # 预加载的解析数据
         self.run_env = None
         self.report = None
+        self.report_case_batch = []  # 已解析、待批量写入的用例和步骤
+        self.parse_plan_record = None  # 记录解析结果，用于保存为解析计划缓存
+        self.script_id_list = []  # 此次执行加载的脚本，用于分片执行时在其他节点加载
         self.response_time_level = {"slow": 0, "very_slow": 0}
+        self.http_client_limits = {}
+        self.shard_count = 1  # 执行分片时，报告切分的分片数，限流配置按分片数平分
+        self.run_engine = "thread"
+        self.async_concurrency = 100
         self.api_model = ApiMsg
         self.element_model = None
         if self.run_type == "api":  # 接口自动化
@@ -62,6 +88,9 @@ class RunTestRunner:
             self.report_step_model = ApiReportStep
             self.time_out = Config.get_request_time_out()
             self.response_time_level = Config.get_response_time_level()
+            self.http_client_limits = Config.get_http_client_limits()
+            self.run_engine = Config.get_api_run_engine()
+            self.async_concurrency = Config.get_api_async_concurrency()
             self.front_report_addr = f'{Config.get_report_host()}{Config.get_api_report_addr()}'
         elif self.run_type == "ui":  # web-ui自动化
             self.project_model = WebUiProject
@@ -98,6 +127,8 @@ class RunTestRunner:
             "report_step_model": self.report_step_model,
             "response_time_level": self.response_time_level,
             "pause_step_time_out": Config.get_pause_step_time_out(),
+            "report_step_progress": Config.get_report_step_progress(),
+            "http_client_limits": self.http_client_limits,
             "project_mapping": {
                 "functions": {},
                 "variables": {},
@@ -107,13 +138,276 @@ class RunTestRunner:
 
         self.init_parsed_data()
 
+    def get_app(self):
+        """ 执行测试用的app，触发方传了app则复用，否则新建一个 """
+        return self.app or create_app()
+
     def init_parsed_data(self):
         self.parsed_project_dict = {}
         self.parsed_case_dict = {}
         self.parsed_api_dict = {}
         self.parsed_element_dict = {}
+        self.prefetched = {}
         self.run_env = None
 
+    def prefetch_case_data(self, case_id_list):
+        """ 解析用例前，用固定的几次批量查询把要用到的数据一次性查出来，解析时直接从内存中取
+        包括：用例及其引用用例（递归）、步骤、接口/元素、用例集、服务、服务环境、运行环境
+        """
+        element_model = self.api_model if self.run_type == "api" else self.element_model
+        element_filed = "api_id" if self.run_type == "api" else "element_id"
+        case_dict, step_dict = {}, {}
+
+        # 按层查用例和步骤，直到没有新的引用用例
+        to_load_case_id_set = set(case_id_list)
+        while to_load_case_id_set:
+            case_dict.update({
+                case.id: case.to_dict()
+                for case in self.case_model.query.filter(self.case_model.id.in_(to_load_case_id_set)).all()
+            })
+            step_list = self.step_model.query.filter(
+                self.step_model.case_id.in_(to_load_case_id_set), self.step_model.status == DataStatusEnum.ENABLE.value
+            ).order_by(self.step_model.num.asc()).all()
+            for case_id in to_load_case_id_set:
+                step_dict[case_id] = []
+            for step in step_list:
+                step_dict[step.case_id].append(step)
+            to_load_case_id_set = {step.quote_case for step in step_list if step.quote_case} - set(step_dict)
+
+        element_id_set = {getattr(step, element_filed) for step_list in step_dict.values() for step in step_list}
+        element_dict = {
+            element.id: element
+            for element in element_model.query.filter(element_model.id.in_(element_id_set)).all()
+        } if element_id_set else {}
+
+        suite_id_set = {case["suite_id"] for case in case_dict.values()}
+        suite_project_dict = {
+            suite_id: project_id for suite_id, project_id in self.suite_model.db.session.query(
+                self.suite_model.id, self.suite_model.project_id).filter(self.suite_model.id.in_(suite_id_set)).all()
+        } if suite_id_set else {}
+
+        project_id_set = set(suite_project_dict.values()) | {element.project_id for element in element_dict.values()}
+        project_dict = {
+            project.id: project.to_dict()
+            for project in self.project_model.query.filter(self.project_model.id.in_(project_id_set)).all()
+        } if project_id_set else {}
+
+        self.run_env = self.run_env or RunEnv.get_first(code=self.env_code).to_dict()
+        project_env_dict = {
+            project_env.project_id: project_env.to_dict()
+            for project_env in self.project_env_model.query.filter(
+                self.project_env_model.env_id == self.run_env["id"],
+                self.project_env_model.project_id.in_(project_id_set)
+            ).all()
+        } if project_id_set else {}
+
+        self.prefetched = {
+            "case": case_dict,
+            "step": step_dict,
+            "element": element_dict,
+            "suite_project": suite_project_dict,
+            "project": project_dict,
+            "project_env": project_env_dict
+        }
+
+    def get_case_steps(self, case_id):
+        """ 获取用例下要执行的步骤，有预加载则从预加载的数据中取 """
+        if "step" in self.prefetched and case_id in self.prefetched["step"]:
+            return self.prefetched["step"][case_id]
+        return self.step_model.query.filter_by(
+            case_id=case_id, status=DataStatusEnum.ENABLE.value).order_by(self.step_model.num.asc()).all()
+
+    def get_suite_project_id(self, suite_id):
+        """ 获取用例集所在的服务id """
+        if suite_id in self.prefetched.get("suite_project", {}):
+            return self.prefetched["suite_project"][suite_id]
+        return self.suite_model.db.session.query(
+            self.suite_model.project_id).filter(self.suite_model.id == suite_id).first()[0]
+
+    def get_element_obj(self, element_id):
+        """ 获取接口/元素数据对象 """
+        if element_id in self.prefetched.get("element", {}):
+            return self.prefetched["element"][element_id]
+        element_model = self.api_model if self.run_type == "api" else self.element_model
+        return element_model.get_first(id=element_id)
+
+    def clear_report_detail(self):
+        """ 删除报告下已经写入的用例和步骤，执行队列中的任务被其他节点接管时，从头开始执行 """
+        self.report_case_model.query.filter(self.report_case_model.report_id == self.report_id).delete()
+        self.report_step_model.query.filter(self.report_step_model.report_id == self.report_id).delete()
+
+    def add_report_case(self, report_case, report_step_list, is_skip=False, is_frozen=False):
+        """ 解析完一条用例，先放到待写入列表中，达到批量写入的数量再一起写入
+        report_case: 报告用例数据，report_step_list: 报告步骤数据（还没有report_case_id），is_skip: 用例是否跳过执行
+        is_frozen: 用例数据已经固定下来了，不会再被后续的解析修改
+        """
+        # 用例数据中的变量和已解析的用例共用一个对象，后续解析会修改，所以先固定下来
+        if is_frozen is False:
+            report_case["case_data"] = self.report_case_model.loads(self.report_case_model.dumps(report_case["case_data"]))
+        if self.parse_plan_record is not None:
+            self.parse_plan_record["report_case_list"].append(
+                self.report_case_model.loads(self.report_case_model.dumps([report_case, report_step_list, is_skip])))
+        self.append_report_case_batch(report_case, report_step_list, is_skip)
+
+    def append_report_case_batch(self, report_case, report_step_list, is_skip=False):
+        """ 放到待写入列表中，达到批量写入的数量再一起写入 """
+        self.report_case_batch.append((report_case, report_step_list, is_skip))
+        if len(self.report_case_batch) >= self.report_case_batch_size:
+            self.flush_report_case_batch()
+
+    def flush_report_case_batch(self):
+        """ 批量写入已解析的用例和步骤，并按解析顺序把要执行的用例id加到测试计划中 """
+        if not self.report_case_batch:
+            return
+        self.check_run_lease(check_db=True)
+        report_case_batch, self.report_case_batch = self.report_case_batch, []
+        report_case_id_list = self.report_case_model.model_bulk_create_and_get_id(
+            [report_case for report_case, report_step_list, is_skip in report_case_batch], report_id=self.report_id)
+
+        all_report_step_list = []
+        for report_case_id, (report_case, report_step_list, is_skip) in zip(report_case_id_list, report_case_batch):
+            for report_step in report_step_list:
+                report_step["report_case_id"] = report_case_id
+            all_report_step_list.extend(report_step_list)
+            if is_skip is False:
+                self.test_plan["report_case_list"].append(report_case_id)
+        self.report_step_model.model_bulk_insert(all_report_step_list)
+
+    def get_parse_plan_key(self, case_id_list, **kwargs):
+        """ 解析计划缓存的key，由要执行的用例、运行环境、执行类型、影响解析结果的配置和参数决定 """
+        return hashlib.md5(self.report_case_model.dumps({
+            "run_type": self.run_type,
+            "env_code": self.env_code,
+            "case_id_list": case_id_list,
+            "time_out": self.time_out,
+            "wait_time_out": self.wait_time_out,
+            **kwargs
+        }, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get_parse_plan_fingerprint(self, case_id_list):
+        """ 解析计划依赖的数据的指纹，只查id、关联关系、数据版本号，不查完整数据
+        用例(含引用的用例)、步骤、接口/元素、用例集、服务、服务环境、运行环境有任何新增、删除、修改、排序变化，指纹都会变
+        """
+        element_model = self.api_model if self.run_type == "api" else self.element_model
+        element_filed = getattr(self.step_model, "api_id" if self.run_type == "api" else "element_id")
+        case_list, step_list, loaded_case_id_set = [], [], set()
+
+        # 按层查用例和步骤，直到没有新的引用用例，和 prefetch_case_data 的查询范围一致
+        to_load_case_id_set = set(case_id_list)
+        while to_load_case_id_set:
+            case_list.extend(self.case_model.db.session.query(
+                self.case_model.id, self.case_model.suite_id, self.case_model.data_version
+            ).filter(self.case_model.id.in_(to_load_case_id_set)).order_by(self.case_model.id.asc()).all())
+            current_step_list = self.step_model.db.session.query(
+                self.step_model.id, self.step_model.case_id, self.step_model.quote_case, element_filed,
+                self.step_model.data_version
+            ).filter(
+                self.step_model.case_id.in_(to_load_case_id_set), self.step_model.status == DataStatusEnum.ENABLE.value
+            ).order_by(self.step_model.num.asc()).all()
+            step_list.extend(current_step_list)
+            loaded_case_id_set.update(to_load_case_id_set)
+            to_load_case_id_set = {step[2] for step in current_step_list if step[2]} - loaded_case_id_set
+
+        element_id_set = {step[3] for step in step_list if step[3]}
+        element_list = element_model.db.session.query(
+            element_model.id, element_model.project_id, element_model.data_version
+        ).filter(element_model.id.in_(element_id_set)).order_by(element_model.id.asc()).all() if element_id_set else []
+
+        suite_id_set = {case[1] for case in case_list}
+        suite_list = self.suite_model.db.session.query(
+            self.suite_model.id, self.suite_model.project_id, self.suite_model.data_version
+        ).filter(self.suite_model.id.in_(suite_id_set)).order_by(self.suite_model.id.asc()).all() if suite_id_set else []
+
+        project_id_set = {suite[1] for suite in suite_list} | {element[1] for element in element_list}
+        project_list = self.project_model.db.session.query(
+            self.project_model.id, self.project_model.data_version
+        ).filter(self.project_model.id.in_(project_id_set)).order_by(self.project_model.id.asc()).all() if project_id_set else []
+
+        run_env = self.run_env or RunEnv.get_first(code=self.env_code).to_dict()
+        project_env_list = self.project_env_model.db.session.query(
+            self.project_env_model.project_id, self.project_env_model.data_version
+        ).filter(
+            self.project_env_model.env_id == run_env["id"], self.project_env_model.project_id.in_(project_id_set)
+        ).order_by(self.project_env_model.project_id.asc()).all() if project_id_set else []
+
+        return hashlib.md5(self.report_case_model.dumps({
+            "case": [list(row) for row in case_list],
+            "step": [list(row) for row in step_list],
+            "element": [list(row) for row in element_list],
+            "suite": [list(row) for row in suite_list],
+            "project": [list(row) for row in project_list],
+            "project_env": [list(row) for row in project_env_list],
+            "run_env": [run_env["id"], run_env["data_version"]]
+        }).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_script_fingerprint(cls, script_id_list):
+        """ 引用的脚本的指纹 """
+        script_list = Script.db.session.query(Script.id, Script.data_version).filter(
+            Script.id.in_(set(script_id_list))).order_by(Script.id.asc()).all() if script_id_list else []
+        return hashlib.md5(Script.dumps([list(row) for row in script_list]).encode("utf-8")).hexdigest()
+
+    def get_parse_plan(self, plan_key, fingerprint=None):
+        """ 读取解析计划缓存，依赖的数据或引用的脚本有变化则返回None
+        fingerprint: 不传则按缓存中记录的用例重新计算，用于重跑不通过的用例时，取被重跑报告的解析计划
+        """
+        try:
+            parse_plan = ParsePlan.get_content(plan_key)
+            if parse_plan is None:
+                return None
+            parse_plan = self.report_case_model.loads(parse_plan)
+            if fingerprint is None:
+                if "case_id_list" not in parse_plan:
+                    return None
+                fingerprint = self.get_parse_plan_fingerprint(parse_plan["case_id_list"])
+            if parse_plan["fingerprint"] != fingerprint or \
+                    parse_plan["script_fingerprint"] != self.get_script_fingerprint(parse_plan["script_id_list"]):
+                return None
+        except Exception as error:
+            logger.error(f'读取解析计划缓存失败，重新解析：{error}')
+            return None
+        return parse_plan
+
+    def load_parse_plan(self, plan_key, fingerprint):
+        """ 依赖的数据都没有变化时，使用缓存的解析计划，把解析结果写入报告，只需在执行时做变量、函数的动态解析 """
+        parse_plan = self.get_parse_plan(plan_key, fingerprint)
+        if parse_plan is None:
+            return False
+
+        logger.info(f'用例、步骤、接口等数据都没有变化，使用缓存的解析计划：{plan_key}')
+        self.parse_functions(parse_plan["script_id_list"])
+        for report_case, report_step_list, is_skip in parse_plan["report_case_list"]:
+            report_case["report_id"] = self.report_id
+            for report_step in report_step_list:
+                report_step["report_id"] = self.report_id
+            self.append_report_case_batch(report_case, report_step_list, is_skip)
+        self.count_step = parse_plan["count_step"]
+        self.api_set, self.element_set = set(parse_plan["api_set"]), set(parse_plan["element_set"])
+        return True
+
+    def save_parse_plan(self, plan_key, fingerprint, case_id_list):
+        """ 保存此次的解析结果，作为下次执行同样用例时的解析计划缓存 """
+        parse_plan_record, self.parse_plan_record = self.parse_plan_record, None
+        try:
+            script_id_list = self.get_unique_script_id_list(parse_plan_record["script_id_list"])
+            ParsePlan.save_content(plan_key, self.report_case_model.dumps({
+                "fingerprint": fingerprint,
+                "case_id_list": case_id_list,
+                "script_id_list": script_id_list,
+                "script_fingerprint": self.get_script_fingerprint(script_id_list),
+                "report_case_list": parse_plan_record["report_case_list"],
+                "count_step": self.count_step,
+                "api_set": list(self.api_set),
+                "element_set": list(self.element_set)
+            }))
+        except Exception as error:
+            logger.error(f'保存解析计划缓存失败：{error}')
+
+    @classmethod
+    def get_unique_script_id_list(cls, script_id_list):
+        """ 同一个脚本加载多次时，以最后一次的顺序为准，函数重名时覆盖顺序不变 """
+        return list(reversed(dict.fromkeys(reversed(script_id_list))))
+
     def get_report_addr(self):
         """ 获取报告前端地址 """
         report_host = Config.get_report_host()
@@ -133,10 +427,16 @@ class RunTestRunner:
             self.run_env = RunEnv.get_first(code=self.env_code).to_dict()
 
         if project_id not in self.parsed_project_dict:
-            project = self.project_model.get_first(id=project_id).to_dict()
+            if project_id in self.prefetched.get("project", {}):
+                project = dict(self.prefetched["project"][project_id])
+            else:
+                project = self.project_model.get_first(id=project_id).to_dict()
             self.parse_functions(project["script_list"])
-            project_env = self.project_env_model.get_first(
-                env_id=self.run_env["id"], project_id=project["id"]).to_dict()
+            if project_id in self.prefetched.get("project_env", {}):
+                project_env = dict(self.prefetched["project_env"][project_id])
+            else:
+                project_env = self.project_env_model.get_first(
+                    env_id=self.run_env["id"], project_id=project["id"]).to_dict()
             project_env.update(project)
             project_env.update(self.run_env)
             self.parsed_project_dict.update({project_id: ProjectModel(**project_env)})
@@ -145,17 +445,20 @@ class RunTestRunner:
     def get_format_case(self, case_id):
         """ 从已解析的用例字典中取指定id的用例，如果没有，则取出来解析后放进去 """
         if case_id not in self.parsed_case_dict:
-            case = self.case_model.get_first(id=case_id)
+            case = self.prefetched.get("case", {}).get(case_id)
+            if case is None:
+                case = self.case_model.get_first(id=case_id)
+                case = case.to_dict() if case else None
             if not case:
                 return  # 可能存在任务选择了用例，在那边直接把这条用例删掉了的情况
-            self.parse_functions(case.script_list)
-            self.parsed_case_dict.update({case_id: CaseModel(**case.to_dict())})
+            self.parse_functions(case["script_list"])
+            self.parsed_case_dict.update({case_id: CaseModel(**case)})
         return self.parsed_case_dict[case_id]
 
     def get_format_element(self, element_id):
         """ 从已解析的元素字典中取指定id的元素，如果没有，则取出来解析后放进去 """
         if element_id not in self.parsed_element_dict:
-            element = self.element_model.get_first(id=element_id).to_dict()
+            element = self.get_element_obj(element_id).to_dict()
             self.parsed_element_dict.update({element_id: ElementModel(**element)})
         return self.parsed_element_dict[element_id]
 
@@ -164,9 +467,12 @@ class RunTestRunner:
         if api_obj:
             api_id = api_obj.id
         if api_id not in self.parsed_api_dict:
-            api = api_obj or ApiMsg.get_first(id=api_id)
+            api = api_obj or self.get_element_obj(api_id)
             if api.project_id not in self.parsed_project_dict:
-                self.parse_functions(json.loads(self.project_model.get_first(id=api.project_id).script_list))
+                if api.project_id in self.prefetched.get("project", {}):
+                    self.parse_functions(self.prefetched["project"][api.project_id]["script_list"])
+                else:
+                    self.parse_functions(json.loads(self.project_model.get_first(id=api.project_id).script_list))
             self.parsed_api_dict.update({
                 api.id: self.parse_api(project, ApiModel(**api.to_dict()))
             })
@@ -174,12 +480,12 @@ class RunTestRunner:
 
     def parse_functions(self, func_list):
         """ 获取自定义函数 """
+        if self.parse_plan_record is not None:
+            self.parse_plan_record["script_id_list"].extend(func_list)
+        self.script_id_list.extend(func_list)
         for func_file_id in func_list:
-            func_file_name = Script.get_first(id=func_file_id).name
-            func_file_data = importlib.reload(importlib.import_module(f'script_list.{self.env_code}_{func_file_name}'))
-            self.test_plan["project_mapping"]["functions"].update({
-                name: item for name, item in vars(func_file_data).items() if isinstance(item, types.FunctionType)
-            })
+            # 脚本在进程内只编译一次，内容没变化则直接复用，见 Script.get_script_module
+            self.test_plan["project_mapping"]["functions"].update(Script.get_script_functions(func_file_id, self.env_code))
 
     def parse_case_is_skip(self, skip_if_list, server_id=None, phone_id=None):
         """ 判断是否跳过用例，暂时只支持对运行环境的判断 """
@@ -230,6 +536,10 @@ class RunTestRunner:
     def save_report_and_send_message(self, result):
         """ 写入测试报告到数据库, 并把数据写入到文本中 """
         logger.info(f'开始保存测试报告')
+        self.check_run_lease(check_db=True)
+        if self.parent_id:
+            result = self.merge_parent_summary(result)
+        self.set_stop_reason(result)
         self.report.save_report_start()
         self.report.update_report_result(result["result"], summary=result)
         self.report.save_report_finish()
@@ -268,51 +578,291 @@ class RunTestRunner:
                     send_list = [{"report_id": query[0], "report_summary": query[1]} for query in query_res]
                 self.send_report_if_task(send_list)
 
+    def finish_report_without_run(self, reason):
+        """ 执行队列中的任务不会再执行了（排队超时、领取的节点都宕机了），报告按执行不通过走正常的结束流程：
+        保存报告、回调流水线、发送通知，避免报告一直显示执行中、流水线一直等不到回调
+        """
+        self.report = self.report_model.get_first(id=self.report_id)
+        if self.report is None:
+            return
+        self.parent_id = None  # 没有执行，不合并被重跑报告的统计
+        summary = self.report.summary or self.report_model.get_summary_template()
+        summary["result"] = "fail"
+        summary["stop_reason"] = reason
+        self.save_report_and_send_message(summary)
+
     def run_case(self):
-        """ 调 testRunner().run() 执行测试 """
-        logger.info(f'\n测试执行数据：\n{self.test_plan}')
-
-        if self.test_plan.get("is_async", 0):
-            # 并行执行, 遍历case，以case为维度多线程执行，测试报告按顺序排列
-            run_case_res_dict = {}
-            self.report.run_case_start()
-            for index, case in enumerate(self.test_plan["report_case_list"]):
-                run_case_res_dict[index] = False  # 用例运行标识，索引：是否运行完成
-                test_plan = copy.deepcopy(self.test_plan)
-                test_plan["report_case_list"] = [case]
-                Thread(target=self.run_case_on_new_thread, args=[test_plan, run_case_res_dict, index]).start()
-        else:  # 串行执行
-            self.sync_run_case()
-
-    def run_case_on_new_thread(self, test_plan, run_case_res_dict, index):
-        """ 新线程运行用例 """
-        with create_app().app_context():  # 手动入栈
-            runner = TestRunner()
-            runner.run(test_plan)
-            self.update_run_case_status(run_case_res_dict, index, runner.summary)
-
-    def update_run_case_status(self, run_case_res_dict, run_index, summary):
-        """ 每条用例执行完了都更新对应的运行状态，如果更新后的结果是用例全都运行了，则生成测试报告"""
-        run_case_res_dict[run_index] = summary
-        if all(run_case_res_dict.values()):  # 全都执行完毕
-            self.report.run_case_finish()
-            all_summary = run_case_res_dict[0]
-            all_summary["stat"]["count"]["step"] = self.count_step
-            all_summary["stat"]["count"]["api"] = len(self.api_set)
-            all_summary["stat"]["count"]["element"] = len(self.element_set)
-            for index, res in enumerate(run_case_res_dict.values()):
-                if index != 0:
-                    self.build_summary(all_summary, res, ["test_case", "test_step"])  # 合并用例统计, 步骤统计
-                    all_summary["result"] = 'success' if all_summary["result"] == 'success' and res[
-                        "result"] == 'success' else 'fail'  # 测试报告状态
-                    all_summary["time"]["case_duration"] = summary["time"]["case_duration"]  # 总共耗时取运行最长的
-                    all_summary["time"]["step_duration"] = summary["time"]["step_duration"]  # 总共耗时取运行最长的
-            self.save_report_and_send_message(all_summary)
+        """ 调 testRunner().run() 执行测试，执行完毕或执行异常都释放此次运行的连接池 """
+        try:
+            self.init_run_plan()
+            logger.info(f'\n测试执行数据：\n{self.test_plan}')
+
+            shard_size = self.get_shard_size()
+            if shard_size:  # 用例分片到各节点执行
+                self.run_case_by_shard(shard_size)
+            elif self.test_plan.get("is_async", 0) and self.run_type == "api" and self.run_engine == "asyncio":
+                # 接口自动化的并行执行，所有用例在一个事件循环中以协程并发执行
+                self.run_case_with_runner(AsyncTestRunner(self.async_concurrency))
+            elif self.test_plan.get("is_async", 0):
+                # 并行执行, 以case为维度放到线程池中执行，测试报告按顺序排列
+                self.report.run_case_start()
+                app = current_app._get_current_object()
+                with ThreadPoolExecutor(
+                        max_workers=max(Config.get_run_case_max_workers(), 1),
+                        thread_name_prefix=f'run_case_{self.report_id}') as executor:
+                    future_list = [
+                        executor.submit(self.run_case_on_new_thread, app, report_case_id)
+                        for report_case_id in self.test_plan["report_case_list"]
+                    ]
+                self.update_run_case_status([future.result() for future in future_list])
+            else:  # 串行执行
+                self.sync_run_case()
+        finally:
+            HttpClientPool.close_run_pool(self.report_id)
+
+    def init_run_plan(self, check_before_run=True):
+        """ 解析完毕，准备执行时才需要的数据
+        check_before_run: 执行前是否探测运行环境，执行分片时报告所在的节点已经探测过了，不再探测
+        """
+        # 自定义函数已全部加载，合并内置函数生成此次运行的函数注册表，执行过程中只读
+        self.test_plan["project_mapping"]["functions"] = FunctionRegistry(self.test_plan["project_mapping"]["functions"])
+        self.test_plan["run_policy"] = self.get_run_policy(check_before_run)
+        self.test_plan["check_run_lease"] = self.check_run_lease
+        if self.run_type == "api":
+            self.test_plan["http_client_limits"] = {
+                **self.http_client_limits, "host_rate_limits": self.get_host_rate_limits()}
+
+    def check_run_lease(self, check_db=False):
+        """ 从执行队列领取执行时，租约已被其他节点接管（此报告会被接管的节点从头执行）的，停止执行、不再写入报告
+        执行进程续租时发现租约被接管会做标记，每条用例执行前检查标记；写入报告前再查一次数据库，避免续租间隔内的误写
+        """
+        if self.run_queue is None or self.run_queue_worker is None:
+            return
+        if self.run_queue_worker.is_lease_lost(self.run_queue.id) or (
+                check_db and not self.run_queue.is_lease_held(self.run_queue_worker.lease_owner)):
+            raise RunLeaseLost(f'执行队列的任务【{self.run_queue.id}】租约已被其他节点接管，报告id：{self.report_id}')
+
+    def get_host_rate_limits(self):
+        """ 此运行环境下各服务环境配置的限流，按域名生效，同一个域名配置了多个的取最严格的
+        执行分片时各分片的限流器是独立的，按分片数平分，所有分片加起来不超过配置的值
+        """
+        run_env = RunEnv.get_first(code=self.env_code)
+        query_data = self.project_env_model.db.session.query(
+            self.project_env_model.host, self.project_env_model.rate_limit
+        ).filter(self.project_env_model.env_id == run_env.id).all()
+        host_rate_limits = {}
+        for host, rate_limit in query_data:
+            host_key = get_host_key(host)
+            if host_key and rate_limit and (rate_limit.get("rate") or rate_limit.get("max_in_flight")):
+                host_rate_limits[host_key] = merge_rate_limit(host_rate_limits.get(host_key), rate_limit)
+        return {
+            host_key: split_rate_limit(rate_limit, self.shard_count) for host_key, rate_limit in host_rate_limits.items()
+        }
+
+    def get_run_policy(self, check_before_run=True):
+        """ 任务的执行策略，没有启用则返回None，启用了环境探测的，默认探测报告所属服务在此运行环境的域名 """
+        run_policy = RunPolicy.get_run_policy(self.task_dict.get("run_policy"), self.get_health_check_url())
+        if run_policy and check_before_run:
+            run_policy.check_before_run()
+        return run_policy
+
+    def set_stop_reason(self, summary):
+        """ 触发了执行策略的，把停止原因记录到执行结果统计中 """
+        run_policy = self.test_plan.get("run_policy")
+        if run_policy and run_policy.is_stop():
+            summary["stop_reason"] = run_policy.stop_reason
+        return summary
+
+    def get_health_check_url(self):
+        if not (self.task_dict.get("run_policy") or {}).get("health_check"):
+            return None
+        run_env = RunEnv.get_first(code=self.env_code)
+        project_env = self.project_env_model.get_first(env_id=run_env.id, project_id=self.report.project_id)
+        return getattr(project_env, "host", None) if project_env else None
+
+    def get_shard_size(self):
+        """ 每个分片的用例数，0为不分片
+        只有从执行队列领取的、并行执行的接口自动化才分片，ui、app自动化依赖本节点的浏览器/设备，不分片
+        """
+        if self.run_queue is None or self.run_queue_worker is None or self.run_queue.unit_type != "report":
+            return 0
+        if self.run_type != "api" or not self.test_plan.get("is_async", 0):
+            return 0
+        run_policy = self.test_plan.get("run_policy")
+        if run_policy and run_policy.is_stop():  # 执行前探测运行环境就不通过，用例都不执行，不用分片
+            return 0
+        shard_size = int(Config.get_run_queue()["shard_size"])
+        return shard_size if 0 < shard_size < len(self.test_plan["report_case_list"]) else 0
+
+    def run_case_by_shard(self, shard_size):
+        """ 把用例按 shard_size 切分成多个分片写入执行队列，由各节点领取执行，全部执行完毕后合并结果生成测试报告
+        分片小、按需领取：执行快的节点领取得多，节点宕机的分片租约过期后由其他节点重新领取；
+        等待期间当前节点也领取本报告的分片执行，不会因为执行线程都在等分片而卡住
+        执行策略按整个报告生效：各分片执行完毕后，把分片的不通过用例数、停止原因合并到报告的执行策略中，
+        触发停止后还没被领取的分片不再执行，分片内的用例记为取消执行，已经在执行的分片执行完当前分片
+        """
+        self.report.run_case_start()
+        report_case_list = self.test_plan["report_case_list"]
+        shard_id_list = RunQueue.add_shard_list(
+            self.run_queue,
+            [report_case_list[index:index + shard_size] for index in range(0, len(report_case_list), shard_size)],
+            self.get_unique_script_id_list(self.script_id_list)
+        )
+        logger.info(f'报告【{self.report_id}】的{len(report_case_list)}条用例切分为{len(shard_id_list)}个分片执行')
+
+        finish_status_list = [
+            RunQueueStatusEnum.done.value, RunQueueStatusEnum.failed.value, RunQueueStatusEnum.rejected.value]
+        poll_interval = float(Config.get_run_queue()["poll_interval"])
+        run_policy = self.test_plan.get("run_policy")
+        merged_shard_id_set, cancel_shard_id_set = set(), set()
+        while True:
+            self.check_run_lease()
+            shard_list = RunQueue.get_shard_list(shard_id_list)
+            if run_policy:
+                self.merge_shard_run_policy(run_policy, shard_list, merged_shard_id_set)
+                if run_policy.is_stop():
+                    cancel_shard_id_set.update(RunQueue.cancel_pending_shard_list(shard_id_list, run_policy.stop_reason))
+            if all(shard.status in finish_status_list for shard in shard_list):
+                break
+            if not self.run_queue_worker.run_report_shard(self.report_id, self.run_type):
+                time.sleep(poll_interval)
+
+        summary_list = []
+        for shard in shard_list:
+            if shard.status == RunQueueStatusEnum.done.value and shard.result:
+                summary_list.append(shard.result)
+            elif shard.status == RunQueueStatusEnum.rejected.value and shard.id in cancel_shard_id_set:
+                summary_list.append(self.cancel_shard(shard.shard["report_case_list"], run_policy.stop_reason))
+            else:  # 分片最终执行失败，分片内的用例都记为错误
+                logger.error(f'报告【{self.report_id}】的分片【{shard.id}】执行失败，状态：{shard.status}')
+                summary_list.append(self.get_shard_error_summary(len(shard.shard["report_case_list"])))
+        self.merge_shard_time_and_response_time(summary_list)
+        self.update_run_case_status(summary_list)
+
+    def get_shard_error_summary(self, case_count, case_result="error"):
+        """ 执行失败的分片的统计，分片内的用例都记为错误 """
+        summary = self.report_model.get_summary_template()
+        summary["result"] = "fail"
+        summary["stat"]["test_case"]["total"] = summary["stat"]["test_case"][case_result] = case_count
+        return summary
+
+    @staticmethod
+    def merge_shard_run_policy(run_policy, shard_list, merged_shard_id_set):
+        """ 把执行完毕的分片的不通过用例数、停止原因合并到报告的执行策略中，每个分片只合并一次 """
+        for shard in shard_list:
+            if shard.id in merged_shard_id_set or shard.status != RunQueueStatusEnum.done.value or not shard.result:
+                continue
+            merged_shard_id_set.add(shard.id)
+            case_stat = shard.result["stat"]["test_case"]
+            run_policy.merge_result(case_stat["fail"] + case_stat["error"], shard.result.get("stop_reason"))
+
+    def cancel_shard(self, report_case_list, reason):
+        """ 触发了执行策略，没有执行的分片内的用例都标记为取消执行 """
+        for report_case_id in report_case_list:
+            TestRunner.cancel_case(self.test_plan, report_case_id, reason)
+        return self.get_shard_error_summary(len(report_case_list), "cancel")
+
+    @staticmethod
+    def merge_shard_time_and_response_time(summary_list):
+        """ 各分片是并行执行的，开始时间取最早的，结束时间取最晚的，慢接口取并集，合并到第一个分片的统计中 """
+        all_summary = summary_list[0]
+        time_list = [summary["time"] for summary in summary_list if summary["time"].get("start_at")]
+        if time_list:
+            start_at = min(time_data["start_at"] for time_data in time_list)
+            end_at = max(time_data["end_at"] for time_data in time_list)
+            all_summary["time"]["start_at"], all_summary["time"]["end_at"] = start_at, end_at
+            all_summary["time"]["all_duration"] = (
+                    datetime.strptime(end_at, "%Y-%m-%d %H:%M:%S") - datetime.strptime(start_at, "%Y-%m-%d %H:%M:%S")
+            ).total_seconds()
+        for key in ["slow", "very_slow"]:
+            all_summary["stat"]["response_time"][key] = list(set().union(
+                *(summary["stat"]["response_time"][key] for summary in summary_list)))
+
+    def run_shard(self, report_case_list, script_id_list, shard_count=1):
+        """ 执行领取到的分片，返回分片的执行结果统计，由报告所在的节点合并 """
+        with self.get_app().app_context():
+            Script.create_script_file(self.env_code)  # 创建所有函数文件
+            self.report = self.report_model.get_first(id=self.report_id)
+            self.parse_functions(script_id_list)
+            self.test_plan["report_case_list"] = report_case_list
+            self.shard_count = shard_count
+            # 执行前报告所在的节点已经探测过运行环境，分片内按执行策略判断，结果由报告所在的节点合并；限流配置按分片数平分
+            self.init_run_plan(check_before_run=False)
+            logger.info(f'执行报告【{self.report_id}】的分片，用例：{report_case_list}')
+
+            with self._shard_run_lock:
+                self._shard_run_count[self.report_id] = self._shard_run_count.get(self.report_id, 0) + 1
+            try:
+                if self.run_engine == "asyncio":
+                    runner = AsyncTestRunner(self.async_concurrency)
+                    runner.run(self.test_plan)
+                    return self.set_stop_reason(runner.summary)
+                app = current_app._get_current_object()
+                with ThreadPoolExecutor(
+                        max_workers=max(Config.get_run_case_max_workers(), 1),
+                        thread_name_prefix=f'run_shard_{self.report_id}') as executor:
+                    future_list = [
+                        executor.submit(self.run_case_on_new_thread, app, report_case_id)
+                        for report_case_id in report_case_list
+                    ]
+                summary_list = [future.result() for future in future_list]
+                all_summary = self.merge_summary_list(summary_list)
+                self.merge_shard_time_and_response_time(summary_list)
+                return self.set_stop_reason(all_summary)
+            finally:
+                with self._shard_run_lock:  # 当前进程没有在执行此报告的分片了，释放此报告的连接池
+                    self._shard_run_count[self.report_id] -= 1
+                    if self._shard_run_count[self.report_id] == 0:
+                        self._shard_run_count.pop(self.report_id)
+                        HttpClientPool.close_run_pool(self.report_id)
+
+    @classmethod
+    def get_node_semaphore(cls):
+        """ 获取当前服务进程并行执行用例的数量限制，第一次使用时根据配置创建 """
+        if cls._node_semaphore is None:
+            with cls._node_semaphore_lock:
+                if cls._node_semaphore is None:
+                    cls._node_semaphore = BoundedSemaphore(max(Config.get_node_run_case_max_workers(), 1))
+        return cls._node_semaphore
+
+    def run_case_on_new_thread(self, app, report_case_id):
+        """ 在线程池中运行一条用例，测试计划只读共享，只替换要执行的用例 """
+        test_plan = {**self.test_plan, "report_case_list": [report_case_id]}
+        with self.get_node_semaphore():
+            with app.app_context():  # 手动入栈
+                runner = TestRunner()
+                runner.run(test_plan)
+                return runner.summary
+
+    def merge_summary_list(self, summary_list):
+        """ 合并多个执行结果（各用例/各分片）的统计 """
+        all_summary = summary_list[0]
+        for summary in summary_list[1:]:
+            self.build_summary(all_summary, summary, ["test_case", "test_step"])  # 合并用例统计, 步骤统计
+            all_summary["result"] = 'success' if all_summary["result"] == 'success' and summary[
+                "result"] == 'success' else 'fail'  # 测试报告状态
+            all_summary["time"]["case_duration"] = summary["time"]["case_duration"]  # 总共耗时取运行最长的
+            all_summary["time"]["step_duration"] = summary["time"]["step_duration"]  # 总共耗时取运行最长的
+        return all_summary
+
+    def update_run_case_status(self, summary_list):
+        """ 所有用例都执行完毕，合并各用例的执行结果，并生成测试报告"""
+        self.report.run_case_finish()
+        all_summary = self.merge_summary_list(summary_list)
+        all_summary["stat"]["count"]["step"] = self.count_step
+        all_summary["stat"]["count"]["api"] = len(self.api_set)
+        all_summary["stat"]["count"]["element"] = len(self.element_set)
+        if self.run_type == "api":
+            all_summary["stat"]["response_time"]["response_time_level"] = self.response_time_level
+        self.save_report_and_send_message(all_summary)
 
     def sync_run_case(self):
         """ 串行运行用例 """
+        self.run_case_with_runner(TestRunner())
+
+    def run_case_with_runner(self, runner):
+        """ 使用指定的执行器运行所有用例，并保存测试报告 """
         self.report.run_case_start()
-        runner = TestRunner()
         runner.run(self.test_plan)
         self.report.run_case_finish()
         logger.info(f'测试执行完成，开始保存测试报告和发送报告')
@@ -324,6 +874,32 @@ class RunTestRunner:
             summary["stat"]["response_time"]["response_time_level"] = self.response_time_level
         self.save_report_and_send_message(summary)
 
+    def merge_parent_summary(self, summary):
+        """ 重跑不通过的用例，报告统计 = 被重跑报告的统计 - 被重跑报告中此次重跑了的数据行 + 此次重跑的结果
+        数据有变化后重新解析时，被重跑报告中的数据行可能已经不存在了，这些数据行没有重跑，保留原来的结果
+        """
+        parent_summary = self.report_model.get_first(id=self.parent_id).summary
+        rerun_row_key_set = self.report_case_model.get_row_key_set(self.report_id)
+        rerun_list = [
+            report_case for report_case in self.report_case_model.get_not_passed_case_list(self.parent_id)
+            if self.report_case_model.get_row_key(
+                report_case.case_id, report_case.run_index, report_case.data_driver_index) in rerun_row_key_set
+        ]
+
+        case_stat, step_stat = summary["stat"]["test_case"], summary["stat"]["test_step"]
+        for key in case_stat:
+            rerun_count = len(rerun_list) if key == "total" else len(
+                [report_case for report_case in rerun_list if report_case.result == key])
+            case_stat[key] += parent_summary["stat"]["test_case"].get(key, 0) - rerun_count
+        for key in step_stat:
+            step_stat[key] += parent_summary["stat"]["test_step"].get(key, 0) - sum(
+                report_case.summary["stat"][key] for report_case in rerun_list)
+        for key in ["slow", "very_slow"]:
+            summary["stat"]["response_time"][key] = list(
+                set(summary["stat"]["response_time"][key]) | set(parent_summary["stat"]["response_time"][key]))
+        summary["result"] = "success" if case_stat["fail"] == 0 and case_stat["error"] == 0 else "fail"
+        return summary
+
     def send_report_if_task(self, notify_list):
         """ 发送测试报告 """
         if self.task_dict:
@@ -388,6 +964,7 @@ class RunTestRunner:
             "extract": api.extracts,  # 接口要提取的信息
             "validate": api.validates,  # 接口断言信息
             "base_url": project.host,
+            "keep_alive": project.keep_alive,
             "body_type": api.body_type,
             "variables": [],
             "request": {
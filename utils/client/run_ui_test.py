@@ -2,8 +2,6 @@
 import copy
 import json
 
-from apps import create_app
-from apps.enums import DataStatusEnum
 from apps.ui_test.model_factory import WebUiCaseSuite, WebUiStep, WebUiReportStep, WebUiReportCase
 from apps.app_test.model_factory import AppUiCaseSuite, AppUiStep, AppUiReportStep, AppUiReportCase, AppUiRunPhone
 from apps.assist.model_factory import Script
@@ -49,10 +47,11 @@ class RunCase(RunTestRunner):
         self.case_id_list = case_id_list  # 要执行的用例id_list
         self.appium_config = appium_config
         self.all_case_steps = []  # 所有测试步骤
+        self.app = kwargs.get("current_app")
 
     def parse_and_run(self):
         """ 把解析放到异步线程里面 """
-        with create_app().app_context():  # 手动入栈
+        with self.get_app().app_context():  # 手动入栈
             Script.create_script_file(self.env_code)  # 创建所有函数文件
             if self.run_type != "ui":
                 self.device_dict = {device.id: device.to_dict() for device in AppUiRunPhone.query.all()}
@@ -61,12 +60,12 @@ class RunCase(RunTestRunner):
             self.report.parse_data_finish()
             self.run_case()
 
-    def parse_step(self, project, element, step, report_case_id):
+    def parse_step(self, project, element, step):
         """ 解析测试步骤
         project: 当前步骤对应元素所在的项目(解析后的)
         element: 解析后的element
         step: 原始step
-        返回解析后的步骤 {}
+        返回解析后的报告步骤数据 {}，report_case_id 在批量写入用例后再补上
         """
         step_data = {
             "case_id": step.case_id,
@@ -92,15 +91,14 @@ class RunCase(RunTestRunner):
             }
         }
 
-        self.report_step_model.model_create({
+        return {
             "element_id": element.id,
             "step_id": step.id,
             "case_id": step.case_id,
             "report_id": self.report_id,
-            "report_case_id": report_case_id,
             "name": step_data["name"],
             "step_data": step_data
-        })
+        }
 
     def parse_extracts(self, extracts: list):
         """ 解析数据提取
@@ -211,9 +209,7 @@ class RunCase(RunTestRunner):
 
         # 不满足跳过条件才解析
         if self.parse_case_is_skip(case.skip_if, self.run_server_id, self.run_phone_id) is not True:
-            steps = self.step_model.query.filter_by(
-                case_id=case.id, status=DataStatusEnum.ENABLE.value).order_by("num").all()
-            for step in steps:
+            for step in self.get_case_steps(case.id):
                 if step.quote_case:
                     self.get_all_steps(step.quote_case)
                 else:
@@ -223,6 +219,7 @@ class RunCase(RunTestRunner):
 
     def parse_all_case(self):
         """ 解析所有用例 """
+        self.prefetch_case_data(self.case_id_list)  # 一次性把要用到的数据查出来
 
         # 遍历要运行的用例
         for case_id in self.case_id_list:
@@ -242,26 +239,22 @@ class RunCase(RunTestRunner):
                 # 记录解析下后的用例
                 report_case_data = current_case.get_attr()
                 report_case_data["run_env"] = self.env_code
-                report_case = self.report_case_model.model_create_and_get({
+                report_case = {
                     "name": case_name,
                     "case_id": current_case.id,
                     "suite_id": current_case.suite_id,
                     "report_id": self.report_id,
                     "case_data": report_case_data,
                     "summary": self.report_case_model.get_summary_template()
-                })
+                }
 
                 # 满足跳过条件则跳过
                 if self.parse_case_is_skip(current_case.skip_if, self.run_server_id, self.run_phone_id) is True:
-                    report_case.test_is_skip()
+                    report_case["result"] = "skip"
+                    self.add_report_case(report_case, [], is_skip=True)
                     continue
 
-                project_id_query = self.suite_model.db.session.query(
-                    self.suite_model.project_id
-                ).filter(
-                    self.suite_model.id == current_case.suite_id
-                ).first()
-                current_project = self.get_format_project(project_id_query[0])
+                current_project = self.get_format_project(self.get_suite_project_id(current_case.suite_id))
 
                 if self.run_type == 'ui':
                     # 用例格式模板, # 火狐：geckodriver
@@ -274,11 +267,11 @@ class RunCase(RunTestRunner):
 
                 # 循环解析测试步骤
                 all_variables = {}  # 当前用例的所有公共变量
+                report_step_list = []  # 当前用例解析后的步骤
                 for step in self.all_case_steps:
                     step_case = self.get_format_case(step.case_id)
                     step_element = self.get_format_element(step.element_id)
                     step = StepModel(**step.to_dict())
-                    step.report_case_id = report_case.id
                     step.execute_name = ui_action_mapping_reverse[step.execute_type]  # 执行方式的别名，用于展示测试报告
                     step.extracts = self.parse_extracts(step.extracts)  # 解析数据提取
                     step.validates = self.parse_validates(step.validates)  # 解析断言
@@ -296,9 +289,9 @@ class RunCase(RunTestRunner):
                             # 数据驱动的 comment 字段，用于做标识
                             step.name += driver_data.get("comment", "")
                             step.params = step.params = step.data_json = step.data_form = driver_data.get("data", {})
-                            self.parse_step(element_project, step_element, step, report_case.id)
+                            report_step_list.append(self.parse_step(element_project, step_element, step))
                     else:
-                        self.parse_step(element_project, step_element, step, report_case.id)
+                        report_step_list.append(self.parse_step(element_project, step_element, step))
 
                     # 把服务和用例的的自定义变量留下来
                     all_variables.update(element_project.variables)
@@ -311,13 +304,13 @@ class RunCase(RunTestRunner):
                 all_variables.update({"device_id": self.device_id})  # 强制增加一个变量为设备id，用于去数据库查数据
                 report_case_data["variables"].update(all_variables)
                 report_case_data["run_type"] = self.run_type
-                report_case.update_report_case_data(report_case_data)
-
-                self.test_plan["report_case_list"].append(report_case.id)
+                self.add_report_case(report_case, report_step_list)
 
                 # 完整的解析完一条用例后，去除对应的解析信息
                 self.all_case_steps = []
 
+        self.flush_report_case_batch()
+
         # 去除服务级的公共变量，保证用步骤上解析后的公共变量
         self.test_plan["project_mapping"]["variables"] = {}
         self.init_parsed_data()
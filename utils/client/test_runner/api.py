@@ -1,8 +1,10 @@
+import asyncio
 import datetime
 import traceback
 
 from utils.logs.log import logger
 from . import exceptions, parser, runner
+from .client.http import AsyncHttpClientPool
 
 
 class TestRunner:
@@ -12,39 +14,57 @@ class TestRunner:
 
     def run_test(self, parsed_tests_mapping):
         """ 执行测试用例 """
+        report_case, case_runner = self.start_case(parsed_tests_mapping)
+        for test_step in parsed_tests_mapping["test_case_mapping"]["step_list"]:
+            try:
+                case_runner.run_step(test_step, parsed_tests_mapping.get("report_step_model"))  # 执行测试步骤
+                step_error_traceback = None
+            except Exception as error:
+                step_error_traceback = self.get_step_error_traceback(case_runner)
+            self.save_step_result(parsed_tests_mapping, report_case, case_runner, test_step, step_error_traceback)
+        return self.finish_case(report_case, case_runner)
+
+    def start_case(self, parsed_tests_mapping, runner_class=runner.Runner, **runner_kwargs):
+        """ 初始化用例的执行器，并标记用例开始执行 """
         functions = parsed_tests_mapping.get("project_mapping", {}).get("functions", {})
         report_case_model = parsed_tests_mapping.get("report_case_model")
-        report_step_model = parsed_tests_mapping.get("report_step_model")
         test_case_mapping = parsed_tests_mapping["test_case_mapping"]  # 执行测试用例
 
         report_case = report_case_model.query.filter_by(id=test_case_mapping["config"]["report_case_id"]).first()
-        case_runner = runner.Runner(test_case_mapping["config"], functions)
+        case_runner = runner_class(test_case_mapping["config"], functions, **runner_kwargs)
 
         report_case.summary["stat"]["total"] = len(test_case_mapping["step_list"])
         report_case.test_is_running()
 
         report_case.summary["time"]["start_at"] = datetime.datetime.now()  # 开始执行用例时间
-        for test_step in test_case_mapping["step_list"]:
-            try:
-                case_runner.run_step(test_step, report_step_model)  # 执行测试步骤
-                step_error_traceback = None
-            except Exception as error:
-                step_error_traceback = traceback.format_exc()
+        return report_case, case_runner
 
-                # 没有执行结果，代表是执行异常，否则代表是步骤里面捕获了异常过后再抛出来的
-                if case_runner.client_session.meta_data["result"] is None:
-                    logger.error(traceback.format_exc())
-                    case_runner.client_session.meta_data["result"] = "error"
+    @staticmethod
+    def get_step_error_traceback(case_runner):
+        """ 步骤执行报错，获取报错信息 """
+        step_error_traceback = traceback.format_exc()
 
-            case_runner.report_step.save_step_result_and_summary(case_runner, step_error_traceback)
-            if case_runner.run_type == "api":
-                case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data, parsed_tests_mapping["response_time_level"], test_step["report_step_id"])
-            else:
-                case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data)
+        # 没有执行结果，代表是执行异常，否则代表是步骤里面捕获了异常过后再抛出来的
+        if case_runner.client_session.meta_data["result"] is None:
+            logger.error(step_error_traceback)
+            case_runner.client_session.meta_data["result"] = "error"
+        return step_error_traceback
+
+    @staticmethod
+    def save_step_result(parsed_tests_mapping, report_case, case_runner, test_step, step_error_traceback):
+        """ 保存步骤的执行结果，并统计到用例中 """
+        case_runner.report_step.save_step_result_and_summary(case_runner, step_error_traceback)
+        if case_runner.run_type == "api":
+            case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data, parsed_tests_mapping["response_time_level"], test_step["report_step_id"])
+        else:
+            case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data)
+
+    @staticmethod
+    def finish_case(report_case, case_runner):
+        """ 用例执行完毕，保存用例的执行结果 """
         report_case.summary["time"]["end_at"] = datetime.datetime.now()  # 用例执行结束时间
         case_runner.try_close_browser()  # 执行完一条用例，不管是不是ui自动化，都强制执行关闭浏览器，防止执行时报错，导致没有关闭到浏览器造成driver进程一直存在
         report_case.save_case_result_and_summary()
-
         return report_case.summary
 
     def run(self, test_plan):
@@ -52,14 +72,141 @@ class TestRunner:
         report = test_plan["report_model"].get_first(id=test_plan["report_id"])
 
         start_run_test_time = datetime.datetime.now()
+        run_policy = test_plan.get("run_policy")
         for report_case_id in test_plan["report_case_list"]: # 解析一条用例就执行一条用例，减少内存开销
-            parsed_test_res = parser.parse_test_data(test_plan, report_case_id)  # 解析测试计划
-            if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
-                case_summary = parsed_test_res
+            self.check_run_lease(test_plan)
+            if run_policy and run_policy.is_stop():  # 触发了执行策略，剩下的用例不再执行
+                case_summary = self.cancel_case(test_plan, report_case_id, run_policy.stop_reason)
             else:
-                case_summary = self.run_test(parsed_test_res)  # 执行测试用例
+                parsed_test_res = parser.parse_test_data(test_plan, report_case_id)  # 解析测试计划
+                if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
+                    case_summary = parsed_test_res
+                else:
+                    case_summary = self.run_test(parsed_test_res)  # 执行测试用例
+                if run_policy:
+                    run_policy.record(case_summary["result"])
             self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
+        self.set_run_time(start_run_test_time)
+
+    @staticmethod
+    def check_run_lease(test_plan):
+        """ 从执行队列领取执行时，租约已被其他节点接管则抛出 RunLeaseLost，停止执行 """
+        check_run_lease = test_plan.get("check_run_lease")
+        if check_run_lease:
+            check_run_lease()
+
+    @staticmethod
+    def cancel_case(test_plan, report_case_id, reason):
+        """ 用例不再执行，标记为取消执行，步骤都没执行，不计入步骤统计 """
+        report_case = test_plan["report_case_model"].query.filter_by(id=report_case_id).first()
+        summary = report_case.summary
+        summary["result"] = "cancel"
+        summary["stat"]["total"] = 0
+        report_case.test_is_cancel(summary=summary, error_msg=reason)
+        return summary
+
+    def set_run_time(self, start_run_test_time):
+        """ 记录整个执行的开始、结束时间和耗时 """
         run_case_finish_time = datetime.datetime.now()
         self.summary["time"]["start_at"] = start_run_test_time.strftime("%Y-%m-%d %H:%M:%S")
         self.summary["time"]["end_at"] = run_case_finish_time.strftime("%Y-%m-%d %H:%M:%S")
         self.summary["time"]["all_duration"] = (run_case_finish_time - start_run_test_time).total_seconds()
+
+
+class AsyncTestRunner(TestRunner):
+    """ 接口自动化的协程执行器
+    在一个事件循环中以协程并发执行多条用例，同时执行的用例数不超过 concurrency，
+    一条用例内的步骤依旧按顺序执行，所有用例共用一个 httpx.AsyncClient 连接池
+    解析用例、读写报告等数据库操作放到线程中执行（各自使用单独的数据库会话），不阻塞事件循环
+    """
+
+    def __init__(self, concurrency=100):
+        super().__init__()
+        self.concurrency = max(int(concurrency or 1), 1)
+
+    async def async_start_case(self, parsed_tests_mapping, client_pool):
+        """ 同 start_case，用例级别的前置函数在事件循环中执行，打印能重定向到步骤中 """
+        functions = parsed_tests_mapping.get("project_mapping", {}).get("functions", {})
+        report_case_model = parsed_tests_mapping.get("report_case_model")
+        test_case_mapping = parsed_tests_mapping["test_case_mapping"]
+
+        report_case = await report_case_model.run_in_thread(
+            report_case_model.get_first, id=test_case_mapping["config"]["report_case_id"])
+        case_runner = runner.AsyncRunner(test_case_mapping["config"], functions, client_pool=client_pool)
+
+        report_case.summary["stat"]["total"] = len(test_case_mapping["step_list"])
+        await report_case_model.run_in_thread(report_case.test_is_running)
+
+        report_case.summary["time"]["start_at"] = datetime.datetime.now()  # 开始执行用例时间
+        return report_case, case_runner
+
+    async def async_run_test(self, parsed_tests_mapping, client_pool):
+        """ 同 run_test """
+        report_case, case_runner = await self.async_start_case(parsed_tests_mapping, client_pool)
+        report_case_model = parsed_tests_mapping["report_case_model"]
+        for test_step in parsed_tests_mapping["test_case_mapping"]["step_list"]:
+            try:
+                await case_runner.async_run_step(test_step, parsed_tests_mapping.get("report_step_model"))
+                step_error_traceback = None
+            except Exception as error:
+                step_error_traceback = self.get_step_error_traceback(case_runner)
+            await report_case_model.run_in_thread(
+                self.save_step_result, parsed_tests_mapping, report_case, case_runner, test_step, step_error_traceback)
+        return await report_case_model.run_in_thread(self.finish_case, report_case, case_runner)
+
+    async def async_run_case(self, test_plan, report_case_id, semaphore, client_pool):
+        """ 解析并执行一条用例，用例执行异常时标记为错误，不影响其他用例 """
+        async with semaphore:
+            self.check_run_lease(test_plan)
+            run_policy = test_plan.get("run_policy")
+            if run_policy and run_policy.is_stop():  # 触发了执行策略，剩下的用例不再执行
+                return await test_plan["report_case_model"].run_in_thread(
+                    self.cancel_case, test_plan, report_case_id, run_policy.stop_reason)
+            summary = await self.async_run_case_summary(test_plan, report_case_id, client_pool)
+            if run_policy:  # 可能要探测运行环境，放到线程中，不阻塞事件循环
+                await asyncio.to_thread(run_policy.record, summary["result"])
+            return summary
+
+    async def async_run_case_summary(self, test_plan, report_case_id, client_pool):
+        """ 解析并执行一条用例，返回用例的执行结果 """
+        report_case_model = test_plan["report_case_model"]
+        parsed_test_res = await report_case_model.run_in_thread(
+            parser.parse_test_data, test_plan, report_case_id)  # 解析测试计划
+        if parsed_test_res.get("result") == "error":
+            return parsed_test_res
+        try:
+            return await self.async_run_test(parsed_test_res, client_pool)
+        except Exception as error:
+            logger.error(traceback.format_exc())
+            return await report_case_model.run_in_thread(
+                self.set_case_error, test_plan, report_case_id, traceback.format_exc())
+
+    @staticmethod
+    def set_case_error(test_plan, report_case_id, error_msg):
+        """ 用例执行异常，标记为错误 """
+        report_case = test_plan["report_case_model"].query.filter_by(id=report_case_id).first()
+        summary = report_case.summary
+        summary["result"] = "error"
+        report_case.test_is_error(summary=summary, error_msg=error_msg)
+        return summary
+
+    async def async_run(self, test_plan):
+        """ 并发执行所有用例，按用例顺序返回用例的执行结果 """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client_pool = AsyncHttpClientPool(**(test_plan.get("http_client_limits") or {}))
+        try:
+            return await asyncio.gather(*[
+                self.async_run_case(test_plan, report_case_id, semaphore, client_pool)
+                for report_case_id in test_plan["report_case_list"]
+            ])
+        finally:
+            await client_pool.aclose()
+
+    def run(self, test_plan):
+        """ 执行测试的流程 """
+        report = test_plan["report_model"].get_first(id=test_plan["report_id"])
+
+        start_run_test_time = datetime.datetime.now()
+        for case_summary in asyncio.run(self.async_run(test_plan)):
+            self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
+        self.set_run_time(start_run_test_time)
@@ -28,6 +28,7 @@ class BaseSession:
                 "content_size": "",
                 "response_time_ms": 0,
                 "elapsed_ms": 0,
+                "limiter_wait_ms": 0,
             },
             "setup_hooks": [],
             "teardown_hooks": [],
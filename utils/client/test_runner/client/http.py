@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
-import copy
 import traceback
 from datetime import datetime
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from threading import Lock
 from urllib import parse
 
 import httpx
@@ -10,7 +11,8 @@ from httpx import Response, HTTPStatusError
 from utils.util.file_util import FileUtil
 from utils.client.test_runner import logger
 from utils.client.test_runner.client import BaseSession
-from utils.client.test_runner.utils import build_url, lower_dict_keys, omit_long_data
+from utils.client.test_runner.client.rate_limit import HostRateLimiter, get_host_key
+from utils.client.test_runner.utils import build_url, lower_dict_keys, omit_long_data, load_response_json
 
 
 class ApiResponse(Response):
@@ -22,6 +24,93 @@ class ApiResponse(Response):
         Response.raise_for_status(self)
 
 
+class HttpClientPool:
+    """ 一次测试运行内复用的httpx连接池，同一个运行内的所有请求共用TCP/TLS连接（keep-alive）
+    httpx.Client 的 verify、proxy 只能在创建时指定，所以按 (verify, proxy) 分别创建client
+    client 不保存响应返回的cookie，保证与每次请求都新建连接时的行为一致，各用例之间cookie不会串
+    host_rate_limits: 各域名的限流配置 {协议://域名:端口: {rate, burst, max_in_flight}}，同一个运行内共用限流器
+    """
+    _run_pool_dict = {}  # {report_id: HttpClientPool}
+    _run_pool_lock = Lock()
+    client_class = httpx.Client
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=5, host_rate_limits=None,
+                 **kwargs):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.client_dict = {}  # {(verify, proxy): httpx.Client}
+        self.lock = Lock()
+        self.host_limiter_dict = {
+            host_key: HostRateLimiter(**rate_limit) for host_key, rate_limit in (host_rate_limits or {}).items()
+        }
+
+    def get_host_limiter(self, url):
+        """ 请求地址对应域名的限流器，没有配置限流则返回None """
+        return self.host_limiter_dict.get(get_host_key(url)) if self.host_limiter_dict else None
+
+    @classmethod
+    def get_run_pool(cls, run_id, **limits):
+        """ 获取指定运行（报告id）的连接池，没有则创建，没有运行id则返回None """
+        if run_id is None:
+            return None
+        with cls._run_pool_lock:
+            if run_id not in cls._run_pool_dict:
+                cls._run_pool_dict[run_id] = cls(**limits)
+            return cls._run_pool_dict[run_id]
+
+    @classmethod
+    def close_run_pool(cls, run_id):
+        """ 运行结束，关闭此次运行的连接池 """
+        with cls._run_pool_lock:
+            pool = cls._run_pool_dict.pop(run_id, None)
+        if pool:
+            pool.close()
+
+    def get_client(self, verify=True, proxy=None):
+        """ 根据 verify、proxy 获取对应的client """
+        key = (verify, proxy)
+        client = self.client_dict.get(key)
+        if client is None:
+            with self.lock:
+                client = self.client_dict.get(key)
+                if client is None:
+                    client = self.client_class(
+                        verify=verify,
+                        proxy=proxy,
+                        limits=self.limits,
+                        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))  # 不保存响应的cookie
+                    )
+                    self.client_dict[key] = client
+        return client
+
+    def close(self):
+        """ 关闭所有client，释放连接 """
+        with self.lock:
+            client_list, self.client_dict = list(self.client_dict.values()), {}
+        for client in client_list:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+class AsyncHttpClientPool(HttpClientPool):
+    """ 协程执行时使用的连接池，client为httpx.AsyncClient，需在事件循环内创建和关闭，由执行器自行管理，不放到运行级别的连接池中 """
+    client_class = httpx.AsyncClient
+
+    async def aclose(self):
+        """ 关闭所有client，释放连接 """
+        client_list, self.client_dict = list(self.client_dict.values()), {}
+        for client in client_list:
+            try:
+                await client.aclose()
+            except Exception:
+                pass
+
+
 # class HttpSession(requests.Session, BaseSession):
 class HttpSession(BaseSession):
     """
@@ -32,12 +121,22 @@ class HttpSession(BaseSession):
     url允许只传接口地址，不传host，此时在发请求时会自动加上base_url
     """
 
-    def __init__(self, base_url=None, *args, **kwargs):
+    def __init__(self, base_url=None, client_pool=None, *args, **kwargs):
         # super(HttpSession, self).__init__(*args, **kwargs)
         self.base_url = base_url if base_url else ""
         self.request_at = self.response_at = datetime.now()
+        self.limiter_wait_ms = 0  # 发请求前等待限流的耗时
         self.init_step_meta_data()
 
+        # 没有传运行级别的连接池时，自己创建一个，并在关闭会话时释放
+        self.is_own_pool = client_pool is None
+        self.client_pool = HttpClientPool() if client_pool is None else client_pool
+
+    def close(self):
+        """ 关闭会话，只释放会话自己创建的连接池，运行级别的连接池由运行结束时统一释放 """
+        if self.is_own_pool:
+            self.client_pool.close()
+
     def get_req_resp_record(self, resp_obj):
         """ 从response对象中获取请求和响应信息。 """
         def log_print(req_resp_dict, r_type):
@@ -82,8 +181,8 @@ class HttpSession(BaseSession):
             req_resp_dict["response"]["content"] = resp_obj.content
         else:
             try:
-                # 响应体转json
-                req_resp_dict["response"]["json"] = resp_obj.json()
+                # 响应体转json，解析结果和数据提取、断言共用
+                req_resp_dict["response"]["json"] = load_response_json(resp_obj)
             except ValueError:
                 # 若不能转为json，则转为文本，默认最多512个字符
                 resp_text = resp_obj.text
@@ -93,7 +192,32 @@ class HttpSession(BaseSession):
 
         return req_resp_dict
 
-    def send_client_request(self, method, url, name=None, case_id=None, variables_mapping={}, **kwargs):
+    def send_client_request(self, method, url, name=None, case_id=None, variables_mapping={}, keep_alive=True, **kwargs):
+        request_url, request_kwargs = self.before_send_request(method, url, name, case_id, variables_mapping, **kwargs)
+        limiter = self.client_pool.get_host_limiter(request_url)
+        self.limiter_wait_ms = limiter.acquire() if limiter else 0
+        try:
+            response = self._send_request_safe_mode(method, request_url, keep_alive, **request_kwargs)
+        finally:
+            if limiter:
+                limiter.release()
+        return self.after_send_request(response, name, **kwargs)
+
+    async def async_send_client_request(
+            self, method, url, name=None, case_id=None, variables_mapping={}, keep_alive=True, **kwargs):
+        """ 同 send_client_request，在事件循环中发送请求 """
+        request_url, request_kwargs = self.before_send_request(method, url, name, case_id, variables_mapping, **kwargs)
+        limiter = self.client_pool.get_host_limiter(request_url)
+        self.limiter_wait_ms = await limiter.async_acquire() if limiter else 0
+        try:
+            response = await self._async_send_request_safe_mode(method, request_url, keep_alive, **request_kwargs)
+        finally:
+            if limiter:
+                limiter.async_release()
+        return self.after_send_request(response, name, **kwargs)
+
+    def before_send_request(self, method, url, name=None, case_id=None, variables_mapping={}, **kwargs):
+        """ 记录原始的请求信息，并构建发送请求时使用的url和参数 """
         self.meta_data["name"] = name  # 记录测试名
         self.meta_data["case_id"] = case_id  # 步骤对应的用例id
         self.meta_data["variables_mapping"] = variables_mapping  # 记录发起此次请求时内存中的自定义变量
@@ -105,7 +229,9 @@ class HttpSession(BaseSession):
 
         # 构建请求的url
         url = build_url(self.base_url, url)
-        copy_kwargs = copy.deepcopy(kwargs)  # 保留转码前的内容
+        # 保留转码前的内容，只有 headers 会被原地修改，其他字段都是整体替换，浅拷贝即可
+        copy_kwargs = dict(kwargs)
+        copy_kwargs["headers"] = dict(copy_kwargs.get("headers") or {})
         copy_kwargs["files"] = FileUtil.build_request_file(copy_kwargs["files"])  # 构建文件请求对象
 
         # 如果是 x-www-form-urlencoded 则进行转码
@@ -117,8 +243,10 @@ class HttpSession(BaseSession):
             if value is None:
                 copy_kwargs["headers"][key] = 'null'
 
-        response = self._send_request_safe_mode(method, url, **copy_kwargs)
+        return url, copy_kwargs
 
+    def after_send_request(self, response, name=None, **kwargs):
+        """ 记录请求耗时、请求和响应信息 """
         # 获取内容的长度，如果stream为True，则从响应头部获取，否则计算响应内容的长度
         if kwargs.get("stream", False):
             content_size = int(dict(response.headers).get("content-length") or 0)
@@ -129,6 +257,7 @@ class HttpSession(BaseSession):
         self.meta_data["stat"] = {
             "content_size": content_size,
             "elapsed_ms": round(response.elapsed.total_seconds() * 1000, 3),  # 请求耗时, 秒转毫秒
+            "limiter_wait_ms": self.limiter_wait_ms,  # 发请求前等待限流的耗时，不计入请求耗时
             "request_at": self.request_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
             "response_at": self.response_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
         }
@@ -146,12 +275,19 @@ class HttpSession(BaseSession):
 
         return response
 
-    def _send_request_safe_mode(self, method, url, **kwargs):
-        """ 发送HTTP请求，并捕获由于连接问题而可能发生的任何异常。 """
+    def _send_request_safe_mode(self, method, url, keep_alive=True, **kwargs):
+        """ 发送HTTP请求，并捕获由于连接问题而可能发生的任何异常。
+        keep_alive 为真时从连接池取client发请求，复用连接；否则每次请求都新建连接，用完即关闭
+        """
         try:
             self.request_at = datetime.now()
             logger.log_info(f"_send_request_safe_mode.try: method: {method}, url: {url}, kwargs: {kwargs}")
-            response = httpx.request(method, url, **kwargs) # requests库出现过卡死发不出请求的情况，换为httpx后没有出现问题
+            if keep_alive:
+                verify, proxy = kwargs.pop("verify", True), kwargs.pop("proxy", None)
+                client = self.client_pool.get_client(verify, proxy)
+                response = client.request(method, url, **kwargs)
+            else:
+                response = httpx.request(method, url, **kwargs) # requests库出现过卡死发不出请求的情况，换为httpx后没有出现问题
             self.response_at = datetime.now()
             return response
         except HTTPStatusError as ex:
@@ -164,3 +300,26 @@ class HttpSession(BaseSession):
         except Exception as e:
             logger.log_error(f"_send_request_safe_mode.Exception: \n{traceback.format_exc()}")
             raise
+
+    async def _async_send_request_safe_mode(self, method, url, keep_alive=True, **kwargs):
+        """ 同 _send_request_safe_mode，client_pool需为 AsyncHttpClientPool """
+        try:
+            self.request_at = datetime.now()
+            logger.log_info(f"_async_send_request_safe_mode.try: method: {method}, url: {url}, kwargs: {kwargs}")
+            verify, proxy = kwargs.pop("verify", True), kwargs.pop("proxy", None)
+            if keep_alive:
+                response = await self.client_pool.get_client(verify, proxy).request(method, url, **kwargs)
+            else:
+                async with httpx.AsyncClient(verify=verify, proxy=proxy) as client:
+                    response = await client.request(method, url, **kwargs)
+            self.response_at = datetime.now()
+            return response
+        except HTTPStatusError as ex:
+            logger.log_info(f"_async_send_request_safe_mode.HTTPStatusError: \n{traceback.format_exc()}")
+            resp = ApiResponse()
+            resp.error = ex
+            resp.status_code = 0
+            return resp
+        except Exception as e:
+            logger.log_error(f"_async_send_request_safe_mode.Exception: \n{traceback.format_exc()}")
+            raise
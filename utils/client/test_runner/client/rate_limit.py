@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+""" 按域名限制发出的请求，避免并行执行时把被测环境的网关打挂、或被网关限流(429)导致用例误报
+
+    rate: 每秒最多发出的请求数，令牌桶算法，桶容量为 burst，允许短时间内突发 burst 个请求
+    max_in_flight: 同时在途（已发出、还没收到响应）的请求数上限
+    为0则不限制，在服务环境上配置，一次运行内同一个域名的所有请求共用一个限流器
+    用例分片到各节点执行时，各分片的限流器是独立的，限流配置按分片数平分，所有分片加起来不超过配置的值
+"""
+import asyncio
+import time
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+
+
+DEFAULT_PORT = {"http": 80, "https": 443}
+
+
+def get_host_key(url):
+    """ 限流的key，协议+域名+端口，协议的默认端口省略，http://h 和 http://h:80 是同一个key """
+    split_url = urlsplit(url or "")
+    if not split_url.hostname:
+        return None
+    scheme, host = split_url.scheme.lower(), split_url.hostname  # hostname 已转为小写、去掉了用户信息
+    if ":" in host:  # IPv6
+        host = f'[{host}]'
+    try:
+        port = split_url.port
+    except ValueError:  # 端口不合法，按原样作为key
+        return f'{scheme}://{split_url.netloc}'.lower()
+    return f'{scheme}://{host}' if port is None or port == DEFAULT_PORT.get(scheme) else f'{scheme}://{host}:{port}'
+
+
+def merge_rate_limit(rate_limit1, rate_limit2):
+    """ 同一个域名配置了多个限流时，各项取最严格的（不为0的最小值） """
+    if not rate_limit1:
+        return rate_limit2
+    merged = {}
+    for key in set(rate_limit1) | set(rate_limit2):
+        value_list = [value for value in (rate_limit1.get(key), rate_limit2.get(key)) if value]
+        merged[key] = min(value_list) if value_list else 0
+    return merged
+
+
+def split_rate_limit(rate_limit, count):
+    """ 把限流配置平分为 count 份，每份的在途请求数、桶容量至少为1 """
+    if count <= 1:
+        return rate_limit
+    return {
+        **rate_limit,
+        "rate": (rate_limit.get("rate") or 0) / count,
+        "burst": max((rate_limit.get("burst") or 0) / count, 1),
+        "max_in_flight": max(int(rate_limit.get("max_in_flight") or 0) // count, 1) if rate_limit.get(
+            "max_in_flight") else 0
+    }
+
+
+class HostRateLimiter:
+
+    def __init__(self, rate=0, burst=0, max_in_flight=0, **kwargs):
+        self.rate = float(rate or 0)
+        self.burst = max(float(burst or 0), 1)
+        self.tokens = self.burst
+        self.token_updated_at = time.monotonic()
+        self.token_lock = Lock()
+        self.max_in_flight = int(max_in_flight or 0)
+        self.in_flight = BoundedSemaphore(self.max_in_flight) if self.max_in_flight else None
+        self.async_in_flight = None  # 协程执行时使用，在事件循环内第一次使用时创建
+
+    def reserve_token(self):
+        """ 预支一个令牌，返回拿到令牌需要等待的秒数 """
+        if not self.rate:
+            return 0
+        with self.token_lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.token_updated_at) * self.rate)
+            self.token_updated_at = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        """ 等待直到可以发请求，返回等待的毫秒数 """
+        start_at = time.monotonic()
+        if self.in_flight:
+            self.in_flight.acquire()
+        wait_time = self.reserve_token()
+        if wait_time:
+            time.sleep(wait_time)
+        return round((time.monotonic() - start_at) * 1000, 3)
+
+    def release(self):
+        """ 请求结束，释放在途名额 """
+        if self.in_flight:
+            self.in_flight.release()
+
+    async def async_acquire(self):
+        """ 同 acquire，在事件循环中等待 """
+        start_at = time.monotonic()
+        if self.max_in_flight:
+            if self.async_in_flight is None:
+                self.async_in_flight = asyncio.Semaphore(self.max_in_flight)
+            await self.async_in_flight.acquire()
+        wait_time = self.reserve_token()
+        if wait_time:
+            await asyncio.sleep(wait_time)
+        return round((time.monotonic() - start_at) * 1000, 3)
+
+    def async_release(self):
+        if self.async_in_flight:
+            self.async_in_flight.release()
@@ -86,3 +86,10 @@ class StopTest(MyBaseError):
 
     def __init__(self, msg):
         MyBaseError.__init__(self, msg)
+
+
+class RunLeaseLost(MyBaseError):
+    """ 从执行队列领取的任务租约已被其他节点接管，停止执行、不再写入报告 """
+
+    def __init__(self, msg):
+        MyBaseError.__init__(self, msg)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+""" 函数注册表，一次测试运行中 ${func()} 能引用的所有函数
+
+    查找优先级：自定义脚本中的函数 > 内置断言方法(validate_func) > python内置函数(builtins)
+    内置函数在进程内只加载一次，自定义脚本的函数在测试执行前合并进来，执行过程中不再变化，
+    查找就是一次dict取值，没找到的函数直接报错，不再用 eval 兜底
+"""
+import builtins
+from collections.abc import Mapping
+from threading import Lock
+
+from . import exceptions, validate_func
+
+_builtin_functions = None
+_builtin_functions_lock = Lock()
+
+
+def get_builtin_functions():
+    """ 内置函数，进程内只加载一次 """
+    global _builtin_functions
+    if _builtin_functions is None:
+        with _builtin_functions_lock:
+            if _builtin_functions is None:
+                functions = {
+                    name: item for name, item in vars(builtins).items() if callable(item) and not name.startswith("_")
+                }
+                functions.update(validate_func.load_builtin_functions())
+                _builtin_functions = functions
+    return _builtin_functions
+
+
+def get_function(function_name, functions_mapping=None):
+    """ 从自定义函数和内置函数中查找函数，都没有则抛出 FunctionNotFound """
+    if functions_mapping and function_name in functions_mapping:
+        return functions_mapping[function_name]
+    function = get_builtin_functions().get(function_name)
+    if function is None:
+        raise exceptions.FunctionNotFound(f"自定义函数 【{function_name}】 没有找到")
+    return function
+
+
+class FunctionRegistry(Mapping):
+    """ 一次测试运行的函数注册表，只读，创建后所有用例、步骤共用 """
+
+    def __init__(self, functions=None):
+        self.script_function_names = sorted(functions or {})  # 自定义脚本中的函数名，用于打印日志
+        self._functions = {**get_builtin_functions(), **(functions or {})}
+
+    def __getitem__(self, function_name):
+        return self._functions[function_name]
+
+    def __contains__(self, function_name):
+        return function_name in self._functions
+
+    def __iter__(self):
+        return iter(self._functions)
+
+    def __len__(self):
+        return len(self._functions)
+
+    def __repr__(self):
+        return f'FunctionRegistry({self.script_function_names})'
+
+    def check_functions(self, function_names):
+        """ 解析时校验引用的函数都存在，有不存在的函数则直接抛出 FunctionNotFound，不用等到执行时才报错 """
+        not_found_list = [name for name in function_names if name not in self._functions]
+        if not_found_list:
+            raise exceptions.FunctionNotFound(f"自定义函数 【{'、'.join(sorted(set(not_found_list)))}】 没有找到")
@@ -3,9 +3,9 @@ import ast
 import re
 import traceback
 
-from . import exceptions, utils
+from . import exceptions, template, utils
 from .compat import basestring, builtin_str, numeric_types
-from .validate_func import load_builtin_functions
+from .function_registry import FunctionRegistry, get_function
 from utils.variables.regexp import variable_regexp, function_regexp, function_regexp_compile
 
 
@@ -297,41 +297,20 @@ def get_mapping_variable(variable_name, variables_mapping):
 
 
 def get_mapping_function(function_name, functions_mapping):
-    """ get function from functions_mapping,
-        if not found, then try to check if builtin function.
+    """ 从 functions_mapping 中获取函数，没有则从内置函数中获取，见 function_registry.py
 
     Args:
-        variable_name (str): variable name
-        variables_mapping (dict): variables mapping
+        function_name (str): 函数名
+        functions_mapping (dict): 自定义函数，一次测试运行中为 FunctionRegistry
 
     Returns:
         mapping function object.
 
     Raises:
-        exceptions.FunctionNotFound: function is neither defined in debugtalk.py nor builtin.
+        exceptions.FunctionNotFound: 自定义函数和内置函数中都没有
 
     """
-    if function_name in functions_mapping:
-        return functions_mapping[function_name]
-
-    try:
-        # check if TestRunner builtin functions
-        # from . import loader
-        # built_in_functions = loader.load_builtin_functions()
-        built_in_functions = load_builtin_functions()
-        return built_in_functions[function_name]
-    except KeyError:
-        pass
-
-    try:
-        # check if Python builtin functions
-        item_func = eval(function_name)
-        if callable(item_func):
-            # is builtin function
-            return item_func
-    except (NameError, TypeError):
-        # is not builtin function
-        raise exceptions.FunctionNotFound(f"自定义函数 【{function_name}】 没有找到")
+    return get_function(function_name, functions_mapping)
 
 
 def parse_string_functions(content, variables_mapping, functions_mapping):
@@ -389,12 +368,13 @@ def parse_string_functions(content, variables_mapping, functions_mapping):
     return content
 
 
-def parse_string_variables(content, variables_mapping, functions_mapping):
+def parse_string_variables(content, variables_mapping, functions_mapping, variables_list=None):
     """ 从字符串中，解析引用变量
 
     Args:
         content (str): string content to be parsed.
         variables_mapping (dict): variables mapping.
+        variables_list (list): 已经提取好的变量名，不传则从content中提取
 
     Returns:
         str: parsed string content.
@@ -406,7 +386,8 @@ def parse_string_variables(content, variables_mapping, functions_mapping):
             "/api/users/1000"
 
     """
-    variables_list = extract_variables(content)
+    if variables_list is None:
+        variables_list = extract_variables(content)
     for variable_name in variables_list:
         variable_value = get_mapping_variable(variable_name, variables_mapping)
 
@@ -479,53 +460,8 @@ def parse_data(content, variables_mapping=None, functions_mapping=None, raise_if
     if content is None or isinstance(content, (numeric_types, bool, type)):
         return content
 
-    if isinstance(content, (list, set, tuple)):
-        return [
-            parse_data(
-                item,
-                variables_mapping,
-                functions_mapping,
-                raise_if_variable_not_found
-            )
-            for item in content
-        ]
-
-    if isinstance(content, dict):
-        parsed_content = {}
-        for key, value in content.items():
-            parsed_key = parse_data(
-                key,
-                variables_mapping,
-                functions_mapping,
-                raise_if_variable_not_found
-            )
-            parsed_value = parse_data(
-                value,
-                variables_mapping,
-                functions_mapping,
-                raise_if_variable_not_found
-            )
-            parsed_content[parsed_key] = parsed_value
-
-        return parsed_content
-
-    if isinstance(content, basestring):
-        # content is in string format here
-        variables_mapping = utils.list_to_dict(variables_mapping or {})
-        functions_mapping = functions_mapping or {}
-        content = content.strip()
-
-        try:
-            # 提取并执行自定义函数
-            content = parse_string_functions(content, variables_mapping, functions_mapping)
-
-            # 用公用变量替换字符串中的占位符
-            content = parse_string_variables(content, variables_mapping, functions_mapping)
-        except exceptions.VariableNotFound:
-            if raise_if_variable_not_found:
-                raise
-
-    return content
+    # 编译成模板后再渲染，相同内容只编译一次，见 template.py
+    return template.render(content, variables_mapping, functions_mapping, raise_if_variable_not_found)
 
 
 def parse_test_config(config, project_mapping):
@@ -649,12 +585,30 @@ def parse_test_step(steps: list, case_config: dict, project_mapping: dict):
             step["name"] = parse_data(step.pop("name", ""), step["variables"], functions, False)
 
 
+# 会渲染的字段，只校验这些字段中引用的函数是否存在
+CONFIG_RENDER_FIELDS = ("variables", "name", "base_url", "setup_hooks", "teardown_hooks")  # 用例配置，解析、执行用例时渲染
+STEP_PARSE_RENDER_FIELDS = ("variables", "name", "base_url", "skip_if")  # 步骤，解析时、判断是否跳过时渲染
+STEP_RUN_RENDER_FIELDS = ("request", "test_action", "setup_hooks", "teardown_hooks", "extract", "validate")  # 步骤，不跳过才渲染
+
+
+def check_render_functions(content_dict, field_list, functions):
+    """ 校验 content_dict 中会渲染的字段引用的函数都存在，有不存在的函数则直接抛出 FunctionNotFound """
+    functions.check_functions(template.get_function_names([content_dict.get(field) for field in field_list]))
+
+
 def parse_test_case(test_case, project_mapping):
     """ 解析测试用例和测试步骤
     Args:
         test_case: {"config": {}, "test_step": []}
     """
     test_case.setdefault("config", {})
+    functions = project_mapping.get("functions", {})
+    if not isinstance(functions, FunctionRegistry):
+        functions = FunctionRegistry(functions)
+    # 引用了不存在的函数，解析时就报错；步骤执行时才渲染的字段，在确定不跳过后、执行前由 Runner 校验
+    check_render_functions(test_case["config"], CONFIG_RENDER_FIELDS, functions)
+    for step in test_case["step_list"]:
+        check_render_functions(step, STEP_PARSE_RENDER_FIELDS, functions)
     parse_test_config(test_case["config"], project_mapping)
     parse_test_step(test_case["step_list"], test_case["config"], project_mapping)
 
@@ -699,6 +653,9 @@ def parse_test_data(tests_dict, report_case_id):
         "step_list": tests_dict["report_step_model"].get_test_step_by_report_case(report_case.id)
     }
     test_case_mapping["config"]["pause_step_time_out"] = tests_dict["pause_step_time_out"]
+    test_case_mapping["config"]["report_id"] = tests_dict["report_id"]
+    test_case_mapping["config"]["report_step_progress"] = tests_dict.get("report_step_progress") or {}
+    test_case_mapping["config"]["http_client_limits"] = tests_dict.get("http_client_limits") or {}
     try:
         parse_test_case(test_case_mapping, tests_dict.get("project_mapping", {}))
     except Exception as error:
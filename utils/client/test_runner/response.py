@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+from functools import lru_cache
 
 from . import exceptions, utils
 from .compat import OrderedDict, basestring
@@ -9,6 +10,117 @@ from .validator import is_extract_expression, is_const
 from ...variables.regexp import text_extractor_regexp_compile
 
 
+class FieldExtractor:
+    """ 编译后的提取表达式，正则表达式只编译一次，路径表达式只拆分一次
+        "LB[\d]*(.*)RB[\d]*"           => regex=re.compile("LB[\d]*(.*)RB[\d]*")
+        "content.person.name"          => top_query="content", sub_query="person.name"
+    """
+    __slots__ = ("field", "regex", "top_query", "sub_query")
+
+    def __init__(self, field):
+        self.field = field
+        self.regex = re.compile(field) if text_extractor_regexp_compile.match(field) else None
+        # string.split(sep=None, maxsplit=-1) -> list of strings
+        # e.g. "content.person.name" => ["content", "person.name"]
+        try:
+            self.top_query, self.sub_query = field.split('.', 1)
+        except ValueError:
+            self.top_query, self.sub_query = field, None
+        if self.sub_query:
+            utils.split_json_query(self.sub_query)  # 预先拆分路径，查询时直接取缓存
+
+
+@lru_cache(maxsize=4096)
+def compile_field(field):
+    return FieldExtractor(field)
+
+
+class ExtractExpression:
+    """ 编译后的数据提取表达式，同一个步骤定义的提取表达式只解析一次，每次执行只做取值
+    extract_type:
+        function: 嵌套了自定义函数，func_name为函数名，args/kwargs 为 [(参数类型, 值)]，参数类型为 literal、variable、field
+        const: 常量，value 为常量值
+        variable: 变量，value 为变量名，field 为变量中的路径表达式，如 variable.$data.data
+        field: 从响应中提取，field 为编译后的提取表达式
+    """
+    __slots__ = ("extract_type", "value", "field", "func_name", "args", "kwargs")
+
+    def __init__(self, extract_type, value=None, field=None, func_name=None, args=(), kwargs=()):
+        self.extract_type = extract_type
+        self.value = value
+        self.field = field
+        self.func_name = func_name
+        self.args = args
+        self.kwargs = kwargs
+
+    @staticmethod
+    def compile_arg(arg, check_const=True):
+        """ 编译自定义函数的参数，判断是自定义变量、常量、还是提取表达式 """
+        variable = extract_variables(arg)
+        if variable:
+            return "variable", variable[0]
+        if check_const and is_const(arg):
+            return "literal", str(arg)
+        if is_extract_expression(arg):
+            return "field", arg
+        return "literal", arg
+
+    @classmethod
+    def compile(cls, expression):
+        functions = extract_functions(expression)
+        if functions:  # 有嵌套自定义函数，先执行提取，再执行自定义函数
+            # 提取自定义函数 {'func_name': 'add', 'args': ['content.data'], 'kwargs': {}}
+            extract_function_data = parse_function(functions[0])
+            return cls(
+                "function",
+                func_name=extract_function_data['func_name'],
+                args=tuple(cls.compile_arg(arg) for arg in extract_function_data.get('args', [])),
+                kwargs=tuple((key, cls.compile_arg(value, False))
+                             for key, value in extract_function_data.get('kwargs', {}).items())
+            )
+
+        if expression.startswith("const"):  # 常量
+            return cls("const", value=expression.split("const.")[1])
+
+        if expression.startswith("variable"):  # 变量：variable.$data.data 或者 variable.$data
+            variable_expression = expression.split("variable.")[1]
+            variable_expression_split = variable_expression.split(".", 1)
+            if len(variable_expression_split) > 1:  # $data.data
+                variable, extract_expression = variable_expression_split
+                return cls("variable", value=extract_variables(variable)[0], field=f"variable.{extract_expression}")
+            return cls("variable", value=extract_variables(variable_expression_split[0])[0])  # $data
+
+        return cls("field", field=expression)  # 从响应中提取
+
+    def get_arg_value(self, arg, resp_obj, variables_mapping):
+        arg_type, value = arg
+        if arg_type == "variable":
+            return get_mapping_variable(value, variables_mapping)
+        if arg_type == "field":
+            return utils.copy_json(resp_obj.extract_field(value))  # 自定义函数可能修改参数，不能改到共用的响应体
+        return value
+
+    def extract(self, resp_obj, variables_mapping, functions_mapping):
+        if self.extract_type == "function":
+            args = [self.get_arg_value(arg, resp_obj, variables_mapping) for arg in self.args]
+            kwargs = {key: self.get_arg_value(arg, resp_obj, variables_mapping) for key, arg in self.kwargs}
+            return functions_mapping[self.func_name](*args, **kwargs)
+
+        if self.extract_type == "const":
+            return self.value
+
+        if self.extract_type == "variable":
+            variable_data = get_mapping_variable(self.value, variables_mapping)
+            return resp_obj.extract_field(self.field, variable_data) if self.field else variable_data
+
+        return resp_obj.extract_field(self.field)
+
+
+@lru_cache(maxsize=4096)
+def compile_extract_expression(expression):
+    return ExtractExpression.compile(expression)
+
+
 class ResponseObject(object):
 
     def __init__(self, resp_obj):
@@ -17,11 +129,13 @@ class ResponseObject(object):
             resp_obj (instance): requests.Response instance
         """
         self.resp_obj = resp_obj
+        self._regex_matched_dict = {}  # 正则提取的结果，同一个正则表达式只在响应体中匹配一次
 
     def __getattr__(self, key):
         try:
             if key == "json":
-                value = self.resp_obj.json()
+                # 前后置函数通过 response.json 拿到的可能会被修改，复制一份，数据提取、断言直接用共用的解析结果
+                value = utils.copy_json(utils.load_response_json(self.resp_obj))
             elif key == "cookies":
                 value = self.resp_obj.cookies.get_dict()
             else:
@@ -33,10 +147,10 @@ class ResponseObject(object):
             err_msg = "响应对象中没有属性: {}".format(key)
             raise exceptions.ParamsError(err_msg)
 
-    def _extract_field_with_regex(self, field):
+    def _extract_field_with_regex(self, extractor):
         """ 从响应对象中提取数据，支持json和字符串
         Args:
-            field (str): 正则字符串 r".*\(.*\).*"
+            extractor (FieldExtractor): 编译后的正则表达式 r".*\(.*\).*"
         Returns:
             str: 匹配的内容
         Raises:
@@ -44,21 +158,23 @@ class ResponseObject(object):
         Examples:
             >>> # self.text: "LB123abcRB789"
             >>> filed = "LB[\d]*(.*)RB[\d]*"
-            >>> _extract_field_with_regex(field)
+            >>> _extract_field_with_regex(compile_field(field))
             abc
         """
-        matched = re.search(field, self.resp_obj.text)
+        if extractor.field not in self._regex_matched_dict:
+            self._regex_matched_dict[extractor.field] = extractor.regex.search(self.text)
+        matched = self._regex_matched_dict[extractor.field]
         if not matched:
-            err_msg = u"正则表达式提取数据失败! => {}\n".format(field)
-            err_msg += u"response body: {}\n".format(self.resp_obj.text)
+            err_msg = u"正则表达式提取数据失败! => {}\n".format(extractor.field)
+            err_msg += u"response body: {}\n".format(self.text)
             raise exceptions.ExtractFailure(err_msg)
 
         return matched.group(1)
 
-    def _extract_field_with_delimiter(self, field, variable_data=None):
+    def _extract_field_with_delimiter(self, extractor, variable_data=None):
         """ 响应内容可以是json或html文本
         Args:
-            field (str): 由分隔符连接的字符串。
+            extractor (FieldExtractor): 编译后的由分隔符连接的字符串。
             e.g.
                 "status_code"
                 "headers"
@@ -67,13 +183,7 @@ class ResponseObject(object):
                 "headers.content-type"
                 "content.person.name.first_name"
         """
-        # string.split(sep=None, maxsplit=-1) -> list of strings
-        # e.g. "content.person.name" => ["content", "person.name"]
-        try:
-            top_query, sub_query = field.split('.', 1)
-        except ValueError:
-            top_query = field
-            sub_query = None
+        field, top_query, sub_query = extractor.field, extractor.top_query, extractor.sub_query
 
         # status_code
         if top_query in ["status_code", "encoding", "ok", "reason", "url"]:
@@ -131,7 +241,7 @@ class ResponseObject(object):
         # 响应体
         elif top_query in ["content", "text", "json"]:
             try:
-                body = self.json
+                body = utils.load_response_json(self.resp_obj)  # 和测试报告共用同一次解析，只读
             except exceptions.JSONDecodeError:
                 body = self.text
 
@@ -191,10 +301,11 @@ class ResponseObject(object):
             raise exceptions.ParamsError(err_msg)
 
         # 判断是否能被正则编译，如果能被正则编译，则用正则提取方式
-        if text_extractor_regexp_compile.match(field):
-            value = self._extract_field_with_regex(field)
+        extractor = compile_field(field)
+        if extractor.regex is not None:
+            value = self._extract_field_with_regex(extractor)
         else:
-            value = self._extract_field_with_delimiter(field, variable_data)
+            value = self._extract_field_with_delimiter(extractor, variable_data)
 
         return value
 
@@ -219,63 +330,11 @@ class ResponseObject(object):
         extract_binds_order_dict = utils.list_to_dict(extractors)
         # 提取数据
         for extract_key, expression in extract_binds_order_dict.items():
-
-            functions = extract_functions(expression)
-            if functions:  # 有嵌套自定义函数，先执行提取，再执行自定义函数
-                # 提取自定义函数 {'func_name': 'add', 'args': ['content.data'], 'kwargs': {}}
-                extract_function_data = parse_function(functions[0])
-
-                # 执行数据提取
-                extract_arg_data = []  # arg
-                for arg in extract_function_data.get('args', []):
-                    # 判断是常量还是自定义变量，如果是自定义变量，则替换
-                    variable = extract_variables(arg)
-                    if variable:
-                        extract_arg_data.append(get_mapping_variable(variable[0], session_context_variables_mapping))
-                    else:
-                        if is_const(arg):
-                            extract_arg_data.append(str(arg))
-                        else:
-                            extract_arg_data.append(self.extract_field(arg) if is_extract_expression(arg) else arg)
-
-
-                extract_kwarg_data = {}  # kwarg
-                for key, value in extract_function_data.get('kwargs', {}).items():
-                    # 判断是常量还是自定义变量，如果是自定义变量，则替换
-                    variable = extract_variables(value)
-                    if variable:
-                        extract_kwarg_data[key] = get_mapping_variable(variable[0], session_context_variables_mapping)
-                    else:
-                        extract_kwarg_data[key] = self.extract_field(value) if is_extract_expression(value) else value
-
-                # 执行自定义函数
-                extract_function_data['args'], extract_function_data['kwargs'] = extract_arg_data, extract_kwarg_data
-                result = session_context.FUNCTIONS_MAPPING[extract_function_data['func_name']](
-                    *extract_function_data['args'],
-                    **extract_function_data['kwargs']
-                )
-                extracted_variables_mapping[extract_key] = result
-                session_context_variables_mapping[extract_key] = result
-
-            else:  # 没有嵌套自定义函数，则直接提取
-                if expression.startswith("const"):  # 常量
-                    result = expression.split("const.")[1]
-                elif expression.startswith("variable"):  # 变量：variable.$data.data 或者 variable.$data
-                    variable_expression = expression.split("variable.")[1]
-                    variable_expression_split = variable_expression.split(".", 1)
-                    if len(variable_expression_split) > 1:  # $data.data
-                        variable, extract_expression = variable_expression_split
-                        variable_data = extract_variables(variable)[0]
-                        result = self.extract_field(
-                            f"variable.{extract_expression}",
-                            get_mapping_variable(variable_data, session_context_variables_mapping)
-                        )
-                    else:  # $data
-                        variable_data = extract_variables(variable_expression_split[0])[0]
-                        result = get_mapping_variable(variable_data, session_context_variables_mapping)
-                else:  # 从响应中提取
-                    result = self.extract_field(expression)
-                extracted_variables_mapping[extract_key] = result
-                session_context_variables_mapping[extract_key] = result
+            extract_expression = compile_extract_expression(expression) if isinstance(expression, str) \
+                else ExtractExpression.compile(expression)
+            result = utils.copy_json(extract_expression.extract(  # 保存为变量的值后续可能被修改，复制一份
+                self, session_context_variables_mapping, session_context.FUNCTIONS_MAPPING))
+            extracted_variables_mapping[extract_key] = result
+            session_context_variables_mapping[extract_key] = result
 
         return extracted_variables_mapping
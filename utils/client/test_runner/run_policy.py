@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+""" 任务的执行策略，满足停止条件后，剩下还没开始执行的用例不再执行，标记为取消执行(cancel)
+
+    max_fail: 不通过（失败/错误）的用例数达到这个数时停止
+    fail_rate、fail_rate_window: 最近 fail_rate_window 条用例中，不通过的比例达到 fail_rate（0-1）时停止，
+        执行的用例数还不够一个窗口时不判断，避免前几条用例不通过就停止
+    health_check: 有用例不通过时探测运行环境，连不上或响应5xx则停止，
+        两次探测至少间隔 health_check_interval 秒，避免环境正常、只是用例不通过时每条用例都去探测
+    各条件为0则不启用，同一次执行的所有线程/协程共用一个执行策略
+    用例分片执行时，各分片按自己的执行策略判断，报告所在的节点把各分片的结果合并到报告的执行策略中，
+        不通过的用例数按整个报告累计判断 max_fail，任一分片触发了停止则整个报告停止
+"""
+import time
+from collections import deque
+from threading import Lock
+
+import requests
+
+from utils.logs.log import logger
+
+
+class RunPolicy:
+
+    def __init__(self, max_fail=0, fail_rate=0, fail_rate_window=20, health_check=0, health_check_url=None,
+                 health_check_interval=30, health_check_time_out=5, **kwargs):
+        self.max_fail = int(max_fail or 0)
+        self.fail_rate = float(fail_rate or 0)
+        self.fail_rate_window = max(int(fail_rate_window or 0), 1)
+        self.health_check_url = health_check_url if health_check else None
+        self.health_check_interval = float(health_check_interval or 0)
+        self.health_check_time_out = float(health_check_time_out or 5)
+
+        self.fail_count = 0
+        self.result_window = deque(maxlen=self.fail_rate_window)  # 最近执行完的用例是否不通过
+        self.last_health_check_time = 0
+        self.stop_reason = None  # 触发停止的原因，None为没有停止
+        self.lock = Lock()
+
+    @classmethod
+    def get_run_policy(cls, run_policy, health_check_url=None):
+        """ 根据任务的执行策略配置创建，没有启用任何条件则返回None """
+        run_policy = run_policy or {}
+        if not (run_policy.get("max_fail") or run_policy.get("fail_rate") or run_policy.get("health_check")):
+            return None
+        return cls(**{"health_check_url": health_check_url, **run_policy})
+
+    def is_stop(self):
+        return self.stop_reason is not None
+
+    def stop(self, reason):
+        if self.stop_reason is None:
+            logger.warning(f'触发执行策略，剩下的用例不再执行：{reason}')
+            self.stop_reason = reason
+
+    def check_before_run(self):
+        """ 开始执行前先探测一次运行环境，不可用则所有用例都不执行 """
+        if self.health_check_url:
+            self.last_health_check_time = time.time()
+            if self.check_health() is False:
+                self.stop(f'运行环境探测不通过：{self.health_check_url}')
+
+    def record(self, result):
+        """ 记录一条用例的执行结果，并判断是否要停止 """
+        is_fail = result in ("fail", "error")
+        with self.lock:
+            self.result_window.append(is_fail)
+            if is_fail:
+                self.fail_count += 1
+            if self.is_stop():
+                return
+            if self.max_fail and self.fail_count >= self.max_fail:
+                self.stop(f'不通过的用例数达到{self.max_fail}条')
+                return
+            if self.fail_rate and len(self.result_window) == self.fail_rate_window:
+                current_fail_rate = sum(self.result_window) / self.fail_rate_window
+                if current_fail_rate >= self.fail_rate:
+                    self.stop(f'最近{self.fail_rate_window}条用例不通过的比例为{current_fail_rate:.0%}，'
+                              f'达到{self.fail_rate:.0%}')
+                    return
+            if not (is_fail and self.health_check_url):
+                return
+            if time.time() - self.last_health_check_time < self.health_check_interval:
+                return
+            self.last_health_check_time = time.time()
+
+        # 探测不持有锁，不阻塞其他用例记录结果
+        if self.check_health() is False:
+            self.stop(f'运行环境探测不通过：{self.health_check_url}')
+
+    def merge_result(self, fail_count, stop_reason=None):
+        """ 合并一个分片的执行结果：不通过的用例数累加判断 max_fail，分片触发了停止则停止 """
+        with self.lock:
+            self.fail_count += fail_count
+            if self.is_stop():
+                return
+            if stop_reason:
+                self.stop(stop_reason)
+            elif self.max_fail and self.fail_count >= self.max_fail:
+                self.stop(f'不通过的用例数达到{self.max_fail}条')
+
+    def check_health(self):
+        """ 探测运行环境是否可用，能连上且不是5xx即为可用 """
+        try:
+            return requests.get(self.health_check_url, timeout=self.health_check_time_out).status_code < 500
+        except Exception as error:
+            logger.warning(f'运行环境探测失败：{self.health_check_url}，{error}')
+            return False
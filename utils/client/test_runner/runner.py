@@ -1,15 +1,15 @@
 # -*- coding: utf-8 -*-
-import copy
 import traceback
 from unittest.case import SkipTest
 
-from . import exceptions, response, extract
+from . import exceptions, response, extract, parser
 from .exceptions import StopTest
-from .runner_context import SessionContext
+from .function_registry import FunctionRegistry
+from .runner_context import SessionContext, VariableSnapshot
 from .webdriver_action import GetWebDriver, GetAppDriver
 from utils.logs.redirect_print_log import RedirectPrintLogToMemory
 from utils.client.test_runner import logger
-from utils.client.test_runner.client.http import HttpSession
+from utils.client.test_runner.client.http import HttpSession, HttpClientPool
 from utils.client.test_runner.client.webdriver import WebDriverSession
 
 
@@ -37,7 +37,7 @@ class Runner:
 
     """
 
-    def __init__(self, config, functions, task_type="api"):
+    def __init__(self, config, functions, task_type="api", client_pool=None):
         """ 运行测试用例
 
         Args:
@@ -51,6 +51,10 @@ class Runner:
                 }
         """
         self.base_url = config.get("base_url")
+        self.report_id = config.get("report_id")
+        self.report_case_id = config.get("report_case_id")
+        self.http_client_limits = config.get("http_client_limits") or {}  # 连接池配置
+        self.client_pool = client_pool  # 指定了连接池则使用指定的，否则使用运行级别的连接池
         self.run_env = config.get("run_env")
         self.verify = config.get("verify", True)
         self.output = config.get("output", [])
@@ -70,6 +74,7 @@ class Runner:
         # 记录当前步骤的执行进度
         self.report_step = None
         self.pause_step_time_out = config.get("pause_step_time_out", 10 * 60) # 暂停测试步骤状态变更的超时时间（暂停 => 放行），默认10分钟
+        self.report_step_progress = config.get("report_step_progress") or {}  # 步骤执行进度的写入配置
         self.testcase_teardown_hooks = config.get("teardown_hooks", [])  # 用例级别的后置条件
 
         self.session_context = SessionContext(self.functions)
@@ -80,7 +85,9 @@ class Runner:
         """ 根据不同的测试类型获取不同的client_session """
         if self.client_session is None:
             if self.run_type == "api":
-                self.client_session = HttpSession(self.base_url)
+                # 同一次运行的所有用例共用一个连接池，复用连接
+                client_pool = self.client_pool or HttpClientPool.get_run_pool(self.report_id, **self.http_client_limits)
+                self.client_session = HttpSession(self.base_url, client_pool=client_pool)
             elif self.run_type == "ui":
                 self.client_session = WebDriverSession()
                 self.driver = GetWebDriver(browser_driver_path=self.browser_driver_path, browser_name=self.browser_name)
@@ -94,10 +101,17 @@ class Runner:
             self.driver.close_browser()
         except Exception:
             pass
+        self.try_close_http_session()
+
+    def try_close_http_session(self):
+        """ 关闭http会话，释放会话自己持有的连接 """
+        if isinstance(self.client_session, HttpSession):
+            self.client_session.close()
 
     def __del__(self):
         if self.testcase_teardown_hooks:
             self.do_hook_actions(self.testcase_teardown_hooks)
+        self.try_close_http_session()
 
     def __clear_step_test_data(self):
         """ 清除请求和响应数据 """
@@ -210,6 +224,28 @@ class Runner:
             exceptions.ExtractFailure
 
         """
+        parsed_step, variables_mapping = self.before_run_test(step_dict)
+        if self.run_type == "api":
+            resp = self.client_session.send_client_request(
+                **self.build_request_kwargs(step_dict, parsed_step, variables_mapping))
+            extracted_variables_mapping = self.extract_api_response(step_dict, resp)
+        else:
+            # 执行测试步骤浏览器操作
+            self.client_session.do_action(
+                self.driver,
+                name=step_dict.get("name"),
+                case_id=step_dict.get("case_id"),
+                variables_mapping=variables_mapping,
+                **parsed_step
+            )
+            # 数据提取
+            self.report_step.test_is_start_extract()
+            extracted_variables_mapping = extract.extract_data(
+                self.session_context, self.driver, step_dict.get("extract", {}))
+        self.after_run_test(step_dict, extracted_variables_mapping)
+
+    def before_run_test(self, step_dict):
+        """ 发送请求/执行操作前的处理：判断跳过、解析请求数据、执行前置函数，返回解析后的请求数据和当前的自定义变量 """
         self.__clear_step_test_data()
         # self.client_session.init_step_meta_data()
         self.client_session.meta_data["setup_hooks"] = step_dict.get("setup_hooks", [])
@@ -221,6 +257,10 @@ class Runner:
 
         self.check_step_is_skip(step_dict)  # 步骤是否满足跳过条件
 
+        # 步骤不跳过才渲染的字段，引用了不存在的函数则在发请求/执行操作前就报错
+        if isinstance(self.functions, FunctionRegistry):
+            parser.check_render_functions(step_dict, parser.STEP_RUN_RENDER_FIELDS, self.functions)
+
         # 解析请求，替换变量、自定义函数
         if self.run_type == "api":
             request_data = step_dict.get("request", {})
@@ -241,45 +281,38 @@ class Runner:
         self.report_step.test_is_start_before()
         self.do_hook_actions(step_dict.get("setup_hooks", []))
 
-        # 深拷贝除 request 的其他数据，请求数据有可能是io，io不能深拷贝，所以先移出再深拷贝，再移入
-        copy_request = self.session_context.test_variables_mapping.pop("request")
-        variables_mapping = copy.deepcopy(self.session_context.test_variables_mapping)
-        self.session_context.test_variables_mapping["request"] = copy_request
+        # 记录此时的变量快照（不含 request），写入报告时才转为dict，不用每个步骤都深拷贝所有变量
+        variables_mapping = self.session_context.snapshot_variables()
 
         self.report_step.test_is_start_running()
-        case_id, step_name, extractors = step_dict.get("case_id"), step_dict.get("name"), step_dict.get("extract", {})
-        if self.run_type == "api":
-            # 发送请求
-            url, method = parsed_step.pop("url"), parsed_step.pop("method")
-            parsed_step.setdefault("verify", self.verify)
-            resp = self.client_session.send_client_request(
-                method,
-                url,
-                name=step_name,
-                case_id=case_id,
-                variables_mapping=copy.deepcopy(variables_mapping),
-                **parsed_step
-            )
-            self.resp_obj = response.ResponseObject(resp)
-
-            # 数据提取
-            self.report_step.test_is_start_extract()
-            extracted_variables_mapping = self.resp_obj.extract_response(
-                self.session_context, extractors.get("extractors", []))
-            self.session_context.update_test_variables("response", self.resp_obj)
-        else:
-            # 执行测试步骤浏览器操作
-            self.client_session.do_action(
-                self.driver,
-                name=step_name,
-                case_id=case_id,
-                variables_mapping=copy.deepcopy(variables_mapping),
-                **parsed_step
-            )
-            # 数据提取
-            self.report_step.test_is_start_extract()
-            extracted_variables_mapping = extract.extract_data(self.session_context, self.driver, extractors)
-
+        return parsed_step, variables_mapping
+
+    def build_request_kwargs(self, step_dict, parsed_step, variables_mapping):
+        """ 组装发送请求的参数 """
+        url, method = parsed_step.pop("url"), parsed_step.pop("method")
+        parsed_step.setdefault("verify", self.verify)
+        return dict(
+            method=method,
+            url=url,
+            name=step_dict.get("name"),
+            case_id=step_dict.get("case_id"),
+            variables_mapping=variables_mapping,
+            keep_alive=step_dict.get("keep_alive", True),
+            **parsed_step
+        )
+
+    def extract_api_response(self, step_dict, resp):
+        """ 接口响应数据提取 """
+        self.resp_obj = response.ResponseObject(resp)
+        self.report_step.test_is_start_extract()
+        extracted_variables_mapping = self.resp_obj.extract_response(
+            self.session_context, step_dict.get("extract", {}).get("extractors", []))
+        self.session_context.update_test_variables("response", self.resp_obj)
+        return extracted_variables_mapping
+
+    def after_run_test(self, step_dict, extracted_variables_mapping):
+        """ 发送请求/执行操作后的处理：保存提取的数据、执行后置函数、断言 """
+        step_name, extractors = step_dict.get("name"), step_dict.get("extract", {})
         self.client_session.meta_data["data"][0]["extract_msgs"] = extracted_variables_mapping
         self.session_context.update_session_variables(extracted_variables_mapping)  # 把提取到的数据更新到变量中
 
@@ -315,17 +348,20 @@ class Runner:
 
     def get_test_step_data(self):
         """ 获取测试数据 """
-        request = copy.deepcopy(self.client_session.meta_data["data"][0]["request"])
+        request = self.client_session.meta_data["data"][0]["request"]
         request_body = request.get("body")
         if request_body and isinstance(request_body, bytes):
-            request["body"] = str(request_body)
+            request = {**request, "body": str(request_body)}  # 只替换body，不修改原始记录
+        variables_mapping = self.client_session.meta_data.get("variables_mapping", {})
+        if isinstance(variables_mapping, VariableSnapshot):
+            variables_mapping = variables_mapping.to_dict()
 
         data = {
             "case_id": self.client_session.meta_data.get("case_id"),
             "name": self.client_session.meta_data["name"],
             "stat": self.client_session.meta_data["stat"],
             "redirect_print": self.client_session.meta_data["redirect_print"],
-            "variables_mapping": self.client_session.meta_data.get("variables_mapping", {}),
+            "variables_mapping": variables_mapping,
             "attachment": "",
             "request": request,
             "response": self.client_session.meta_data["data"][0]["response"],
@@ -353,6 +389,24 @@ class Runner:
                 }
             :param report_step_model:
         """
+        self.before_run_step(step_dict)
+        self.report_step = report_step_model.get_resport_step_with_status(
+            step_dict.get("report_step_id"), self.pause_step_time_out, self.report_id, self.report_case_id)
+        self.start_run_step(step_dict)
+
+        try:
+            logger.log_info(f"""开始执行步骤: {step_dict.get("name")}""")
+            self._run_test(step_dict)
+            self.client_session.meta_data["result"] = "success"
+        except Exception as error:  # 捕获步骤运行中报错(报错、断言不通过、跳过测试)
+            self.on_run_step_error(error)
+            raise
+        finally:
+            # 保存自定义函数的 print 打印, 并把print重定向到默认输出
+            self.client_session.meta_data["redirect_print"] = self.redirect_print.get_text_and_redirect_to_default()
+
+    def before_run_step(self, step_dict):
+        """ 执行步骤前的准备：重定向打印、初始化client_session """
         self.meta_datas = None
         self.redirect_print = RedirectPrintLogToMemory()  # 重定向自定义函数的打印到内存中
         try:
@@ -372,7 +426,9 @@ class Runner:
                 # Message: An unknown server-side error occurred while processing the command. Original error: 'app' option is required for reinstall
                 self.client_init_error = "启动app失败，请检查 app是否安装、包名是否正确"
 
-        self.report_step = report_step_model.get_resport_step_with_status(step_dict.get("report_step_id"), self.pause_step_time_out)
+    def start_run_step(self, step_dict):
+        """ 拿到步骤的执行状态后，判断是否停止执行，并标记步骤开始执行 """
+        self.report_step.init_progress_buffer(**self.report_step_progress)
         if self.report_step.status == "stop": # 停止测试
             self.__clear_step_test_data()
             raise StopTest("中断测试执行")
@@ -382,28 +438,59 @@ class Runner:
         if self.client_init_error:
             raise RuntimeError(self.client_init_error)
 
+    def on_run_step_error(self, error):
+        """ 步骤运行中报错(报错、断言不通过、跳过测试)，记录对应的执行结果 """
+        # 如果不是跳过测试的异常，则把当前测试用例运行结果标识为失败，后续步骤可根据此状态判断是否继续执行
+        if isinstance(error, SkipTest):
+            self.client_session.meta_data["result"] = "skip"
+            self.report_step.test_is_skip()
+        else:
+            self.session_context.update_session_variables({"case_run_result": "fail"})
+
+            if isinstance(error, (
+                    exceptions.ParamsError,
+                    exceptions.ValidationFailure,
+                    exceptions.ExtractFailure,
+                    exceptions.ReadTimeout
+            )) is False:
+                self.client_session.meta_data["result"] = "error"
+            else:
+                self.client_session.meta_data["result"] = "fail"
+
+
+class AsyncRunner(Runner):
+    """ 在事件循环中执行接口测试用例，发请求时让出事件循环，一个用例内的步骤依旧按顺序执行，变量、数据提取的逻辑与 Runner 一致
+    读写数据库（步骤状态、执行进度）放到线程中执行，步骤执行过程中的进度变更只缓存，步骤开始、结束时写入
+    """
+
+    def __init__(self, config, functions, task_type="api", client_pool=None):
+        super().__init__(config, functions, task_type, client_pool)
+        # 执行过程中的进度变更只缓存，不在事件循环中写库，步骤开始（实时进度下）、结束时在线程中写入
+        self.report_step_progress = {**self.report_step_progress, "flush_interval": float("inf")}
+
+    async def async_run_step(self, step_dict, report_step_model):
+        """ 同 run_step """
+        self.before_run_step(step_dict)
+        self.report_step = await report_step_model.async_get_resport_step_with_status(
+            step_dict.get("report_step_id"), self.pause_step_time_out, self.report_id, self.report_case_id)
+        await report_step_model.run_in_thread(self.start_run_step, step_dict)
+        self.redirect_print.redirect_to_memory()  # 等待期间其他协程可能改了重定向，重新指向当前步骤
+
         try:
             logger.log_info(f"""开始执行步骤: {step_dict.get("name")}""")
-            self._run_test(step_dict)
+            await self._async_run_test(step_dict)
             self.client_session.meta_data["result"] = "success"
-        except Exception as error:  # 捕获步骤运行中报错(报错、断言不通过、跳过测试)
-            # 如果不是跳过测试的异常，则把当前测试用例运行结果标识为失败，后续步骤可根据此状态判断是否继续执行
-            if isinstance(error, SkipTest):
-                self.client_session.meta_data["result"] = "skip"
-                self.report_step.test_is_skip()
-            else:
-                self.session_context.update_session_variables({"case_run_result": "fail"})
-
-                if isinstance(error, (
-                        exceptions.ParamsError,
-                        exceptions.ValidationFailure,
-                        exceptions.ExtractFailure,
-                        exceptions.ReadTimeout
-                )) is False:
-                    self.client_session.meta_data["result"] = "error"
-                else:
-                    self.client_session.meta_data["result"] = "fail"
+        except Exception as error:
+            self.on_run_step_error(error)
             raise
         finally:
-            # 保存自定义函数的 print 打印, 并把print重定向到默认输出
             self.client_session.meta_data["redirect_print"] = self.redirect_print.get_text_and_redirect_to_default()
+
+    async def _async_run_test(self, step_dict):
+        """ 同 _run_test，仅支持接口测试 """
+        parsed_step, variables_mapping = self.before_run_test(step_dict)
+        resp = await self.client_session.async_send_client_request(
+            **self.build_request_kwargs(step_dict, parsed_step, variables_mapping))
+        self.redirect_print.redirect_to_memory()
+        extracted_variables_mapping = self.extract_api_response(step_dict, resp)
+        self.after_run_test(step_dict, extracted_variables_mapping)
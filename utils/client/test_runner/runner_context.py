@@ -1,8 +1,102 @@
 # -*- coding: utf-8 -*-
 import json
-import re
+from collections.abc import MutableMapping
 
-from . import exceptions, parser, utils, validate_func
+from . import exceptions, parser, utils
+from .validator import CompiledValidator, prepare_validators
+
+
+class VariableSnapshot:
+    """ 变量在某一时刻的只读快照，只保存各层变量的引用，需要写入报告时才合并成dict """
+
+    def __init__(self, layers, exclude=()):
+        self.layers = layers
+        self.exclude = exclude
+
+    def to_dict(self):
+        """ 按优先级从低到高合并各层变量 """
+        variables = {}
+        for layer in reversed(self.layers):
+            variables.update(layer)
+        for key in self.exclude:
+            variables.pop(key, None)
+        return variables
+
+
+class VariableScope(MutableMapping):
+    """ 分层的自定义变量，取值优先级从高到低：
+        local: 当前步骤执行过程中产生的变量，如解析后的变量值、前置函数的返回值、request、response
+        session: 整个用例执行过程中都有效的变量，如提取的变量、case_run_result
+        step: 当前步骤的变量（已合并了用例的变量）
+    snapshot() 不拷贝数据，只把各层标记为共享，之后第一次修改共享的层时才浅拷贝该层（写时复制），
+    所以快照记录的是生成快照那一刻的变量，不受后续修改的影响
+    """
+    layer_names = ("local", "session", "step")
+
+    def __init__(self, session=None, step=None):
+        self.layers = {"local": {}, "session": session or {}, "step": step or {}}
+        self.shared_layers = set()
+
+    def get_writable_layer(self, layer_name):
+        """ 获取可以修改的层，该层被快照引用时，先拷贝一份 """
+        if layer_name in self.shared_layers:
+            self.layers[layer_name] = dict(self.layers[layer_name])
+            self.shared_layers.discard(layer_name)
+        return self.layers[layer_name]
+
+    def new_step(self, step_variables):
+        """ 开始执行新的步骤，清空上一个步骤的变量 """
+        self.layers["local"], self.layers["step"] = {}, step_variables
+        self.shared_layers -= {"local", "step"}
+
+    def update_session(self, variables_mapping):
+        """ 更新会话变量，同名的步骤执行中产生的变量失效，以会话变量为准 """
+        session = self.get_writable_layer("session")
+        session.update(variables_mapping)
+        local = self.layers["local"]
+        overridden = [key for key in local if key in session]
+        if overridden:
+            local = self.get_writable_layer("local")
+            for key in overridden:
+                local.pop(key)
+
+    def snapshot(self, exclude=()):
+        """ 获取当前变量的快照 """
+        self.shared_layers.update(self.layer_names)
+        return VariableSnapshot(tuple(self.layers[name] for name in self.layer_names), exclude)
+
+    def __getitem__(self, key):
+        for layer_name in self.layer_names:
+            layer = self.layers[layer_name]
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return any(key in self.layers[layer_name] for layer_name in self.layer_names)
+
+    def __setitem__(self, key, value):
+        self.get_writable_layer("local")[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        for layer_name in self.layer_names:
+            if key in self.layers[layer_name]:
+                self.get_writable_layer(layer_name).pop(key)
+
+    def __iter__(self):
+        return iter(self.all_keys())
+
+    def __len__(self):
+        return len(self.all_keys())
+
+    def all_keys(self):
+        """ 所有层的变量名，去重 """
+        keys = {}
+        for layer_name in reversed(self.layer_names):
+            keys.update(dict.fromkeys(self.layers[layer_name]))
+        return list(keys)
 
 
 class SessionContext(object):
@@ -20,7 +114,8 @@ class SessionContext(object):
     """
     def __init__(self, functions, variables=None):
         # 初始化时把当前测试用例运行结果标识为成功，后续步骤可根据此状态判断是否继续执行
-        self.session_variables_mapping = utils.list_to_dict(variables or {"case_run_result": "success"})
+        self.test_variables_mapping = VariableScope(
+            session=utils.list_to_dict(variables or {"case_run_result": "success"}))
         self.FUNCTIONS_MAPPING = functions
         self.init_test_variables()
         self.validation_results = []
@@ -42,10 +137,8 @@ class SessionContext(object):
         variables_mapping = variables_mapping or {}
         variables_mapping = utils.list_to_dict(variables_mapping)
 
-        self.test_variables_mapping = {}
-        # 提取的变量将覆盖预先定义好的变量
-        self.test_variables_mapping.update(variables_mapping)
-        self.test_variables_mapping.update(self.session_variables_mapping)
+        # 提取的变量将覆盖预先定义好的变量，步骤的变量不会被修改，直接作为最底层，不用拷贝
+        self.test_variables_mapping.new_step(variables_mapping)
 
         for variable_name, variable_value in variables_mapping.items():
             variable_value = self.eval_content(variable_value)
@@ -55,11 +148,19 @@ class SessionContext(object):
         """ 更新变量，这些变量仅在当前测试中有效 """
         self.test_variables_mapping.setdefault(variable_name, variable_value)
 
+    @property
+    def session_variables_mapping(self):
+        """ 整个会话中都有效的变量 """
+        return self.test_variables_mapping.layers["session"]
+
+    def snapshot_variables(self, exclude=("request",)):
+        """ 获取当前变量的快照，用于记录发起请求时的变量，请求数据有可能是io，默认不记录 """
+        return self.test_variables_mapping.snapshot(exclude)
+
     def update_session_variables(self, variables_mapping):
         """ 使用提取的变量映射更新会话。这些变量在整个运行会话中有效。"""
         variables_mapping = utils.list_to_dict(variables_mapping)
-        self.session_variables_mapping.update(variables_mapping)
-        self.test_variables_mapping.update(self.session_variables_mapping)
+        self.test_variables_mapping.update_session(variables_mapping)
 
     def save_update_to_header_filed(self, filed_list: list, extracted_variables_mapping: dict):
         """ 把提取后需要更新到头部信息的数据保存下来
@@ -82,11 +183,11 @@ class SessionContext(object):
             self.FUNCTIONS_MAPPING
         )
 
-    def __eval_check_item(self, validator, resp_obj):
+    def __eval_check_item(self, compiled_validator: CompiledValidator, resp_obj):
         """ evaluate check item in validator.
 
         Args:
-            validator (dict): validator
+            compiled_validator (CompiledValidator): 编译后的断言，解析后的断言数据如
                 {"check": "status_code", "comparator": "eq", "expect": 201}
                 {"check": "$resp_body_success", "comparator": "eq", "expect": True}
             resp_obj (object): requests.Response() object
@@ -101,6 +202,7 @@ class SessionContext(object):
                 }
 
         """
+        validator = compiled_validator.new_validator_dict()
         check_item = validator["check"]
         # check_item should only be the following 5 formats:
         # 1, variable reference, e.g. $token
@@ -109,12 +211,10 @@ class SessionContext(object):
         # 4, string joined by delimiter. e.g. "status_code", "headers.content-type"
         # 5, regex string, e.g. "LB[\d]*(.*)RB[\d]*"
 
-        if isinstance(check_item, (dict, list)) \
-            or parser.extract_variables(check_item) \
-            or parser.extract_functions(check_item):
+        if compiled_validator.check_type == "eval":
             # format 1/2/3
             check_value = self.eval_content(check_item)
-        elif re.compile(r".*\(.*\).*").match(check_item) or check_item.startswith(("content", "headers", "cookies")):  # 正则表达式或提取表达式
+        elif compiled_validator.check_type == "extract":  # 正则表达式或提取表达式
             check_value = resp_obj.extract_field(check_item)
         else:
             check_value = check_item
@@ -129,8 +229,8 @@ class SessionContext(object):
         validator["check_result"] = "unchecked"
         return validator
 
-    def do_api_validation(self, validator_dict):
-        """ 根据断言数据执行断言方法
+    def do_api_validation(self, validator_dict, validate_func=None):
+        """ 根据断言数据执行断言方法，validate_func 为编译断言时已经找到的断言方法
         Args:
             validator_dict (dict): validator dict
                 {
@@ -141,7 +241,7 @@ class SessionContext(object):
                 }
         """
         comparator = validator_dict["comparator"]
-        validate_func = parser.get_mapping_function(comparator, self.FUNCTIONS_MAPPING)
+        validate_func = validate_func or parser.get_mapping_function(comparator, self.FUNCTIONS_MAPPING)
         check_item = validator_dict.get("check")
         check_value = validator_dict["check_value"]
         expect_value = validator_dict["expect"]
@@ -217,15 +317,15 @@ class SessionContext(object):
         validate_pass = True
         failures = []
 
-        for validator in validators:
+        for validator in prepare_validators(validators):
             # evaluate validators with context variable mapping.
-            if validator.get("check") is None:  # 数据校验，已经解析过了
-                evaluated_validator = self.__eval_check_item(parser.parse_validator(validator), resp_obj)
-            else:
+            if isinstance(validator, CompiledValidator):  # 接口断言
+                evaluated_validator = self.__eval_check_item(validator, resp_obj)
+            else:  # UI断言，已经解析过了
                 evaluated_validator = validator
             try:
-                if validator.get("check") is None:  # 数据校验，已经解析过了
-                    self.do_api_validation(evaluated_validator)
+                if isinstance(validator, CompiledValidator):
+                    self.do_api_validation(evaluated_validator, validator.get_validate_func(self.FUNCTIONS_MAPPING))
                 else:
                     self.do_ui_validation(driver, evaluated_validator)
             except exceptions.ValidationFailure as ex:
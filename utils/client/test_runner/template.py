@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+""" 把要解析的数据预编译成模板树，渲染时不再重复做正则提取、函数参数解析
+
+    原数据:  {"url": "/api/$uid", "headers": {"token": "${get_token($user)}"}, "timeout": 10}
+    模板树:  DictTemplate([
+                (LiteralTemplate("url"), StringTemplate("/api/$uid", functions=[], variables=["uid"])),
+                (LiteralTemplate("headers"), DictTemplate([
+                    (LiteralTemplate("token"), StringTemplate(..., functions=[("${get_token($user)}", "get_token", ...)]))
+                ])),
+                (LiteralTemplate("timeout"), LiteralTemplate(10))
+             ])
+
+    编译结果只和数据内容有关，字符串以内容本身为key缓存，dict/list以内容的hash为key缓存，
+    同一个步骤多次执行、数据驱动的多次执行，都只会编译一次
+"""
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+from . import exceptions, parser, utils
+from .compat import numeric_types
+
+container_template_cache_size = 1024  # dict/list 模板最多缓存的数量
+_container_template_cache = OrderedDict()
+_container_template_cache_lock = Lock()
+
+
+class LiteralTemplate:
+    """ 不包含变量和函数引用的内容，渲染时原样返回 """
+    __slots__ = ("content",)
+
+    def __init__(self, content):
+        self.content = content
+
+    def render(self, variables_mapping, functions_mapping, raise_if_variable_not_found=True):
+        return self.content
+
+    def get_function_names(self):
+        return set()
+
+
+class StringTemplate:
+    """ 包含 $变量 或 ${自定义函数()} 引用的字符串
+    functions: [(函数引用原文, 函数名, 参数模板, 关键字参数模板)]，如 [("${add($a, 1)}", "add", ListTemplate, DictTemplate)]
+    variables: 字符串中引用的变量名，按出现顺序，如 ["uid", "token"]
+    渲染规则和 parser.parse_string_functions、parser.parse_string_variables 保持一致：先执行函数，再替换变量，
+    整个字符串只有一个函数/变量引用时，保留其原本的数据类型
+    """
+    __slots__ = ("content", "functions", "variables")
+
+    def __init__(self, content, functions, variables):
+        self.content = content
+        self.functions = functions
+        self.variables = variables
+
+    def render_functions(self, variables_mapping, functions_mapping):
+        """ 执行字符串中引用的自定义函数 """
+        content = self.content
+        for func_content, func_name, args_template, kwargs_template in self.functions:
+            args = args_template.render(variables_mapping, functions_mapping)
+            kwargs = kwargs_template.render(variables_mapping, functions_mapping)
+            func = parser.get_mapping_function(func_name, functions_mapping)
+            eval_value = func(*args, **kwargs)
+
+            if func_content == content:  # 整个字符串就是一个函数
+                content = eval_value
+            else:
+                content = content.replace(func_content, str(eval_value), 1)
+        return content
+
+    def render_variables(self, content, variables_mapping, functions_mapping):
+        """ 替换字符串中引用的变量，有函数引用时，函数返回值里面的变量引用也要替换 """
+        if not self.functions:
+            variables_list = self.variables
+        elif isinstance(content, str) and "$" in content:
+            variables_list = parser.extract_variables(content)
+        else:
+            return content
+        return parser.parse_string_variables(content, variables_mapping, functions_mapping, variables_list)
+
+    def get_function_names(self):
+        function_names = set()
+        for func_content, func_name, args_template, kwargs_template in self.functions:
+            function_names.add(func_name)
+            function_names.update(args_template.get_function_names(), kwargs_template.get_function_names())
+        return function_names
+
+    def render(self, variables_mapping, functions_mapping, raise_if_variable_not_found=True):
+        content = self.content
+        try:
+            content = self.render_functions(variables_mapping, functions_mapping)
+            content = self.render_variables(content, variables_mapping, functions_mapping)
+        except exceptions.VariableNotFound:
+            if raise_if_variable_not_found:
+                raise
+        return content
+
+
+class ListTemplate:
+    """ list/tuple/set，渲染结果统一为list """
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def render(self, variables_mapping, functions_mapping, raise_if_variable_not_found=True):
+        return [
+            item.render(variables_mapping, functions_mapping, raise_if_variable_not_found) for item in self.items
+        ]
+
+    def get_function_names(self):
+        return set().union(*(item.get_function_names() for item in self.items))
+
+
+class DictTemplate:
+    """ dict，key和value都可能有引用 """
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def render(self, variables_mapping, functions_mapping, raise_if_variable_not_found=True):
+        parsed_content = {}
+        for key_template, value_template in self.items:
+            parsed_key = key_template.render(variables_mapping, functions_mapping, raise_if_variable_not_found)
+            parsed_content[parsed_key] = value_template.render(
+                variables_mapping, functions_mapping, raise_if_variable_not_found)
+        return parsed_content
+
+    def get_function_names(self):
+        return set().union(*(
+            key_template.get_function_names() | value_template.get_function_names() for key_template, value_template in self.items
+        ))
+
+
+@lru_cache(maxsize=4096)
+def compile_string(content):
+    """ 编译字符串，函数的参数在编译时就解析好 """
+    content = content.strip()
+    functions = []
+    for func_content in parser.extract_functions(content):
+        function_meta = parser.parse_function(func_content)
+        functions.append((
+            "${" + func_content + "}",
+            function_meta["func_name"],
+            ListTemplate([_compile(arg)[0] for arg in function_meta["args"]]),
+            DictTemplate([(LiteralTemplate(key), _compile(value)[0]) for key, value in function_meta["kwargs"].items()])
+        ))
+    variables = parser.extract_variables(content)
+    if not functions and not variables:
+        return LiteralTemplate(content)
+    return StringTemplate(content, functions, variables)
+
+
+def _compile(content):
+    """ 递归编译，返回 (模板, 是否可以缓存)，包含非json基础类型数据的模板不缓存，避免不同对象的repr相同时取错 """
+    if content is None or isinstance(content, (numeric_types, bool)):
+        return LiteralTemplate(content), True
+
+    if isinstance(content, str):
+        return compile_string(content), True
+
+    if isinstance(content, bytes):
+        return LiteralTemplate(content.strip()), True
+
+    if isinstance(content, (list, tuple, set)):
+        items, cacheable = [], not isinstance(content, set)  # set的遍历顺序不固定，不缓存
+        for item in content:
+            item_template, item_cacheable = _compile(item)
+            items.append(item_template)
+            cacheable = cacheable and item_cacheable
+        return ListTemplate(items), cacheable
+
+    if isinstance(content, dict):
+        items, cacheable = [], True
+        for key, value in content.items():
+            key_template, key_cacheable = _compile(key)
+            value_template, value_cacheable = _compile(value)
+            items.append((key_template, value_template))
+            cacheable = cacheable and key_cacheable and value_cacheable
+        return DictTemplate(items), cacheable
+
+    return LiteralTemplate(content), False
+
+
+def get_content_hash(content):
+    """ 内容的hash，repr会区分数据类型和key的顺序 """
+    return hashlib.md5(repr(content).encode("utf-8", "backslashreplace")).hexdigest()
+
+
+def compile_template(content):
+    """ 获取内容编译后的模板，有缓存则直接用缓存 """
+    if not isinstance(content, (list, tuple, set, dict)):
+        return _compile(content)[0]
+
+    content_hash = get_content_hash(content)
+    with _container_template_cache_lock:
+        template = _container_template_cache.get(content_hash)
+        if template is not None:
+            _container_template_cache.move_to_end(content_hash)
+            return template
+
+    template, cacheable = _compile(content)
+    if cacheable:
+        with _container_template_cache_lock:
+            _container_template_cache[content_hash] = template
+            while len(_container_template_cache) > container_template_cache_size:
+                _container_template_cache.popitem(last=False)
+    return template
+
+
+def get_function_names(content):
+    """ 内容中引用的所有函数名，解析时用来校验引用的函数是否存在，每次的内容都不一样(如包含报告用例id)，不缓存整体的模板 """
+    return _compile(content)[0].get_function_names()
+
+
+def render(content, variables_mapping=None, functions_mapping=None, raise_if_variable_not_found=True):
+    """ 编译并渲染内容 """
+    return compile_template(content).render(
+        utils.list_to_dict(variables_mapping or {}), functions_mapping or {}, raise_if_variable_not_found)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import copy
 import json
+from collections.abc import Mapping
+from functools import lru_cache
 
 from . import exceptions
 from .compat import basestring
@@ -34,10 +36,9 @@ def query_json(json_content, query, delimiter='.'):
         query_json(json_content, "person.name.first_name.0") >> L
         query_json(json_content, "person.cities.0") >> Guangzhou
     """
-    raise_flag = False
-    response_body = u"response body: {}\n".format(json_content)
+    raise_flag, origin_json_content = False, json_content
     try:
-        for key in query.split(delimiter):
+        for key in split_json_query(query, delimiter):
             if isinstance(json_content, (list, basestring)):
                 json_content = json_content[int(key)]
             elif isinstance(json_content, dict):
@@ -49,12 +50,47 @@ def query_json(json_content, query, delimiter='.'):
 
     if raise_flag:
         err_msg = u"数据提取失败! => {}\n".format(query)
-        err_msg += response_body
+        err_msg += u"response body: {}\n".format(origin_json_content)
         raise exceptions.ExtractFailure(err_msg)
 
     return json_content
 
 
+@lru_cache(maxsize=4096)
+def split_json_query(query, delimiter='.'):
+    """ 拆分路径表达式，同一个表达式只拆分一次，"person.cities.0" => ("person", "cities", "0") """
+    return tuple(query.split(delimiter))
+
+
+def load_response_json(resp_obj):
+    """ 响应体转json，解析结果保存在响应对象上，数据提取、断言、测试报告共用同一次解析的结果
+    不能转为json时抛出 ValueError(JSONDecodeError)，解析失败的结果也会保存，不会重复解析
+    """
+    parsed_json = resp_obj.__dict__.get("_parsed_json")
+    if parsed_json is None:
+        try:
+            parsed_json = (True, resp_obj.json())
+        except ValueError as error:
+            parsed_json = (False, error)
+        resp_obj._parsed_json = parsed_json
+    is_json, value = parsed_json
+    if is_json:
+        return value
+    raise value.with_traceback(None)
+
+
+def copy_json(data):
+    """ 复制json数据，只复制 dict、list 容器，其他类型的值不可变，直接引用
+    响应体解析结果在数据提取、断言、测试报告之间共用，提取出来保存为变量、交给自定义函数的值要复制一份，
+    避免后续修改变量时改到测试报告中记录的响应体
+    """
+    if isinstance(data, dict):
+        return {key: copy_json(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [copy_json(value) for value in data]
+    return data
+
+
 def lower_dict_keys(origin_dict):
     """ 把字典的key转为小写
     Args:
@@ -98,7 +134,7 @@ def list_to_dict(variables):
 
         return variables_dict
 
-    elif isinstance(variables, dict):
+    elif isinstance(variables, Mapping):  # dict 或 VariableScope
         return variables
 
     else:
@@ -3,8 +3,9 @@ import json
 import re
 import types
 import sys
+from functools import lru_cache
 
-from pactverify.matchers import PactJsonVerify
+from pactverify.matchers import PactVerify, change_pact_json_to_obj
 
 from .compat import basestring, builtin_str, integer_types
 
@@ -29,6 +30,18 @@ def load_builtin_functions():
     return load_module_functions(this)
 
 
+@lru_cache(maxsize=1024)
+def get_compiled_regex(pattern):
+    """ 编译后的正则表达式，同一个预期结果只编译一次 """
+    return re.compile(pattern)
+
+
+@lru_cache(maxsize=256)
+def get_contract_matcher(contract):
+    """ 契约转换后的校验对象，同一个契约只转换一次，contract 为契约的json字符串 """
+    return change_pact_json_to_obj(json.loads(contract), separator='@')
+
+
 def _01equals(check_value, expect_value):
     """ 相等 """
     assert check_value == expect_value, '断言不通过，断言方式为相等'
@@ -53,9 +66,8 @@ def _03json_equals(check_value, expect_value):
 def _04contract_equals(check_value, expect_value):
     """ 契约校验 """
     # 详见：https://pypi.org/project/pactverify/
-    if isinstance(expect_value, str):
-        expect_value = json.loads(expect_value)
-    pact_json_verify = PactJsonVerify(expect_value, hard_mode=True, separator='@')
+    contract = expect_value if isinstance(expect_value, str) else json.dumps(expect_value, ensure_ascii=False)
+    pact_json_verify = PactVerify(get_contract_matcher(contract), hard_mode=True)  # 校验结果记录在校验器上，每次新建
     pact_json_verify.verify(check_value)  # 校验实际返回数据
     assert pact_json_verify.verify_result is True, json.dumps(pact_json_verify.verify_info, ensure_ascii=False,
                                                               indent=4)
@@ -359,4 +371,4 @@ def _25regex_match(check_value, expect_value):
     """ 正则匹配 """
     assert isinstance(expect_value, basestring)
     assert isinstance(check_value, basestring)
-    assert re.match(expect_value, check_value)
+    assert get_compiled_regex(expect_value).match(check_value)
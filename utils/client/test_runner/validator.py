@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 import types
+from collections import OrderedDict
+from threading import Lock
 
+from . import function_registry, parser, template
 from utils.variables.runner import extract_exp_start
 from utils.variables.regexp import text_extractor_regexp_compile
 
+compiled_validator_cache_size = 1024  # 编译后的断言最多缓存的数量
+_compiled_validator_cache = OrderedDict()
+_compiled_validator_cache_lock = Lock()
+
 
 def is_function(item):
     """ 判断传进来的 item对象 是否为函数 """
@@ -20,3 +27,59 @@ def is_const(variable):
 def is_extract_expression(expression):
     """ 判断字符串是否为提取表达式 """
     return text_extractor_regexp_compile.match(expression) or expression.startswith(extract_exp_start)
+
+
+class CompiledValidator:
+    """ 编译后的接口断言，断言数据格式的解析、实际结果的取值方式、断言方法的查找，同一个断言定义只做一次
+    check_type:
+        eval: 变量引用、函数引用、dict/list，取值时解析变量和函数，如 $token、${is_status_code_200($status_code)}
+        extract: 正则表达式或提取表达式，从响应中提取，如 "headers.content-type"、"LB[\d]*(.*)RB[\d]*"
+        const: 原样作为实际结果
+    """
+    __slots__ = ("parsed_validator", "check_type", "builtin_validate_func")
+
+    def __init__(self, validator):
+        self.parsed_validator = parser.parse_validator(validator)
+        check_item = self.parsed_validator["check"]
+        if isinstance(check_item, (dict, list)) \
+                or parser.extract_variables(check_item) \
+                or parser.extract_functions(check_item):
+            self.check_type = "eval"
+        elif text_extractor_regexp_compile.match(check_item) or check_item.startswith(("content", "headers", "cookies")):
+            self.check_type = "extract"
+        else:
+            self.check_type = "const"
+        self.builtin_validate_func = function_registry.get_builtin_functions().get(self.parsed_validator["comparator"])
+
+    def get_validate_func(self, functions_mapping):
+        """ 断言方法，自定义函数中有同名函数时以自定义函数为准 """
+        comparator = self.parsed_validator["comparator"]
+        if comparator in functions_mapping:
+            return functions_mapping[comparator]
+        return self.builtin_validate_func or function_registry.get_function(comparator, functions_mapping)
+
+    def new_validator_dict(self):
+        """ 每次执行断言都用新的dict记录断言结果 """
+        return dict(self.parsed_validator)
+
+
+def compile_validator(validator):
+    """ 获取编译后的断言，有缓存则直接用缓存，以断言内容的hash为key """
+    content_hash = template.get_content_hash(validator)
+    with _compiled_validator_cache_lock:
+        compiled_validator = _compiled_validator_cache.get(content_hash)
+        if compiled_validator is not None:
+            _compiled_validator_cache.move_to_end(content_hash)
+            return compiled_validator
+
+    compiled_validator = CompiledValidator(validator)
+    with _compiled_validator_cache_lock:
+        _compiled_validator_cache[content_hash] = compiled_validator
+        while len(_compiled_validator_cache) > compiled_validator_cache_size:
+            _compiled_validator_cache.popitem(last=False)
+    return compiled_validator
+
+
+def prepare_validators(validators):
+    """ 把步骤的断言列表转为执行时使用的列表，接口断言替换为编译后的断言，UI断言已经解析过了，原样保留 """
+    return [compile_validator(validator) if validator.get("check") is None else validator for validator in validators]
@@ -6,6 +6,10 @@ class RedirectPrintLogToMemory:
 
     def __init__(self):
         self.text = ""
+        self.redirect_to_memory()
+
+    def redirect_to_memory(self):
+        """ 重定向输出到当前对象 """
         sys.stdout = self
 
     def write(self, out_stream):
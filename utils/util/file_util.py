@@ -4,6 +4,7 @@ import os
 import io
 import platform
 import shutil
+import threading
 
 from config import _basedir as basedir
 from utils.variables.content_type import CONTENT_TYPE
@@ -78,12 +79,36 @@ class FileUtil:
         with io.open(os.path.join(DIFF_RESULT, f'{diff_record_id}.json'), "w", encoding="utf-8") as fp:
             json.dump(diff_detail, fp, ensure_ascii=False, indent=4)
 
+    @classmethod
+    def build_script_data(cls, content, env="debug"):
+        """ 自定义函数文件的完整内容，默认在第一行加上运行环境 """
+        return "# coding:utf-8\n\n" + f'env = "{env}"\n\n' + (content or '')
+
+    @classmethod
+    def get_script_path(cls, name):
+        """ 自定义函数文件的路径 """
+        return os.path.join(SCRIPT_ADDRESS, f'{name}.py')
+
+    @classmethod
+    def get_script_mtime(cls, name):
+        """ 自定义函数文件的修改时间，文件不存在返回None """
+        try:
+            return os.stat(cls.get_script_path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     @classmethod
     def save_script_data(cls, name, content, env="debug"):
-        """ 保存自定义函数数据 """
-        content = content or ''
-        func_data = "# coding:utf-8\n\n" + f'env = "{env}"\n\n' + content
-        cls.save_file(os.path.join(SCRIPT_ADDRESS, f'{name}.py'), func_data)
+        """ 保存自定义函数数据，内容没变则不重新写入，先写临时文件再替换，避免并发执行时读到写了一半的文件 """
+        func_data = cls.build_script_data(content, env)
+        path = cls.get_script_path(name)
+        if os.path.exists(path):
+            with io.open(path, "r", encoding="utf-8") as file:
+                if file.read() == func_data:
+                    return
+        temp_path = f'{path}.{os.getpid()}_{threading.get_ident()}.tmp'
+        cls.save_file(temp_path, func_data)
+        os.replace(temp_path, path)
 
     @classmethod
     def make_mock_script(cls, name, content, path={}, headers={}, query={}, body={}):
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+
+from flask import Response, current_app
+
+from utils.logs.log import logger
+
+
+class ReportEventUtil:
+    """ 测试报告执行状态的事件，执行过程中状态有变更时发布事件，查看报告的页面通过SSE订阅，只接收有变化的部分
+    事件写入数据库的事件表(system_report_event)，执行节点和web节点不在同一台机器上也能读到：
+        同一个进程内的订阅者通过 Condition 立即唤醒，其他进程/节点的订阅者每 poll_interval 秒查一次有没有新事件
+    事件表的自增id作为事件id，断线重连时浏览器会带上 Last-Event-ID，从这个id之后继续读
+    事件只用于执行过程中实时展示，超过 keep_hours 小时的由发布事件的进程顺带删除，报告删除时一起删除
+    """
+    poll_interval = 0.5  # 检查其他进程发布的事件的间隔（秒）
+    heartbeat_interval = 15  # 没有事件时发送心跳的间隔（秒），防止连接被代理断开
+    stream_time_out = 30 * 60  # 一个SSE连接最长保持的时间（秒），超时后浏览器会自动重连
+    keep_hours = 24  # 事件保留的时间（小时）
+    clean_interval = 10 * 60  # 同一个进程删除过期事件的间隔（秒）
+    _condition = threading.Condition()
+    _last_clean_time = 0
+
+    @classmethod
+    def get_model(cls):
+        from apps.system.model_factory import ReportEvent
+        return ReportEvent
+
+    @classmethod
+    def get_channel(cls, table_name, report_id):
+        """ 事件频道，报告、报告用例、报告步骤都发布到报告所在的频道，如 api_test_report_step => api_test_report_1 """
+        for suffix in ("_case", "_step"):
+            if table_name.endswith(suffix):
+                table_name = table_name[:-len(suffix)]
+        return f'{table_name}_{report_id}'
+
+    @classmethod
+    def publish(cls, table_name, report_id, event: dict):
+        """ 发布事件，发布失败不影响测试执行 """
+        try:
+            cls.get_model().add_event(
+                cls.get_channel(table_name, report_id), json.loads(json.dumps(event, default=str)))
+            with cls._condition:
+                cls._condition.notify_all()
+            cls.clean_expire_events()
+        except Exception as error:
+            logger.error(f'发布测试报告事件失败：{error}')
+
+    @classmethod
+    def clean_expire_events(cls):
+        """ 删除过期的事件，同一个进程每 clean_interval 秒最多删一次 """
+        if time.time() - cls._last_clean_time < cls.clean_interval:
+            return
+        cls._last_clean_time = time.time()
+        delete_count = cls.get_model().delete_expire(cls.keep_hours)
+        if delete_count:
+            logger.info(f'删除了{delete_count}条过期的测试报告事件')
+
+    @classmethod
+    def read_events(cls, channel, offset=0):
+        """ 读取事件id大于 offset 的事件，返回 [(事件id, 事件)] """
+        return cls.get_model().get_event_list(channel, offset)
+
+    @classmethod
+    def wait(cls, timeout):
+        """ 等待本进程内有新事件发布，或者超时 """
+        with cls._condition:
+            cls._condition.wait(timeout)
+
+    @classmethod
+    def subscribe(cls, app, table_name, report_id, offset=0, time_out=None):
+        """ 订阅报告的事件，返回 (事件id, 事件) 的生成器，超时没有事件时返回 (事件id, None)，便于调用方做心跳
+        每次读取都在新的app上下文中查询，读完即归还数据库连接，SSE连接保持期间不占用连接
+        """
+        channel = cls.get_channel(table_name, report_id)
+        end_time = time.time() + (time_out or cls.stream_time_out)
+        while time.time() < end_time:
+            with app.app_context():
+                event_list = cls.read_events(channel, offset)
+            for offset, event in event_list:
+                yield offset, event
+            if not event_list:
+                yield offset, None
+            cls.wait(cls.poll_interval)
+
+    @classmethod
+    def is_finish_event(cls, event):
+        """ 报告写入完毕（进度3，状态2）的事件 """
+        return event.get("type") == "report" and event.get("process") == 3 and event.get("status") == 2
+
+    @classmethod
+    def stream(cls, app, table_name, report_id, offset=0):
+        """ 把事件转为SSE格式，报告写入完毕后结束 """
+        yield "retry: 3000\n\n"
+        last_send_time = time.time()
+        for offset, event in cls.subscribe(app, table_name, report_id, offset):
+            if event is None:
+                if time.time() - last_send_time >= cls.heartbeat_interval:
+                    last_send_time = time.time()
+                    yield ": ping\n\n"
+                continue
+            last_send_time = time.time()
+            yield f'id: {offset}\nevent: {event["type"]}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+            if cls.is_finish_event(event):
+                return
+
+    @classmethod
+    def make_sse_response(cls, table_name, report_id, last_event_id=None):
+        """ 返回SSE响应，第一次连接时从头推送当前报告已有的所有事件，断线重连时从 Last-Event-ID 继续推送 """
+        offset = int(last_event_id) if last_event_id and str(last_event_id).isdigit() else 0
+        app = current_app._get_current_object()
+        return Response(cls.stream(app, table_name, report_id, offset), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # nginx 不缓冲，事件立即推送
+        })
+
+    @classmethod
+    def delete_events(cls, table_name, report_id_list):
+        """ 删除报告的事件 """
+        if report_id_list:
+            cls.get_model().delete_by_channel(
+                [cls.get_channel(table_name, report_id) for report_id in report_id_list])